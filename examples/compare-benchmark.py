@@ -0,0 +1,84 @@
+#! /usr/bin/env python3
+
+####################################################################################################
+#
+# filewalker — ...
+# Copyright (C) 2024 Fabrice Salvaire
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+####################################################################################################
+
+"""Benchmark the file comparers against cmp.
+
+Usage::
+
+    compare-benchmark.py FILE1 FILE2
+    compare-benchmark.py --size 1024  # MiB, compare two temporary identical files
+
+Run it twice or drop the page cache to measure a cold cache.
+
+"""
+
+####################################################################################################
+
+import argparse
+import os
+import tempfile
+import time
+from pathlib import Path
+
+from filewalker.path.compare import FileComparer
+from filewalker.path.file import File
+
+####################################################################################################
+
+parser = argparse.ArgumentParser(description='Benchmark the file comparers against cmp')
+parser.add_argument('paths', nargs='*')
+parser.add_argument('--size', type=int, default=256, help="size of the temporary files in MiB")
+parser.add_argument('--repeat', type=int, default=3)
+args = parser.parse_args()
+
+####################################################################################################
+
+def benchmark(path1: Path, path2: Path) -> None:
+    file1 = File.from_path(path1)
+    file2 = File.from_path(path2)
+    size = file1.size
+    methods = {
+        'mmap': FileComparer(use_mmap=True).compare,
+        'readinto': FileComparer(use_mmap=False).compare,
+        'cmp': lambda file1, file2: file1.compare_with(file2, posix=True),
+    }
+    print(f"Compare {size / 1024**2:.0f} MiB")
+    for name, method in methods.items():
+        timings = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            result = method(file1, file2)
+            timings.append(time.perf_counter() - start)
+        best = min(timings)
+        print(f"  {name:10} {result!s:5} {best * 1000:8.1f} ms {size / 1024**2 / best:8.0f} MiB/s")
+
+if args.paths:
+    benchmark(*[Path(_) for _ in args.paths[:2]])
+else:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        paths = [Path(tmp_dir, _) for _ in ('file1', 'file2')]
+        data = os.urandom(1024**2)
+        for path in paths:
+            with open(path, 'wb') as fh:
+                for _ in range(args.size):
+                    fh.write(data)
+        benchmark(*paths)
@@ -22,11 +22,18 @@ __all__ = ['DuplicateFinder']
 
 ####################################################################################################
 
+from contextlib import contextmanager
+from itertools import islice
 from operator import attrgetter
 from pathlib import Path
-from typing import AnyStr, Type, Union
+from typing import AnyStr, Iterator, List, Optional, Sequence, Tuple, Type, Union
 import logging
+import os
 
+from filewalker.common.checkpoint import Checkpoint
+from filewalker.common.hashing import check_backend, get_backend
+from filewalker.os import statx as _statx
+from filewalker.path.cache import DirectoryCache
 from filewalker.path.file import File
 from filewalker.path.walker import WalkerAbc
 from .DuplicateSet import DuplicateSet, DuplicateSetIt, DuplicatePool
@@ -47,7 +54,7 @@ class DuplicateFinder(WalkerAbc):
     - eliminate singleton
     - eliminate candidates based on first bytes
     - eliminate candidates based on last bytes
-    - eliminate candidates based on sha1
+    - eliminate candidates based on a checksum, sha1 by default
     """
 
     _logger = _module_logger.getChild('DuplicateFinder')
@@ -56,51 +63,101 @@ class DuplicateFinder(WalkerAbc):
 
     # Fixme: cleaner
 
+    # fields fetched by statx during the walk: register_file, make_size_map and remove_nonunique_inode
+    STATX_MASK = _statx.STATX_TYPE | _statx.STATX_SIZE | _statx.STATX_INO
+
+    # the files up to this size are hashed when their first bytes are read, see _first_bytes
+    EAGER_SHA_SIZE = 64 * 1024
+
+    # stages after the walk, by name, message and method
+    STAGES = (
+        # Fixme: ok ??? same size, same first bytes but followings...
+        ('first_bytes', "first bytes", 'remove_different_first_byte'),
+        ('last_bytes', "last bytes", 'remove_different_last_byte'),
+        ('sha', "{hash} checksum", 'remove_different_sha'),
+    )
+
+    ##############################################
+
     @classmethod
     def find_duplicate(
             cls,
             path: Union[AnyStr, Path],
             fast_io: bool = False,
+            workers: int = 1,
+            checkpoint: Optional[Union[AnyStr, Path, Checkpoint]] = None,
+            **kwargs,
     ) -> Type['Cleaner']:
-        obj = cls(path)
-        print(f'Now scanning "{obj.path}"')
-        obj.run(top_down=False, sort=False, follow_links=False)
-
-        obj.make_size_map()
-
-        #! p = ""
-        #! print("Check: ", obj.has_path(p))
+        """Find duplicates in *path*, *kwargs* are the walk options, see
+        :class:`filewalker.path.walker.WalkOptions`.
 
-        old_file_count = obj.count()
-        print(f"Now have {old_file_count} files in total.")
-        # Total size is xxx bytes or xxx GiB
+        If the option *throttle* is set, it is also used to throttle the file reads of all the
+        stages, see :attr:`File.THROTTLE`.
 
-        def report(old_file_count):
-            file_count = obj.count()
-            print(f"removed {old_file_count - file_count} files from list. {file_count} files left.")
-            return file_count
+        If the option *statx* is set, the metadata are fetched by statx and only the fields used
+        by the stages are requested, see :meth:`File.fetch_stat`.  The option *dont_sync* adds the
+        flag ``AT_STATX_DONT_SYNC`` so that a network file system can answer from its cache.
 
-        obj.remove_unique_size()
-        file_count = obj.count()
-        print(f"Removed {old_file_count - file_count} files due to unique sizes from list. {file_count} files left.")
-        old_file_count = file_count
+        The option *hash* is the name of the checksum backend, see :mod:`filewalker.common.hashing`,
+        :code:`'auto'` selects the fastest cryptographic backend on this CPU and :code:`'auto-fast'`
+        the fastest backend, e.g. xxhash if it is installed.
 
-        # Fixme: ok ??? same size, same first bytes but followings...
-        print("Now eliminating candidates based on first bytes:")
-        obj.remove_different_first_byte(fast_io)
-        old_file_count = report(old_file_count)
+        The option *cache* can be the path of a :class:`filewalker.path.cache.DirectoryCache`, it is
+        then loaded before the walk and saved after.
 
-        print("Now eliminating candidates based on last bytes:")
-        obj.remove_different_last_byte(fast_io)
-        old_file_count = report(old_file_count)
+        If *checkpoint* is set, a :class:`filewalker.common.checkpoint.Checkpoint` or its path, the
+        state is saved periodically and the scan can be continued by :meth:`resume`.  The walk is
+        then top-down and, if *workers* > 1, only the stages are checkpointed.  The checkpoint is
+        removed when the scan is completed.
 
-        print("Now eliminating candidates based on sha1 checksum:")
-        obj.remove_different_sha(fast_io)
-        old_file_count = report(old_file_count)
+        """
+        obj = cls(path)
+        obj._set_checkpoint(checkpoint)
+        print(f'Now scanning {", ".join(f"{_}" for _ in obj.roots)}')
+        with obj._install_file_options(kwargs):
+            obj._walk(workers, **kwargs)
+            obj._run_stages(fast_io)
+        return obj
 
-        print(f"It seems like you have {old_file_count} files that are not unique")
-        # Totally, 822 MiB can be reduced.
+    ##############################################
 
+    @classmethod
+    def resume(
+            cls,
+            checkpoint: Union[AnyStr, Path, Checkpoint],
+            fast_io: bool = False,
+            workers: int = 1,
+            **kwargs,
+    ) -> Type['Cleaner']:
+        """Continue the scan saved in *checkpoint*, the arguments must match those given to
+        :meth:`find_duplicate`.  The hash backend of the checkpoint is used, another *hash* option
+        raises :exc:`filewalker.common.hashing.IncompatibleHashBackend`.
+
+        """
+        if not isinstance(checkpoint, Checkpoint):
+            checkpoint = Checkpoint(checkpoint)
+        state = checkpoint.load()
+        if state is None:
+            raise ValueError(f"No checkpoint {os.fsdecode(checkpoint.path)}")
+        # checkpoints of a previous version were made with sha1
+        hash_backend = state.get('hash_backend', 'sha1')
+        if kwargs.get('hash') is not None:
+            check_backend(get_backend(kwargs['hash']).name, hash_backend)
+        kwargs['hash'] = hash_backend
+        obj = cls(state['paths'])
+        obj._set_checkpoint(checkpoint)
+        stage = state['stage']
+        print(f'Now resuming "{obj.path}" at stage {stage}')
+        with obj._install_file_options(kwargs):
+            if stage == 'walk':
+                obj._files = state['files']
+                obj._walk(workers, frontier=state['frontier'], **kwargs)
+                obj._run_stages(fast_io)
+            else:
+                obj._pool = state['pool']
+                obj._hard_links = state['hard_links']
+                obj._resumed_stage = state['new_pool'], state['position']
+                obj._run_stages(fast_io, stage)
         return obj
 
     ##############################################
@@ -110,22 +167,177 @@ class DuplicateFinder(WalkerAbc):
             cls,
             path: Union[AnyStr, Path],
             fast_io: bool = False,
+            workers: int = 1,
+            **kwargs,
     ) -> DuplicatePool:
-        obj = cls.find_duplicate(path, fast_io)
-        return DuplicatePool(it=obj.duplicate_iter())
+        obj = cls.find_duplicate(path, fast_io, workers, **kwargs)
+        return DuplicatePool(it=obj.duplicate_iter(), hash_backend=obj.hash_backend)
+
+    ##############################################
+
+    @contextmanager
+    def _install_file_options(self, kwargs: dict) -> Iterator[None]:
+        """Install the *throttle* option as :attr:`File.THROTTLE`, the *statx* and *dont_sync*
+        options as :attr:`File.USE_STATX` and :attr:`File.STATX_FLAGS`, and the *hash* option as
+        :attr:`File.HASH_BACKEND`.
+
+        """
+        # these options are not walk options
+        use_statx = kwargs.pop('statx', False)
+        dont_sync = kwargs.pop('dont_sync', False)
+        hash_backend = kwargs.pop('hash', None)
+        self._use_statx = use_statx
+        previous = File.THROTTLE, File.USE_STATX, File.STATX_FLAGS, File.HASH_BACKEND
+        throttle = kwargs.get('throttle')
+        if throttle is not None:
+            File.THROTTLE = throttle
+        if hash_backend is not None:
+            File.HASH_BACKEND = get_backend(hash_backend)
+        self._hash_backend = File.HASH_BACKEND.name
+        if use_statx:
+            File.USE_STATX = True
+            # no effect on a local file system
+            File.STATX_FLAGS = _statx.AT_STATX_DONT_SYNC if dont_sync else 0
+        try:
+            yield
+        finally:
+            File.THROTTLE, File.USE_STATX, File.STATX_FLAGS, File.HASH_BACKEND = previous
+
+    ##############################################
+
+    def _set_checkpoint(self, checkpoint: Optional[Union[AnyStr, Path, Checkpoint]]) -> None:
+        if checkpoint is not None and not isinstance(checkpoint, Checkpoint):
+            checkpoint = Checkpoint(checkpoint)
+        self._checkpoint = checkpoint
 
     ##############################################
 
-    def __init__(self, path: Union[AnyStr, Path]) -> None:
+    def _save_checkpoint(self, stage: str, **state) -> None:
+        self._checkpoint.save(dict(
+            state,
+            paths=[str(_) for _ in self.roots],
+            stage=stage,
+            hard_links=self._hard_links,
+            hash_backend=self._hash_backend,
+        ))
+
+    ##############################################
+
+    def _walk(self, workers: int = 1, frontier: Optional[List[Tuple[bytes, int]]] = None, **kwargs) -> None:
+        # the workers lstat the files, on_filename is serialized
+        #  statx fetches less fields than the lstat of the prefetch
+        kwargs.setdefault('prefetch_stat', workers > 1 and not self._use_statx)
+        if not kwargs['prefetch_stat']:
+            # else the walker accounts for the lstat calls
+            self._throttle = kwargs.get('throttle')
+        cache = kwargs.get('cache')
+        save_cache = isinstance(cache, (str, bytes, Path))
+        if save_cache:
+            cache = kwargs['cache'] = DirectoryCache.load(cache)
+        # only a serial top-down walk has a frontier to be saved
+        top_down = self._checkpoint is not None and workers == 1
+        self.run(top_down=top_down, workers=workers, frontier=frontier, **kwargs)
+        if cache is not None:
+            print(f"Reused {cache.reused} directories, read {len(cache.revisited)} directories again.")
+            for dirpath in cache.revisited_subtrees():
+                self._logger.info(f"Revisited {os.fsdecode(dirpath)}")
+            if save_cache:
+                cache.save()
+
+    ##############################################
+
+    def on_frontier(self, frontier: List[Tuple[bytes, int]]) -> None:
+        if self._checkpoint is not None and self._checkpoint.due():
+            self._save_checkpoint('walk', frontier=list(frontier), files=self._files)
+
+    ##############################################
+
+    def _run_stages(self, fast_io: bool = False, stage: Optional[str] = None) -> None:
+        """Run the stages after the walk, or from *stage* to resume a scan"""
+        if stage is None:
+            self.make_size_map()
+
+            #! p = ""
+            #! print("Check: ", obj.has_path(p))
+
+            old_file_count = self.count()
+            print(f"Now have {old_file_count} files in total.")
+            # Total size is xxx bytes or xxx GiB
+
+            self.remove_nonunique_inode()
+            file_count = self.count()
+            print(f"Removed {old_file_count - file_count} files due to nonunique device and inode.")
+            old_file_count = file_count
+
+            self.remove_unique_size()
+            file_count = self.count()
+            print(
+                f"Removed {old_file_count - file_count} files due to unique sizes from list. {file_count} files left."
+            )
+            old_file_count = file_count
+            stages = self.STAGES
+        else:
+            old_file_count = self.count()
+            stages = self.STAGES[[_[0] for _ in self.STAGES].index(stage):]
+
+        for name, message, method in stages:
+            print(f"Now eliminating candidates based on {message.format(hash=File.HASH_BACKEND.name)}:")
+            self._stage = name
+            getattr(self, method)(fast_io)
+            file_count = self.count()
+            print(f"removed {old_file_count - file_count} files from list. {file_count} files left.")
+            old_file_count = file_count
+
+        print(f"It seems like you have {old_file_count} files that are not unique")
+        # Totally, 822 MiB can be reduced.
+
+        if self._checkpoint is not None:
+            self._checkpoint.remove()
+
+    ##############################################
+
+    def __init__(self, path: Union[AnyStr, Path, Sequence[Union[AnyStr, Path]]]) -> None:
         super().__init__(path)
         self._files = []   # : [File]
         self._pool = None   # : [[File]] grouped by size
+        self._throttle = None
+        self._use_statx = False
+        self._hash_backend = File.HASH_BACKEND.name
+        self._checkpoint = None
+        # current stage and, when resumed, its pool and position
+        self._stage = None
+        self._resumed_stage = None
+        # hard links removed from the pool by inode key
+        self._hard_links = {}
+        # last directory and its location, see WalkerAbc.locate
+        self._location = (None, None)
+
+    ##############################################
+
+    @property
+    def hash_backend(self) -> str:
+        """Name of the hash backend of the checksums"""
+        return self._hash_backend
 
     ##############################################
 
-    def on_filename(self, dirpath: bytes, path: bytes) -> None:
-        file_obj = File(dirpath, path)
+    def on_filename(self, dirpath: bytes, entry: os.DirEntry) -> None:
+        # d_type is enough to skip symlinks without a stat
+        if entry.is_symlink():
+            return
+        if self._use_statx:
+            file_obj = File(dirpath, entry.name, getattr(entry, 'handle', None))
+            file_obj.fetch_stat(self.STATX_MASK)
+        else:
+            file_obj = File.from_dir_entry(dirpath, entry)
+        if self._throttle is not None:
+            # the device is known once the stat is done, the debt delays the next one
+            self._throttle.metadata(1, file_obj.device)
         if self.register_file(file_obj):
+            # the files of a directory are consecutive
+            if self._location[0] != dirpath:
+                self._location = dirpath, self.locate(dirpath)
+            file_obj.priority, file_obj.depth = self._location[1]
             self._files.append(file_obj)
 
     ##############################################
@@ -145,7 +357,11 @@ class DuplicateFinder(WalkerAbc):
     #     return iter(self._files)
 
     def duplicate_iter(self) -> DuplicateSetIt:
-        return iter([DuplicateSet(_) for _ in self._pool])
+        """Yield the duplicate sets, the first file is the original, see :meth:`DuplicateSet.sort`"""
+        for file_objs in self._pool:
+            duplicate_set = DuplicateSet(file_objs)
+            duplicate_set.sort(sorting='rank')
+            yield duplicate_set
 
     ##############################################
 
@@ -154,8 +370,13 @@ class DuplicateFinder(WalkerAbc):
 
     ##############################################
 
+    @staticmethod
+    def _inode_key(file_obj: File) -> int:
+        # an int is more compact and faster to compare than a tuple
+        return (file_obj.device << 64) + file_obj.inode
+
     def sort_file_by_inode(self) -> None:
-        self._files.sort(key=lambda file_obj: (file_obj.device << 64) + file_obj.inode)
+        self._files.sort(key=self._inode_key)
 
     ##############################################
 
@@ -201,7 +422,49 @@ class DuplicateFinder(WalkerAbc):
     ##############################################
 
     def remove_nonunique_inode(self) -> int:
-        raise NotImplementedError
+        """Keep a single file per inode in each size group, the other hard links are removed and
+        registered, see :meth:`hard_links`.  Thus an inode is read once.
+
+        """
+        inode_key = self._inode_key
+        new_pool = []
+        remove_count = 0
+        for file_objs in self._pool:
+            if len(file_objs) > 1:
+                # sort by inode, the links of an inode are adjacent
+                file_objs = sorted(file_objs, key=inode_key)
+                kept = []
+                previous_key = None
+                for file_obj in file_objs:
+                    key = inode_key(file_obj)
+                    if key == previous_key:
+                        self._hard_links.setdefault(key, [kept[-1]]).append(file_obj)
+                        remove_count += 1
+                    else:
+                        kept.append(file_obj)
+                        previous_key = key
+                file_objs = kept
+            new_pool.append(file_objs)
+        self._pool = new_pool
+        return remove_count
+
+    ##############################################
+
+    def hard_links(self, file_obj: File) -> List[File]:
+        """Return the files which are hard links to the inode of *file_obj*, including the file
+        kept by :meth:`remove_nonunique_inode`.
+
+        """
+        return self._hard_links.get(self._inode_key(file_obj), [file_obj])
+
+    ##############################################
+
+    def hard_link_groups(self) -> Iterator[List[File]]:
+        """Yield the groups of hard links removed by :meth:`remove_nonunique_inode`, the first file
+        is kept.
+
+        """
+        return iter(self._hard_links.values())
 
     ##############################################
 
@@ -222,9 +485,11 @@ class DuplicateFinder(WalkerAbc):
     ##############################################
 
     def _remove_different_feature_impl(self, method) -> int:
-        new_pool = []
+        new_pool, position = self._resumed_stage or ([], 0)
+        self._resumed_stage = None
         remove_count = 0
-        for file_objs in self._pool:
+        checkpoint = self._checkpoint
+        for index, file_objs in enumerate(islice(self._pool, position, None), position):
             # We split the file set to uniq feature sets and remove singletons
             features = [method(_) for _ in file_objs]
             unique_features = tuple(set(features))
@@ -241,6 +506,9 @@ class DuplicateFinder(WalkerAbc):
             for _ in pool.values():
                 if _:
                     new_pool.append(_)
+            if checkpoint is not None and self._stage is not None and checkpoint.due():
+                # the groups before position have passed this stage
+                self._save_checkpoint(self._stage, pool=self._pool, new_pool=new_pool, position=index + 1)
         self._pool = new_pool
         return remove_count
 
@@ -255,8 +523,13 @@ class DuplicateFinder(WalkerAbc):
 
     ##############################################
 
+    def _first_bytes(self, file_obj: File) -> bytes:
+        # read the features of the next stages in the same session, a small file is read at once
+        file_obj.extract_features(first=True, last=True, sha=file_obj.size <= self.EAGER_SHA_SIZE)
+        return file_obj.first_bytes()
+
     def remove_different_first_byte(self, fast_io: bool = False) -> int:
-        return self.remove_different_feature(File.first_bytes, fast_io)
+        return self.remove_different_feature(self._first_bytes, fast_io)
 
     def remove_different_last_byte(self, fast_io: bool = False) -> int:
         return self.remove_different_feature(File.last_bytes, fast_io)
@@ -30,11 +30,12 @@ __all__ = [
 ####################################################################################################
 
 from pathlib import Path
-from typing import AnyStr, Iterator, List, Set, Union, Generator
+from typing import AnyStr, Iterator, List, Optional, Set, Union, Generator
 import json
 import logging
 import os
 
+from filewalker.path.compare import partition_files
 from filewalker.path.file import File
 
 ####################################################################################################
@@ -578,6 +579,10 @@ class DuplicateSet(MarkMixin):
                 raise NameError(f"Name length {_} > {SCALE}")
             return len(str(_.parent)) * SCALE + n
 
+        def by_rank(_):
+            # like rdfind: root priority, depth, then path
+            return _.file.priority, _.file.depth, _.path_str
+
         if sorting is not None:
             match sorting:
                 case 'path':
@@ -588,6 +593,8 @@ class DuplicateSet(MarkMixin):
                     key = by_name_length
                 case 'parent_length':
                     key = by_parent_length
+                case 'rank':
+                    key = by_rank
                 case _:
                     raise ValueError(f"unknow sorting '{sorting}'")
         elif key is None:
@@ -668,11 +675,15 @@ class DuplicateSet(MarkMixin):
     ##############################################
 
     def check_is_duplicate(self) -> bool:
-        ref = self.first
-        for _ in self.followings:
-            self._logger.debug(f"{LINESEP}{ref}{LINESEP}{_}")
-            if not ref.compare_with(_):
-                return False
+        """Return True if the pending files, the first and the following ones, have the same content.
+        The files are read once in lockstep, see :func:`filewalker.path.compare.partition_files`.
+
+        """
+        partitions = partition_files([_.file for _ in self.pendings])
+        if len(partitions) > 1:
+            for _ in partitions:
+                self._logger.debug(f"Partition:{LINESEP}{LINESEP.join(str(file_obj) for file_obj in _)}")
+            return False
         return True
 
     ##############################################
@@ -700,7 +711,13 @@ type DuplicateSetIt = Iterator[DuplicateSet]
 class DuplicatePool:
 
     # Fixme: naming...
-    """Class to implements a pool of set of duplicated files (DuplicateSet)."""
+    """Class to implements a pool of set of duplicated files (DuplicateSet).
+
+    *hash_backend* is the name of the hash backend used to find the duplicates, if it is known.  It
+    is recorded in the JSON file for information, the pools only hold paths, thus pools found with
+    different backends can be compared.
+
+    """
 
     _logger = _module_logger.getChild('DuplicatePool')
 
@@ -711,6 +728,10 @@ class DuplicatePool:
         pool = cls()
         with open(path, 'r', encoding="utf-8") as fh:
             data = json.load(fh)
+            # a previous version only saved the list of duplicates
+            if isinstance(data, dict):
+                pool.hash_backend = data.get('hash_backend')
+                data = data['duplicates']
             for _ in data:
                 pool.add_from_paths(_)
         return pool
@@ -718,16 +739,17 @@ class DuplicatePool:
     ##############################################
 
     @classmethod
-    def new_from_paths(cls, paths: ByteListIt) -> 'DuplicatePool':
-        pool = cls()
+    def new_from_paths(cls, paths: ByteListIt, hash_backend: Optional[str] = None) -> 'DuplicatePool':
+        pool = cls(hash_backend=hash_backend)
         for _ in paths:
             pool.add_from_paths(_)
         return pool
 
     ##############################################
 
-    def __init__(self, it: DuplicateSetIt = None) -> None:
+    def __init__(self, it: DuplicateSetIt = None, hash_backend: Optional[str] = None) -> None:
         self._pool = []
+        self.hash_backend = hash_backend
         if it is not None:
             self.fill(it)
 
@@ -740,7 +762,7 @@ class DuplicatePool:
         self._pool.append(duplicate)
 
     def add_from_paths(self, paths: ByteList) -> None:
-        self.add(DuplicateSet.new_from_paths(paths))
+        self.add(DuplicateSet.new_from_str(paths))
 
     ##############################################
 
@@ -800,6 +822,8 @@ class DuplicatePool:
             data = [_.paths_str for _ in self if not _.is_singleton]
         else:
             data = [_.paths_str for _ in self]
+        if self.hash_backend is not None:
+            data = {'hash_backend': self.hash_backend, 'duplicates': data}
         return json.dumps(data, indent=4)
 
     ##############################################
@@ -0,0 +1,129 @@
+####################################################################################################
+#
+# filewalker — ...
+# Copyright (C) 2020 Fabrice Salvaire
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+####################################################################################################
+####################################################################################################
+
+"""Module to save the state of a long-running task periodically, thus it can be resumed after a crash
+or a reboot.
+
+"""
+
+####################################################################################################
+
+__all__ = ['Checkpoint']
+
+####################################################################################################
+
+from pathlib import Path
+from typing import Any, AnyStr, Dict, Optional, Union
+import logging
+import os
+import pickle
+import time
+
+####################################################################################################
+
+_module_logger = logging.getLogger(__name__)
+
+####################################################################################################
+
+class Checkpoint:
+
+    """Class to save a state to a local file at most every *interval* seconds.
+
+    The state is a picklable dictionary, the file is replaced atomically, thus a crash during a save
+    keeps the previous checkpoint.
+
+    Usage::
+
+        checkpoint = Checkpoint('scan.checkpoint', interval=300)
+        for item in items:
+            ...
+            if checkpoint.due():
+                checkpoint.save({'position': position})
+
+    """
+
+    _logger = _module_logger.getChild('Checkpoint')
+
+    VERSION = 1
+
+    ##############################################
+
+    def __init__(self, path: Union[AnyStr, Path], interval: float = 300.) -> None:
+        self._path = os.fsencode(path)
+        self._interval = interval
+        self._last_save = time.monotonic()
+
+    ##############################################
+
+    @property
+    def path(self) -> bytes:
+        return self._path
+
+    @property
+    def interval(self) -> float:
+        return self._interval
+
+    def exists(self) -> bool:
+        return os.path.exists(self._path)
+
+    ##############################################
+
+    def due(self) -> bool:
+        """Return True if the last save is older than *interval*"""
+        return time.monotonic() - self._last_save >= self._interval
+
+    ##############################################
+
+    def save(self, state: Dict[str, Any]) -> None:
+        state = dict(state, version=self.VERSION)
+        tmp_path = self._path + b'.tmp'
+        with open(tmp_path, 'wb') as fh:
+            pickle.dump(state, fh, protocol=pickle.HIGHEST_PROTOCOL)
+            fh.flush()
+            # survive a reboot
+            os.fsync(fh.fileno())
+        os.replace(tmp_path, self._path)
+        self._last_save = time.monotonic()
+        self._logger.info(f"Saved checkpoint {os.fsdecode(self._path)} at stage {state.get('stage')}")
+
+    ##############################################
+
+    def load(self) -> Optional[Dict[str, Any]]:
+        """Return the saved state, None if there is no checkpoint.  Raise :exc:`ValueError` if the
+        checkpoint is incompatible.
+
+        """
+        try:
+            with open(self._path, 'rb') as fh:
+                state = pickle.load(fh)
+        except FileNotFoundError:
+            return None
+        if not isinstance(state, dict) or state.get('version') != self.VERSION:
+            raise ValueError(f"Incompatible checkpoint {os.fsdecode(self._path)}")
+        return state
+
+    ##############################################
+
+    def remove(self) -> None:
+        try:
+            os.remove(self._path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,221 @@
+####################################################################################################
+#
+# filewalker — ...
+# Copyright (C) 2020 Fabrice Salvaire
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+####################################################################################################
+####################################################################################################
+
+"""Module to implement a registry of hash backends.
+
+The :mod:`hashlib` algorithms are always registered, the fast non-cryptographic hashes of the
+optional `xxhash <https://pypi.org/project/xxhash>`_ package are registered if it is installed.
+:func:`benchmark` measures the throughput of the backends on the current CPU and
+:func:`fastest_backend` picks the fastest one.
+
+A checksum is only meaningful with the name of its backend, thus the checkpoints of
+:class:`filewalker.cleaner.DuplicateFinder.DuplicateFinder` record it and a scan cannot be resumed
+with another backend.  :class:`filewalker.cleaner.DuplicateSet.DuplicatePool` records it for
+information.
+
+"""
+
+####################################################################################################
+
+__all__ = [
+    'HashBackend',
+    'IncompatibleHashBackend',
+    'backends',
+    'benchmark',
+    'check_backend',
+    'fastest_backend',
+    'get_backend',
+    'register_backend',
+]
+
+####################################################################################################
+
+from typing import Any, Callable, Dict, Iterable, List, Optional
+import hashlib
+import logging
+import time
+
+####################################################################################################
+
+_module_logger = logging.getLogger(__name__)
+
+####################################################################################################
+
+class IncompatibleHashBackend(ValueError):
+    pass
+
+####################################################################################################
+
+class HashBackend:
+
+    """Class to define a hash backend, *factory* returns a new hash object which implements
+    `update` and `hexdigest` like :mod:`hashlib`.
+
+    """
+
+    __slots__ = ['name', 'factory', 'cryptographic']
+
+    ##############################################
+
+    def __init__(self, name: str, factory: Callable[[], Any], cryptographic: bool = True) -> None:
+        self.name = name
+        self.factory = factory
+        self.cryptographic = cryptographic
+
+    ##############################################
+
+    def __repr__(self) -> str:
+        return f'<HashBackend {self.name}>'
+
+    ##############################################
+
+    def new(self) -> Any:
+        return self.factory()
+
+    ##############################################
+
+    def hexdigest(self, data: bytes) -> str:
+        hasher = self.factory()
+        hasher.update(data)
+        return hasher.hexdigest()
+
+####################################################################################################
+
+_BACKENDS: Dict[str, HashBackend] = {}
+
+def register_backend(name: str, factory: Callable[[], Any], cryptographic: bool = True) -> HashBackend:
+    """Register a backend, a previous backend with the same name is replaced"""
+    backend = HashBackend(name, factory, cryptographic)
+    _BACKENDS[name] = backend
+    return backend
+
+####################################################################################################
+
+def _register_default_backends() -> None:
+    for name in (
+            'md5',
+            'sha1',
+            'sha224',
+            'sha256',
+            'sha384',
+            'sha512',
+            'sha3_256',
+            'sha3_512',
+            'blake2b',
+            'blake2s',
+    ):
+        # md5 is missing on a FIPS system
+        if name in hashlib.algorithms_available:
+            register_backend(name, getattr(hashlib, name))
+    try:
+        import xxhash
+    except ImportError:
+        return
+    for name in ('xxh64', 'xxh3_64', 'xxh3_128'):
+        factory = getattr(xxhash, name, None)
+        if factory is not None:
+            register_backend(name, factory, cryptographic=False)
+
+_register_default_backends()
+
+####################################################################################################
+
+def backends(cryptographic: Optional[bool] = None) -> List[str]:
+    """Return the names of the registered backends, or only the (non-)*cryptographic* ones"""
+    return [
+        name for name, backend in _BACKENDS.items()
+        if cryptographic is None or backend.cryptographic == cryptographic
+    ]
+
+####################################################################################################
+
+def get_backend(name: str) -> HashBackend:
+    """Return the backend *name*.
+
+    :code:`'auto'` is the fastest cryptographic backend and :code:`'auto-fast'` the fastest of all
+    the backends, including the non-cryptographic ones if they are installed.  A non-cryptographic
+    checksum is fast but its collisions can be provoked, thus the duplicates must then be compared
+    byte by byte.
+
+    """
+    if name == 'auto':
+        name = fastest_backend()
+    elif name == 'auto-fast':
+        name = fastest_backend(None)
+    try:
+        return _BACKENDS[name]
+    except KeyError:
+        raise ValueError(f"Unknown hash backend {name}, available: {', '.join(_BACKENDS)}")
+
+####################################################################################################
+
+def check_backend(name: Optional[str], other: Optional[str]) -> None:
+    """Raise :exc:`IncompatibleHashBackend` if two results were made with different backends, an
+    unknown backend, a result from a previous version, is compatible.
+
+    """
+    if name is not None and other is not None and name != other:
+        raise IncompatibleHashBackend(f"Results made with the hash backends {name} and {other} cannot be compared")
+
+####################################################################################################
+
+def benchmark(names: Optional[Iterable[str]] = None,
+              size: int = 1024**2,
+              duration: float = .05,
+              ) -> Dict[str, float]:
+    """Return the throughput in bytes/s of the backends *names*, or all the backends, to hash
+    *size* bytes buffers during at least *duration* seconds each.
+
+    """
+    if names is None:
+        names = list(_BACKENDS)
+    data = bytes(range(256)) * (size // 256)
+    throughputs = {}
+    for name in names:
+        backend = _BACKENDS[name]
+        # warm up
+        backend.hexdigest(data)
+        count = 0
+        start = time.perf_counter()
+        while True:
+            backend.hexdigest(data)
+            count += 1
+            elapsed = time.perf_counter() - start
+            if elapsed >= duration:
+                break
+        throughputs[name] = count * len(data) / elapsed
+    return throughputs
+
+####################################################################################################
+
+_fastest = {}
+
+def fastest_backend(cryptographic: Optional[bool] = True) -> str:
+    """Return the name of the fastest (non-)*cryptographic* backend on this CPU, or of all the
+    backends if *cryptographic* is None, the benchmark is run once.
+
+    """
+    if cryptographic not in _fastest:
+        throughputs = benchmark(backends(cryptographic) or backends())
+        name = max(throughputs, key=throughputs.get)
+        _module_logger.info(f"Fastest hash backend is {name} at {throughputs[name] / 1024**2:.0f} MB/s")
+        _fastest[cryptographic] = name
+    return _fastest[cryptographic]
@@ -0,0 +1,366 @@
+####################################################################################################
+#
+# filewalker — ...
+# Copyright (C) 2020 Fabrice Salvaire
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+####################################################################################################
+
+"""Module to limit the I/O rate of a scan.
+
+A scan must never freeze a computer, thus the walker, the duplicate finder and the file readers
+can share an :class:`IoThrottle` which limits the number of metadata operations (directory
+listings, stat, open) per second and the number of bytes read per second, globally and per device.
+
+The limits are implemented by token buckets.  A consumer takes its tokens immediately, possibly
+leaving the bucket in debt, and sleeps until the debt is paid back.  Thus concurrent consumers are
+served in order and a large read is not starved.
+
+Besides fixed limits, an :class:`AdaptiveThrottle` backs off when the computer is busy.
+
+A throttle is picklable, the locks are rebuilt, and :meth:`IoThrottle.split` shares its rates
+between processes.
+
+"""
+
+####################################################################################################
+
+__all__ = ['AdaptiveThrottle', 'IoThrottle', 'TokenBucket']
+
+####################################################################################################
+
+from pathlib import Path
+from typing import AnyStr, Mapping, Optional, Tuple, Union
+import copy
+import logging
+import os
+import threading
+import time
+
+####################################################################################################
+
+_module_logger = logging.getLogger(__name__)
+
+type Rates = Tuple[Optional[float], Optional[float]]
+
+####################################################################################################
+
+class TokenBucket:
+
+    """Class to implement a thread-safe token bucket.
+
+    *rate* is the number of tokens per second and *burst* the capacity of the bucket, it defaults to
+    one second of tokens.
+
+    """
+
+    ##############################################
+
+    def __init__(self, rate: float, burst: Optional[float] = None) -> None:
+        if rate <= 0:
+            raise ValueError(f"Invalid rate {rate}")
+        self._rate = float(rate)
+        self._burst = float(burst if burst is not None else rate)
+        self._tokens = self._burst
+        self._time = time.monotonic()
+        self._lock = threading.Lock()
+
+    ##############################################
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._time = time.monotonic()
+        self._lock = threading.Lock()
+
+    ##############################################
+
+    @property
+    def rate(self) -> float:
+        return self._rate
+
+    @property
+    def burst(self) -> float:
+        return self._burst
+
+    ##############################################
+
+    def reserve(self, tokens: float = 1) -> float:
+        """Take *tokens* and return the time to wait in seconds"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self._burst, self._tokens + (now - self._time) * self._rate)
+            self._time = now
+            self._tokens -= tokens
+            debt = -self._tokens
+        return max(debt, 0) / self._rate
+
+    ##############################################
+
+    def consume(self, tokens: float = 1) -> None:
+        """Take *tokens* and sleep until they are available"""
+        delay = self.reserve(tokens)
+        if delay > 0:
+            time.sleep(delay)
+
+####################################################################################################
+
+class IoThrottle:
+
+    """Class to throttle the I/O of a scan.
+
+    *ops_per_second* limits the metadata operations and *bytes_per_second* the bytes read, None
+    means unlimited.  *devices* maps a device, given by its :code:`st_dev` or a path on it, to a
+    tuple :code:`(ops_per_second, bytes_per_second)` of limits which apply in addition to the global
+    ones.
+
+    Usage::
+
+        throttle = IoThrottle(ops_per_second=1000, bytes_per_second=50 * 2**20, devices={'/mnt/nas': (100, None)})
+        DuplicateFinder.find_duplicate(path, throttle=throttle)
+
+    """
+
+    _logger = _module_logger.getChild('IoThrottle')
+
+    ##############################################
+
+    def __init__(self,
+                 ops_per_second: Optional[float] = None,
+                 bytes_per_second: Optional[float] = None,
+                 devices: Optional[Mapping[Union[int, AnyStr, Path], Rates]] = None,
+                 ) -> None:
+        self._ops = self._make_bucket(ops_per_second)
+        self._bytes = self._make_bucket(bytes_per_second)
+        self._devices = {}
+        if devices:
+            for device, (ops, bytes_) in devices.items():
+                if not isinstance(device, int):
+                    device = os.stat(device).st_dev
+                self._devices[device] = (self._make_bucket(ops), self._make_bucket(bytes_))
+
+    ##############################################
+
+    @staticmethod
+    def _make_bucket(rate: Optional[float]) -> Optional[TokenBucket]:
+        if rate is None:
+            return None
+        return TokenBucket(rate)
+
+    ##############################################
+
+    @staticmethod
+    def _split_bucket(bucket: Optional[TokenBucket], count: int) -> Optional[TokenBucket]:
+        if bucket is None:
+            return None
+        return TokenBucket(bucket.rate / count, bucket.burst / count)
+
+    ##############################################
+
+    def split(self, count: int) -> 'IoThrottle':
+        """Return a copy of the throttle for one of *count* processes, the rates are divided by
+        *count* thus the processes together respect the limits.
+
+        """
+        if count < 1:
+            raise ValueError(f"Invalid count {count}")
+        throttle = copy.copy(self)
+        throttle._ops = self._split_bucket(self._ops, count)
+        throttle._bytes = self._split_bucket(self._bytes, count)
+        throttle._devices = {
+            device: tuple(self._split_bucket(_, count) for _ in buckets)
+            for device, buckets in self._devices.items()
+        }
+        return throttle
+
+    ##############################################
+
+    def _consume(self, index: int, tokens: float, device: Optional[int]) -> None:
+        buckets = [(self._ops, self._bytes)[index]]
+        if device is not None:
+            _ = self._devices.get(device)
+            if _ is not None:
+                buckets.append(_[index])
+        # take the tokens in all the buckets, then wait for the slowest
+        delay = max((_.reserve(tokens) for _ in buckets if _ is not None), default=0)
+        if delay > 0:
+            time.sleep(delay)
+
+    ##############################################
+
+    def metadata(self, count: int = 1, device: Optional[int] = None) -> None:
+        """Account for *count* metadata operations on *device*"""
+        self._consume(0, count, device)
+
+    ##############################################
+
+    def read(self, size: int, device: Optional[int] = None) -> None:
+        """Account for *size* bytes read on *device*"""
+        if size > 0:
+            self._consume(1, size, device)
+
+    ##############################################
+
+    def max_workers(self, workers: int) -> int:
+        """Return how many workers among *workers* are allowed to run"""
+        return workers
+
+    ##############################################
+
+    def wait_worker(self, worker: int, workers: int) -> bool:
+        """Return whether the worker number *worker* among *workers* is allowed to run, else wait a
+        while before to return False.
+
+        """
+        return True
+
+####################################################################################################
+
+class AdaptiveThrottle(IoThrottle):
+
+    """Class to throttle the I/O of a scan according to the load of the computer.
+
+    The throttle reads the Linux Pressure Stall Information for I/O and CPU, and the load average,
+    at most every *interval* seconds.  The computer is busy if the *some* I/O pressure exceeds
+    *io_pressure* %, the *some* CPU pressure exceeds *cpu_pressure* % or the load average per CPU
+    exceeds *load*.
+
+    When the computer is busy, the number of running workers is halved and the consumers sleep for a
+    delay which is doubled up to *max_delay*, when it is idle, the number of workers is incremented
+    and the delay is halved.
+
+    If *idle_io_priority* is set, the calling thread is put in the idle I/O scheduling class, thus
+    the throttle should be created before the worker threads.  If it fails, a warning is logged.
+
+    The fixed limits of :class:`IoThrottle` still apply.
+
+    """
+
+    _logger = _module_logger.getChild('AdaptiveThrottle')
+
+    MIN_DELAY = .001   # s
+
+    ##############################################
+
+    def __init__(self,
+                 ops_per_second: Optional[float] = None,
+                 bytes_per_second: Optional[float] = None,
+                 devices: Optional[Mapping[Union[int, AnyStr, Path], Rates]] = None,
+                 max_workers: Optional[int] = None,
+                 interval: float = 1.,
+                 io_pressure: float = 10.,
+                 cpu_pressure: float = 20.,
+                 load: float = 1.,
+                 max_delay: float = 1.,
+                 idle_io_priority: bool = False,
+                 ) -> None:
+        super().__init__(ops_per_second, bytes_per_second, devices)
+        self._max_workers = max_workers or os.cpu_count() or 1
+        self._interval = interval
+        self._io_pressure = io_pressure
+        self._cpu_pressure = cpu_pressure
+        self._load = load
+        self._max_delay = max_delay
+        self._lock = threading.Lock()
+        self._last_update = .0
+        self._allowed_workers = self._max_workers
+        self._delay = .0
+        if idle_io_priority:
+            from filewalker.os.linux import set_io_priority
+            try:
+                set_io_priority()
+            except OSError as exception:
+                self._logger.warning(f"Cannot set the idle I/O priority: {exception}")
+
+    ##############################################
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    ##############################################
+
+    @property
+    def allowed_workers(self) -> int:
+        return self._allowed_workers
+
+    @property
+    def delay(self) -> float:
+        return self._delay
+
+    ##############################################
+
+    def is_busy(self) -> bool:
+        from filewalker.os.linux import Pressure, load_average
+        for resource, threshold in (('io', self._io_pressure), ('cpu', self._cpu_pressure)):
+            pressure = Pressure.read(resource)
+            if pressure is not None and pressure.some() > threshold:
+                return True
+        try:
+            return load_average()[0] / (os.cpu_count() or 1) > self._load
+        except OSError:
+            return False
+
+    ##############################################
+
+    def update(self) -> None:
+        """Adapt the number of workers and the delay, at most every *interval* seconds"""
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_update < self._interval:
+                return
+            self._last_update = now
+        busy = self.is_busy()
+        with self._lock:
+            if busy:
+                self._allowed_workers = max(1, self._allowed_workers // 2)
+                self._delay = min(self._max_delay, max(2 * self._delay, self.MIN_DELAY))
+            else:
+                self._allowed_workers = min(self._max_workers, self._allowed_workers + 1)
+                self._delay = self._delay / 2 if self._delay > self.MIN_DELAY else .0
+        if busy:
+            self._logger.debug(f"busy: {self._allowed_workers} workers, delay {self._delay:.3f} s")
+
+    ##############################################
+
+    def _consume(self, index: int, tokens: float, device: Optional[int]) -> None:
+        super()._consume(index, tokens, device)
+        self.update()
+        delay = self._delay
+        if delay > 0:
+            time.sleep(delay)
+
+    ##############################################
+
+    def max_workers(self, workers: int) -> int:
+        return max(1, min(workers, self._allowed_workers))
+
+    ##############################################
+
+    def wait_worker(self, worker: int, workers: int) -> bool:
+        if worker < self.max_workers(workers):
+            return True
+        time.sleep(self._interval)
+        self.update()
+        return False
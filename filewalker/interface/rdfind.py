@@ -57,6 +57,9 @@ _module_logger = logging.getLogger(__name__)
 
 class Rdfind:
 
+    # name of the rdfind checksum and of the hash backend, see filewalker.common.hashing
+    CHECKSUM = 'sha256'
+
     _logger = _module_logger.getChild('Rdfind')
 
     ##############################################
@@ -107,7 +110,7 @@ class Rdfind:
         command = [
             '/usr/bin/rdfind',
             '-followsymlinks', 'false',
-            '-checksum', 'sha256',
+            '-checksum', self.CHECKSUM,
             '-outputname', output,
             '-dryrun', 'true',
         ]
@@ -171,7 +174,7 @@ class Rdfind:
 
     @property
     def duplicate_pool(self) -> DuplicatePool:
-        return DuplicatePool.new_from_paths(self.run())
+        return DuplicatePool.new_from_paths(self.run(), hash_backend=self.CHECKSUM)
 
     ##############################################
 
@@ -0,0 +1,259 @@
+####################################################################################################
+#
+# filewalker — ...
+# Copyright (C) 2020 Fabrice Salvaire
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+####################################################################################################
+####################################################################################################
+
+"""Module to hold open directory descriptors and to resolve names relative to them.
+
+An operation on a path costs a path walk in the kernel, one lookup per component, whereas the
+``*at`` syscalls resolve a name relative to an open directory.  A :class:`DirectoryHandle` is the
+handle of a directory, its descriptor is opened relative to the handle of its parent when it is
+open.  The number of open descriptors is bounded by a LRU, an evicted handle is reopened on
+demand, thus a handle remains valid as long as its path.  Once :meth:`DirectoryHandles.close` is
+called, the handles are no longer :attr:`DirectoryHandle.live`, the users must fall back to the path
+instead of reopening a descriptor for a single call.
+
+"""
+
+####################################################################################################
+
+__all__ = ['DirectoryHandle', 'DirectoryHandles']
+
+####################################################################################################
+
+from collections import OrderedDict
+from typing import TYPE_CHECKING
+import logging
+import os
+import threading
+
+from .statx import statx
+
+if TYPE_CHECKING:
+    from .statx import StatxResult
+
+####################################################################################################
+
+_module_logger = logging.getLogger(__name__)
+
+####################################################################################################
+
+class DirectoryHandle:
+
+    """Class to implement the handle of a directory, see :class:`DirectoryHandles`.
+
+    The methods resolve *name* relative to the directory and pin the descriptor for the duration of
+    the call, thus it cannot be closed by another thread.
+
+    """
+
+    __slots__ = ['path', 'fd', '_pins', '_handles']
+
+    ##############################################
+
+    def __init__(self, handles: 'DirectoryHandles', path: bytes) -> None:
+        self.path = path
+        self.fd = None
+        self._pins = 0
+        self._handles = handles
+
+    ##############################################
+
+    def __repr__(self) -> str:
+        return f'<DirectoryHandle {self.path!r} fd={self.fd}>'
+
+    ##############################################
+
+    @property
+    def live(self) -> bool:
+        """Return whether the handles are not closed, see :meth:`DirectoryHandles.close`"""
+        return not self._handles.closed
+
+    ##############################################
+
+    def acquire(self) -> int:
+        """Pin the handle and return its descriptor, it is reopened if it was evicted."""
+        return self._handles._acquire(self)
+
+    def release(self) -> None:
+        self._handles._release(self)
+
+    ##############################################
+
+    def lstat(self, name: bytes) -> os.stat_result:
+        fd = self.acquire()
+        try:
+            return os.lstat(name, dir_fd=fd)
+        finally:
+            self.release()
+
+    def stat(self, name: bytes) -> os.stat_result:
+        fd = self.acquire()
+        try:
+            return os.stat(name, dir_fd=fd)
+        finally:
+            self.release()
+
+    def statx(self, name: bytes, mask: int, flags: int) -> 'StatxResult':
+        fd = self.acquire()
+        try:
+            return statx(name, mask, flags, dir_fd=fd)
+        finally:
+            self.release()
+
+    ##############################################
+
+    def open(self, name: bytes, flags: int = os.O_RDONLY) -> int:
+        """Open the file *name* and return a descriptor"""
+        fd = self.acquire()
+        try:
+            return os.open(name, flags | os.O_CLOEXEC, dir_fd=fd)
+        finally:
+            self.release()
+
+####################################################################################################
+
+class DirectoryHandles:
+
+    """Class to implement a thread-safe LRU of at most *max_size* open directory descriptors.
+
+    A pinned handle is not evicted, thus the limit can be exceeded while more handles are in use.
+    Once :meth:`close` is called, a descriptor is only opened for the duration of a call.
+
+    """
+
+    FLAGS = os.O_RDONLY | os.O_DIRECTORY | os.O_CLOEXEC
+
+    _logger = _module_logger.getChild('DirectoryHandles')
+
+    ##############################################
+
+    def __init__(self, max_size: int = 256) -> None:
+        if max_size < 1:
+            raise ValueError("max_size must be >= 1")
+        self._max_size = max_size
+        self._lock = threading.Lock()
+        # open handles, the first one is the least recently used
+        self._lru = OrderedDict()
+        self._by_path = {}
+        self._closed = False
+
+    ##############################################
+
+    def __len__(self) -> int:
+        return len(self._lru)
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    ##############################################
+
+    def get(self, path: bytes) -> DirectoryHandle:
+        """Return the handle of the directory *path*, it is opened on demand."""
+        with self._lock:
+            handle = self._by_path.get(path)
+        if handle is None:
+            handle = DirectoryHandle(self, path)
+        return handle
+
+    ##############################################
+
+    def _open(self, handle: DirectoryHandle) -> None:
+        # called with the lock, thus the parent cannot be closed
+        path = handle.path
+        parent_path, name = os.path.split(path.rstrip(b'/'))
+        parent = self._by_path.get(parent_path)
+        if parent is not None and name:
+            # a single lookup
+            handle.fd = os.open(name, self.FLAGS, dir_fd=parent.fd)
+        else:
+            handle.fd = os.open(path, self.FLAGS)
+        self._lru[handle] = None
+        self._by_path.setdefault(path, handle)
+        self._evict()
+
+    ##############################################
+
+    def _evict(self) -> None:
+        excess = len(self._lru) - self._max_size
+        if excess <= 0:
+            return
+        for handle in [_ for _ in self._lru if not _._pins][:excess]:
+            self._close(handle)
+
+    ##############################################
+
+    def _close(self, handle: DirectoryHandle) -> None:
+        self._lru.pop(handle, None)
+        if self._by_path.get(handle.path) is handle:
+            del self._by_path[handle.path]
+        os.close(handle.fd)
+        handle.fd = None
+
+    ##############################################
+
+    def _acquire(self, handle: DirectoryHandle) -> int:
+        with self._lock:
+            if handle.fd is None:
+                # pin before the eviction
+                handle._pins += 1
+                try:
+                    if self._closed:
+                        # not cached, closed by _release
+                        handle.fd = os.open(handle.path, self.FLAGS)
+                    else:
+                        self._open(handle)
+                except OSError:
+                    handle._pins -= 1
+                    raise
+            else:
+                handle._pins += 1
+                if handle in self._lru:
+                    self._lru.move_to_end(handle)
+            return handle.fd
+
+    ##############################################
+
+    def _release(self, handle: DirectoryHandle) -> None:
+        with self._lock:
+            handle._pins -= 1
+            if not handle._pins:
+                if self._closed:
+                    self._close(handle)
+                elif len(self._lru) > self._max_size:
+                    self._evict()
+
+    ##############################################
+
+    def close(self) -> None:
+        """Close the descriptors which are not in use, the others are closed when they are released.
+        The handles remain valid but are no longer live.
+
+        """
+        with self._lock:
+            self._closed = True
+            for handle in [_ for _ in self._lru if not _._pins]:
+                self._close(handle)
+
+    def __del__(self) -> None:
+        try:
+            self.close()
+        except Exception:
+            pass
@@ -0,0 +1,251 @@
+####################################################################################################
+#
+# filewalker — ...
+# Copyright (C) 2020 Fabrice Salvaire
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+####################################################################################################
+####################################################################################################
+
+"""Module to read large directories with the Linux getdents64 syscall, see getdents(2).
+
+:func:`os.scandir` reads a directory with a 32 KiB buffer.  For a directory with millions of entries,
+a larger buffer saves syscalls, and the entries can be processed by batches instead of building a
+list of the whole directory.
+
+"""
+
+####################################################################################################
+
+__all__ = ['DT_DIR', 'DT_LNK', 'DT_REG', 'DT_UNKNOWN', 'RawDirEntry', 'iter_dirents', 'iter_dir_entries']
+
+####################################################################################################
+
+from errno import ENOSYS
+from pathlib import Path
+from typing import TYPE_CHECKING, AnyStr, Callable, Iterator, List, Optional, Tuple, Union
+import ctypes
+import os
+import platform
+import stat
+import struct
+
+if TYPE_CHECKING:
+    from .dirfd import DirectoryHandle
+
+####################################################################################################
+
+# from <dirent.h>
+DT_UNKNOWN = 0
+DT_FIFO = 1
+DT_CHR = 2
+DT_DIR = 4
+DT_BLK = 6
+DT_REG = 8
+DT_LNK = 10
+DT_SOCK = 12
+
+# glibc < 2.30 doesn't provide a wrapper
+SYS_GETDENTS64 = {
+    'x86_64': 217,
+    'i386': 220,
+    'i686': 220,
+    'aarch64': 61,
+    'riscv64': 61,
+    'armv7l': 217,
+    'ppc64le': 202,
+    's390x': 220,
+}
+
+BUFFER_SIZE = 1024 * 1024
+
+# struct linux_dirent64: d_ino, d_off, d_reclen, d_type, d_name
+DIRENT64_STRUCT = struct.Struct('=QqHB')
+
+type Dirent = Tuple[bytes, int, int]
+
+_libc = None
+
+####################################################################################################
+
+def _getdents64() -> Callable[[int, ctypes.Array, int], int]:
+    global _libc
+    if _libc is None:
+        _libc = ctypes.CDLL(None, use_errno=True)
+    machine = platform.machine()
+    try:
+        number = SYS_GETDENTS64[machine]
+    except KeyError:
+        raise OSError(ENOSYS, f"getdents64 syscall number is unknown for {machine}")
+    syscall = _libc.syscall
+    syscall.restype = ctypes.c_long
+    return lambda fd, buffer, size: syscall(number, fd, buffer, ctypes.c_size_t(size))
+
+####################################################################################################
+
+def iter_dirents(path: Union[AnyStr, Path], buffer_size: int = BUFFER_SIZE) -> Iterator[List[Dirent]]:
+    """Yield the entries of the directory *path* by batches of :code:`(name, inode, d_type)`, a
+    batch is the content of a *buffer_size* buffer.  "." and ".." are skipped.  Raise
+    :exc:`OSError`, with :data:`errno.ENOSYS` if the syscall number is unknown for the architecture.
+
+    """
+    fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY | os.O_CLOEXEC)
+    try:
+        yield from _read_dirents(fd, path, buffer_size)
+    finally:
+        os.close(fd)
+
+####################################################################################################
+
+def _read_dirents(fd: int, path: Union[AnyStr, Path], buffer_size: int) -> Iterator[List[Dirent]]:
+    getdents64 = _getdents64()
+    buffer = ctypes.create_string_buffer(buffer_size)
+    header_size = DIRENT64_STRUCT.size
+    unpack_from = DIRENT64_STRUCT.unpack_from
+    while True:
+        size = getdents64(fd, buffer, buffer_size)
+        if size == -1:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), os.fsdecode(path))
+        if size == 0:
+            return
+        # copy only the records, buffer.raw would copy the whole buffer
+        data = ctypes.string_at(buffer, size)
+        batch = []
+        offset = 0
+        while offset < size:
+            inode, _, record_length, d_type = unpack_from(data, offset)
+            end = data.index(b'\0', offset + header_size)
+            name = data[offset + header_size:end]
+            offset += record_length
+            if name != b'.' and name != b'..':
+                batch.append((name, inode, d_type))
+        if batch:
+            yield batch
+
+####################################################################################################
+
+class RawDirEntry:
+
+    """Class to implement an :class:`os.DirEntry` from a getdents64 record, the stat results are
+    cached like :class:`os.DirEntry`.
+
+    If *handle* is set, the stat calls are relative to this handle of the directory while it is
+    live, see :mod:`filewalker.os.dirfd`.
+
+    """
+
+    __slots__ = ['name', 'path', 'handle', '_inode', '_d_type', '_stat', '_lstat']
+
+    ##############################################
+
+    def __init__(self,
+                 dirpath: bytes, name: bytes, inode: int, d_type: int,
+                 handle: Optional['DirectoryHandle'] = None,
+                 ) -> None:
+        self.name = name
+        self.path = os.path.join(dirpath, name)
+        self.handle = handle
+        self._inode = inode
+        self._d_type = d_type
+        self._stat = None
+        self._lstat = None
+
+    ##############################################
+
+    def __repr__(self) -> str:
+        return f'<RawDirEntry {self.name!r}>'
+
+    def __fspath__(self) -> bytes:
+        return self.path
+
+    ##############################################
+
+    def inode(self) -> int:
+        return self._inode
+
+    ##############################################
+
+    def _live_handle(self) -> Optional['DirectoryHandle']:
+        # a closed handle would reopen the directory for a single call
+        handle = self.handle
+        if handle is not None and not handle.live:
+            handle = self.handle = None
+        return handle
+
+    ##############################################
+
+    def stat(self, *, follow_symlinks: bool = True) -> os.stat_result:
+        if follow_symlinks and self.is_symlink():
+            if self._stat is None:
+                handle = self._live_handle()
+                if handle is not None:
+                    self._stat = handle.stat(self.name)
+                else:
+                    self._stat = os.stat(self.path)
+            return self._stat
+        if self._lstat is None:
+            handle = self._live_handle()
+            if handle is not None:
+                self._lstat = handle.lstat(self.name)
+            else:
+                self._lstat = os.lstat(self.path)
+        return self._lstat
+
+    ##############################################
+
+    def _test_mode(self, d_type: int, test: Callable[[int], bool], follow_symlinks: bool) -> bool:
+        if self._d_type == DT_UNKNOWN or (follow_symlinks and self._d_type == DT_LNK):
+            try:
+                return test(self.stat(follow_symlinks=follow_symlinks).st_mode)
+            except FileNotFoundError:
+                return False
+        return self._d_type == d_type
+
+    def is_symlink(self) -> bool:
+        if self._d_type == DT_UNKNOWN:
+            return self._test_mode(DT_LNK, stat.S_ISLNK, False)
+        return self._d_type == DT_LNK
+
+    def is_dir(self, *, follow_symlinks: bool = True) -> bool:
+        return self._test_mode(DT_DIR, stat.S_ISDIR, follow_symlinks)
+
+    def is_file(self, *, follow_symlinks: bool = True) -> bool:
+        return self._test_mode(DT_REG, stat.S_ISREG, follow_symlinks)
+
+####################################################################################################
+
+def iter_dir_entries(dirpath: bytes,
+                     buffer_size: int = BUFFER_SIZE,
+                     handle: Optional['DirectoryHandle'] = None,
+                     ) -> Iterator[List[RawDirEntry]]:
+    """Like :func:`iter_dirents` but yield batches of :class:`RawDirEntry`.
+
+    If *handle* is set, the directory is read from its descriptor, which is pinned until the end of
+    the iteration, and the entries are bound to it.
+
+    """
+    if handle is None:
+        for batch in iter_dirents(dirpath, buffer_size):
+            yield [RawDirEntry(dirpath, *_) for _ in batch]
+        return
+    fd = handle.acquire()
+    try:
+        # the descriptor can be read again
+        os.lseek(fd, 0, os.SEEK_SET)
+        for batch in _read_dirents(fd, dirpath, buffer_size):
+            yield [RawDirEntry(dirpath, *_, handle) for _ in batch]
+    finally:
+        handle.release()
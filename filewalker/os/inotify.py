@@ -0,0 +1,204 @@
+####################################################################################################
+#
+# filewalker — ...
+# Copyright (C) 2020 Fabrice Salvaire
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+####################################################################################################
+####################################################################################################
+
+"""Linux inotify binding using ctypes, see inotify(7).
+
+"""
+
+####################################################################################################
+
+__all__ = ['Inotify', 'InotifyEvent']
+
+####################################################################################################
+
+from pathlib import Path
+from typing import AnyStr, List, NamedTuple, Optional, Union
+import ctypes
+import logging
+import os
+import select
+import struct
+
+####################################################################################################
+
+_module_logger = logging.getLogger(__name__)
+
+####################################################################################################
+
+# from <sys/inotify.h>
+IN_ACCESS = 0x00000001
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_CLOSE_NOWRITE = 0x00000010
+IN_OPEN = 0x00000020
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+
+IN_UNMOUNT = 0x00002000
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_EXCL_UNLINK = 0x04000000
+IN_MASK_ADD = 0x20000000
+IN_ISDIR = 0x40000000
+IN_ONESHOT = 0x80000000
+
+IN_MOVE = IN_MOVED_FROM | IN_MOVED_TO
+IN_CLOSE = IN_CLOSE_WRITE | IN_CLOSE_NOWRITE
+
+IN_CLOEXEC = os.O_CLOEXEC
+IN_NONBLOCK = os.O_NONBLOCK
+
+####################################################################################################
+
+class InotifyEvent(NamedTuple):
+
+    """Class to hold an inotify event, *name* is empty for an event on the watched directory
+    itself.
+
+    """
+
+    wd: int
+    mask: int
+    cookie: int
+    name: bytes
+
+    ##############################################
+
+    @property
+    def is_dir(self) -> bool:
+        return bool(self.mask & IN_ISDIR)
+
+####################################################################################################
+
+class Inotify:
+
+    """Class to implement an inotify instance.
+
+    Usage::
+
+        with Inotify() as inotify:
+            wd = inotify.add_watch(path, IN_CREATE | IN_DELETE)
+            for event in inotify.read_events(timeout=1):
+                ...
+
+    """
+
+    _logger = _module_logger.getChild('Inotify')
+
+    EVENT_STRUCT = struct.Struct('=iIII')
+    # enough for the events of a busy directory
+    BUFFER_SIZE = 64 * 1024
+
+    _libc = None
+
+    ##############################################
+
+    @classmethod
+    def _load_libc(cls) -> ctypes.CDLL:
+        if cls._libc is None:
+            libc = ctypes.CDLL(None, use_errno=True)
+            libc.inotify_init1.argtypes = (ctypes.c_int,)
+            libc.inotify_add_watch.argtypes = (ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32)
+            libc.inotify_rm_watch.argtypes = (ctypes.c_int, ctypes.c_int)
+            cls._libc = libc
+        return cls._libc
+
+    ##############################################
+
+    @staticmethod
+    def _check(result: int, path: Optional[bytes] = None) -> int:
+        if result == -1:
+            errno = ctypes.get_errno()
+            if path is not None:
+                raise OSError(errno, os.strerror(errno), os.fsdecode(path))
+            raise OSError(errno, os.strerror(errno))
+        return result
+
+    ##############################################
+
+    def __init__(self) -> None:
+        self._libc = self._load_libc()
+        self._fd = self._check(self._libc.inotify_init1(IN_CLOEXEC | IN_NONBLOCK))
+
+    ##############################################
+
+    def close(self) -> None:
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+    def __enter__(self) -> 'Inotify':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def fileno(self) -> int:
+        return self._fd
+
+    ##############################################
+
+    def add_watch(self, path: Union[AnyStr, Path], mask: int) -> int:
+        """Watch *path* and return the watch descriptor.  Raise :exc:`OSError`, ENOSPC means the
+        limit /proc/sys/fs/inotify/max_user_watches is reached.
+
+        """
+        path = os.fsencode(path)
+        return self._check(self._libc.inotify_add_watch(self._fd, path, mask), path)
+
+    ##############################################
+
+    def rm_watch(self, wd: int) -> None:
+        # EINVAL if the watch was already removed by the kernel
+        self._check(self._libc.inotify_rm_watch(self._fd, wd))
+
+    ##############################################
+
+    def read_events(self, timeout: Optional[float] = None) -> List[InotifyEvent]:
+        """Return the pending events, wait at most *timeout* seconds if there is none, forever if
+        *timeout* is None.
+
+        """
+        readable, _, _ = select.select((self._fd,), (), (), timeout)
+        if not readable:
+            return []
+        try:
+            buffer = os.read(self._fd, self.BUFFER_SIZE)
+        except BlockingIOError:
+            return []
+        events = []
+        header_size = self.EVENT_STRUCT.size
+        offset = 0
+        while offset < len(buffer):
+            wd, mask, cookie, length = self.EVENT_STRUCT.unpack_from(buffer, offset)
+            offset += header_size
+            name = buffer[offset:offset + length].rstrip(b'\0')
+            offset += length
+            events.append(InotifyEvent(wd, mask, cookie, name))
+        return events
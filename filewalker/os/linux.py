@@ -27,6 +27,11 @@ see also https://psutil.readthedocs.io/en/latest/#psutil.disk_partitions
 * /usr/bin/mount
 * /proc/partitions
 * /proc/mounts -> /proc/self/mounts   see PROC(5) use fstab format
+* /proc/self/mountinfo   see PROC(5), provides the root of the mount and the device number
+* /proc/pressure/{cpu,io,memory}   Pressure Stall Information, see
+  https://docs.kernel.org/accounting/psi.html
+* /proc/loadavg
+* /sys/dev/block/MAJOR:MINOR/queue/rotational   1 for a rotating disk
 
 """
 
@@ -34,19 +39,53 @@ see also https://psutil.readthedocs.io/en/latest/#psutil.disk_partitions
 
 # from os import PathLike
 # import subprocess
+from errno import ENOSYS
 from pathlib import Path
-from typing import AnyStr, Iterator, Union
+from typing import AnyStr, Iterator, Optional, Tuple, Union
+import ctypes
+import os
+import platform
+import re
+
+####################################################################################################
+
+def unescape(path: str) -> str:
+    """Decode the octal escapes used in /proc/self/mounts, e.g. \\040 for a space"""
+    return re.sub(r'\\([0-7]{3})', lambda _: chr(int(_.group(1), 8)), path)
 
 ####################################################################################################
 
 class MountPoint:
 
+    NETWORK_TYPES = (
+        '9p',
+        'afs',
+        'ceph',
+        'cifs',
+        'fuse.sshfs',
+        'glusterfs',
+        'nfs',
+        'nfs4',
+        'smb3',
+        'smbfs',
+    )
+
     ##############################################
 
-    def __init__(self, mount_point: str, device: str, type_: str) -> None:
+    def __init__(self,
+                 mount_point: str,
+                 device: str,
+                 type_: str,
+                 root: str = '/',
+                 st_dev: Optional[int] = None,
+                 is_bind: bool = False,
+                 ) -> None:
         self._mount_point = mount_point
         self._device = device
         self._type = type_
+        self._root = root
+        self._st_dev = st_dev
+        self._is_bind = is_bind
 
     ##############################################
 
@@ -62,6 +101,24 @@ class MountPoint:
     def type(self) -> str:
         return self._type
 
+    @property
+    def root(self) -> str:
+        """Root of the mount within the file system"""
+        return self._root
+
+    @property
+    def st_dev(self) -> Optional[int]:
+        """Device number as reported by stat"""
+        return self._st_dev
+
+    @property
+    def is_network(self) -> bool:
+        return self._type in self.NETWORK_TYPES
+
+    @property
+    def is_bind(self) -> bool:
+        return self._is_bind
+
     def __str__(self) -> str:
         return f"{self._mount_point} -> {self._device} {self._type}"
 
@@ -71,6 +128,7 @@ class MountPoints:
 
     # MOUNT_COMMAND = ('/usr/bin/mount')
     PROC_MOUNTS = ('/proc/self/mounts')
+    PROC_MOUNTINFO = ('/proc/self/mountinfo')
 
     SYSTEM_TYPES = (
         'autofs',
@@ -97,7 +155,8 @@ class MountPoints:
 
     ##############################################
 
-    def __init__(self) -> None:
+    def __init__(self, include_system: bool = False) -> None:
+        self._include_system = include_system
         self._mounts = []
         self._read_mount_points()
         self._map = {_.mount_point: _ for _ in self._mounts}
@@ -113,11 +172,37 @@ class MountPoints:
         #         mount = MountPoint(mount_point, device, type_)
         #         self._mounts.append(mount)
 
-        with open(self.PROC_MOUNTS) as fh:
+        # with open(self.PROC_MOUNTS) as fh:
+        #     for line in fh:
+        #         device, mount_point, type_, mount_options, _, _ = line.split(' ')
+
+        # 36 35 98:0 /mnt1 /mnt2 rw,noatime master:1 - ext3 /dev/root rw,errors=continue
+        # mount_id parent_id major:minor root mount_point options [optional fields] - type source super_options
+        devices = set()
+        # roots of the btrfs mounts by device
+        subvolumes = {}
+        with open(self.PROC_MOUNTINFO) as fh:
             for line in fh:
-                device, mount_point, type_, mount_options, _, _ = line.split(' ')
-                if type_ not in self.SYSTEM_TYPES:
-                    mount = MountPoint(mount_point, device, type_)
+                fields, _, tail = line.rstrip('\n').partition(' - ')
+                fields = fields.split(' ')
+                major_minor, root, mount_point = fields[2:5]
+                type_, device = tail.split(' ')[:2]
+                root = unescape(root)
+                mount_point = unescape(mount_point)
+                major, minor = major_minor.split(':')
+                st_dev = os.makedev(int(major), int(minor))
+                if type_ == 'btrfs':
+                    # the root of a btrfs mount is its subvolume, a bind mount exposes a subtree of
+                    # a subvolume already mounted
+                    roots = subvolumes.setdefault(st_dev, [])
+                    is_bind = any(root == _ or root.startswith(_.rstrip('/') + '/') for _ in roots)
+                    roots.append(root)
+                else:
+                    # A bind mount exposes a subtree, or a file system already mounted elsewhere.
+                    is_bind = root != '/' or st_dev in devices
+                devices.add(st_dev)
+                if self._include_system or type_ not in self.SYSTEM_TYPES:
+                    mount = MountPoint(mount_point, device, type_, root, st_dev, is_bind)
                     self._mounts.append(mount)
 
     ##############################################
@@ -133,6 +218,137 @@ class MountPoints:
 
     ##############################################
 
+    def find(self, path: Union[AnyStr, Path]) -> Optional[MountPoint]:
+        if isinstance(path, bytes):
+            path = os.fsdecode(path)
+        return self._map.get(str(path))
+
+    ##############################################
+
+    def find_device(self, st_dev: int) -> Optional[MountPoint]:
+        """Return the first mount point of the device *st_dev*"""
+        for mount in self._mounts:
+            if mount.st_dev == st_dev:
+                return mount
+        return None
+
+    ##############################################
+
     # def is_mount(self, path: Union[AnyStr, PathLike[AnyStr]]) -> bool:
     def is_mount(self, path: Union[AnyStr, Path]) -> bool:
-        return str(path) in self._map
+        return self.find(path) is not None
+
+####################################################################################################
+
+class Pressure:
+
+    """Class to read the Pressure Stall Information of a resource: cpu, io or memory.
+
+    The *some* line is the share of time at least one task is stalled on the resource, the *full*
+    line the share of time all non-idle tasks are stalled.  The averages are percentages.
+
+    """
+
+    PROC_PRESSURE = '/proc/pressure/{}'
+
+    ##############################################
+
+    @classmethod
+    def read(cls, resource: str) -> Optional['Pressure']:
+        """Return the pressure on *resource* or None if PSI is not available"""
+        try:
+            with open(cls.PROC_PRESSURE.format(resource)) as fh:
+                return cls(fh.read())
+        except OSError:
+            return None
+
+    ##############################################
+
+    def __init__(self, text: str) -> None:
+        # some avg10=0.00 avg60=0.00 avg300=0.00 total=0
+        self._lines = {}
+        for line in text.splitlines():
+            kind, *fields = line.split()
+            self._lines[kind] = {
+                key: float(value)
+                for key, value in (_.split('=') for _ in fields)
+            }
+
+    ##############################################
+
+    def some(self, average: str = 'avg10') -> float:
+        return self._lines['some'][average]
+
+    def full(self, average: str = 'avg10') -> float:
+        # the cpu full line is only reported by recent kernels
+        return self._lines.get('full', {}).get(average, .0)
+
+####################################################################################################
+
+def load_average() -> Tuple[float, float, float]:
+    """Return the load averages over 1, 5 and 15 minutes from /proc/loadavg"""
+    with open('/proc/loadavg') as fh:
+        return tuple(float(_) for _ in fh.read().split()[:3])
+
+####################################################################################################
+
+def is_rotational(device: int) -> Optional[bool]:
+    """Return True if the block device *device*, given by its :code:`st_dev`, is a rotating disk, None
+    if it is unknown, e.g. for a network or virtual file system.
+
+    """
+    path = f'/sys/dev/block/{os.major(device)}:{os.minor(device)}'
+    # a partition doesn't have a queue directory
+    for queue in ('queue', '../queue'):
+        try:
+            with open(os.path.join(path, queue, 'rotational')) as fh:
+                return fh.read().strip() == '1'
+        except OSError:
+            pass
+    return None
+
+####################################################################################################
+
+# See ioprio_set(2) and linux/ioprio.h
+
+IOPRIO_CLASS_NONE = 0
+IOPRIO_CLASS_RT = 1
+IOPRIO_CLASS_BE = 2
+IOPRIO_CLASS_IDLE = 3
+
+IOPRIO_CLASS_SHIFT = 13
+
+IOPRIO_WHO_PROCESS = 1
+IOPRIO_WHO_PGRP = 2
+IOPRIO_WHO_USER = 3
+
+# glibc doesn't provide a wrapper
+SYS_IOPRIO_SET = {
+    'x86_64': 251,
+    'i386': 289,
+    'i686': 289,
+    'aarch64': 30,
+    'riscv64': 30,
+    'armv7l': 314,
+    'ppc64le': 273,
+    's390x': 282,
+}
+
+def set_io_priority(class_: int = IOPRIO_CLASS_IDLE, level: int = 0, who: int = 0) -> None:
+    """Set the I/O scheduling class of the thread *who*, 0 is the calling thread.
+
+    The threads created afterwards inherit the I/O priority.  The idle class only gets disk time
+    when no other program has asked for it.  Raise :exc:`OSError`, with :data:`errno.ENOSYS` if the
+    syscall number is unknown for the architecture.
+
+    """
+    machine = platform.machine()
+    try:
+        number = SYS_IOPRIO_SET[machine]
+    except KeyError:
+        raise OSError(ENOSYS, f"ioprio_set syscall number is unknown for {machine}")
+    libc = ctypes.CDLL(None, use_errno=True)
+    ioprio = (class_ << IOPRIO_CLASS_SHIFT) | level
+    if libc.syscall(number, IOPRIO_WHO_PROCESS, who, ioprio) == -1:
+        errno = ctypes.get_errno()
+        raise OSError(errno, os.strerror(errno))
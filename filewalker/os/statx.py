@@ -0,0 +1,238 @@
+####################################################################################################
+#
+# filewalker — ...
+# Copyright (C) 2020 Fabrice Salvaire
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+####################################################################################################
+####################################################################################################
+
+"""Module to call the Linux statx syscall using ctypes, see statx(2).
+
+Unlike :func:`os.lstat`, statx can be asked for a subset of the fields, thus a file system can skip
+the expensive ones, and it can be told by :data:`AT_STATX_DONT_SYNC` to return the cached attributes
+of a network file system instead of a fresh copy from the server.  On a local file system, this
+flag has no effect.
+
+"""
+
+####################################################################################################
+
+__all__ = ['StatxResult', 'statx']
+
+####################################################################################################
+
+from errno import ENOSYS
+from pathlib import Path
+from typing import AnyStr, Union
+import ctypes
+import os
+
+####################################################################################################
+
+# from <linux/stat.h>
+STATX_TYPE = 0x0001
+STATX_MODE = 0x0002
+STATX_NLINK = 0x0004
+STATX_UID = 0x0008
+STATX_GID = 0x0010
+STATX_ATIME = 0x0020
+STATX_MTIME = 0x0040
+STATX_CTIME = 0x0080
+STATX_INO = 0x0100
+STATX_SIZE = 0x0200
+STATX_BLOCKS = 0x0400
+STATX_BASIC_STATS = 0x07ff
+STATX_BTIME = 0x0800
+
+# from <fcntl.h>
+AT_FDCWD = -100
+AT_SYMLINK_NOFOLLOW = 0x100
+AT_STATX_SYNC_AS_STAT = 0x0000
+AT_STATX_FORCE_SYNC = 0x2000
+AT_STATX_DONT_SYNC = 0x4000
+
+####################################################################################################
+
+class _StatxTimestamp(ctypes.Structure):
+    _fields_ = [
+        ('tv_sec', ctypes.c_int64),
+        ('tv_nsec', ctypes.c_uint32),
+        ('__reserved', ctypes.c_int32),
+    ]
+
+    @property
+    def ns(self) -> int:
+        return self.tv_sec * 1_000_000_000 + self.tv_nsec
+
+class _Statx(ctypes.Structure):
+    _fields_ = [
+        ('stx_mask', ctypes.c_uint32),
+        ('stx_blksize', ctypes.c_uint32),
+        ('stx_attributes', ctypes.c_uint64),
+        ('stx_nlink', ctypes.c_uint32),
+        ('stx_uid', ctypes.c_uint32),
+        ('stx_gid', ctypes.c_uint32),
+        ('stx_mode', ctypes.c_uint16),
+        ('__spare0', ctypes.c_uint16),
+        ('stx_ino', ctypes.c_uint64),
+        ('stx_size', ctypes.c_uint64),
+        ('stx_blocks', ctypes.c_uint64),
+        ('stx_attributes_mask', ctypes.c_uint64),
+        ('stx_atime', _StatxTimestamp),
+        ('stx_btime', _StatxTimestamp),
+        ('stx_ctime', _StatxTimestamp),
+        ('stx_mtime', _StatxTimestamp),
+        ('stx_rdev_major', ctypes.c_uint32),
+        ('stx_rdev_minor', ctypes.c_uint32),
+        ('stx_dev_major', ctypes.c_uint32),
+        ('stx_dev_minor', ctypes.c_uint32),
+        # the kernel can fill newer fields
+        ('__spare', ctypes.c_uint64 * 14),
+    ]
+
+####################################################################################################
+
+class StatxResult:
+
+    """Class to hold a statx result with the attribute names of :class:`os.stat_result`.
+
+    Only the fields returned by the kernel are set, see :attr:`mask`, the device is always set.  A
+    file system can omit a requested field, see :attr:`requested`, accessing a missing field raises
+    :exc:`AttributeError`.
+
+    """
+
+    __slots__ = [
+        'mask', 'requested',
+        'st_dev', 'st_rdev', 'st_blksize',
+        'st_mode', 'st_nlink', 'st_uid', 'st_gid', 'st_ino', 'st_size', 'st_blocks',
+        'st_atime_ns', 'st_mtime_ns', 'st_ctime_ns', 'st_birthtime_ns',
+    ]
+
+    # (mask, stat attribute, statx field)
+    _FIELDS = (
+        (STATX_NLINK, 'st_nlink', 'stx_nlink'),
+        (STATX_UID, 'st_uid', 'stx_uid'),
+        (STATX_GID, 'st_gid', 'stx_gid'),
+        (STATX_INO, 'st_ino', 'stx_ino'),
+        (STATX_SIZE, 'st_size', 'stx_size'),
+        (STATX_BLOCKS, 'st_blocks', 'stx_blocks'),
+    )
+    _TIMES = (
+        (STATX_ATIME, 'st_atime_ns', 'stx_atime'),
+        (STATX_MTIME, 'st_mtime_ns', 'stx_mtime'),
+        (STATX_CTIME, 'st_ctime_ns', 'stx_ctime'),
+        (STATX_BTIME, 'st_birthtime_ns', 'stx_btime'),
+    )
+
+    ##############################################
+
+    def __init__(self, buffer: _Statx, requested: int) -> None:
+        mask = buffer.stx_mask
+        self.mask = mask
+        self.requested = requested
+        self.st_dev = os.makedev(buffer.stx_dev_major, buffer.stx_dev_minor)
+        self.st_rdev = os.makedev(buffer.stx_rdev_major, buffer.stx_rdev_minor)
+        self.st_blksize = buffer.stx_blksize
+        if mask & (STATX_TYPE | STATX_MODE):
+            # the type and the permissions are in the same field
+            self.st_mode = buffer.stx_mode
+        for field_mask, name, field in self._FIELDS:
+            if mask & field_mask:
+                setattr(self, name, getattr(buffer, field))
+        for field_mask, name, field in self._TIMES:
+            if mask & field_mask:
+                setattr(self, name, getattr(buffer, field).ns)
+
+    ##############################################
+
+    def __getattr__(self, name: str):
+        # called for an unset slot
+        if name.startswith('st_'):
+            raise AttributeError(
+                f"{name} is not returned by statx, mask {self.mask:#x} for {self.requested:#x}"
+            )
+        raise AttributeError(name)
+
+    ##############################################
+
+    def has(self, mask: int) -> bool:
+        """Return True if the fields *mask* are set"""
+        return self.mask & mask == mask
+
+    def missing(self, mask: int) -> int:
+        """Return the fields of *mask* which were not requested, a file system can omit a requested
+        field thus asking it again is useless.
+
+        """
+        return mask & ~(self.requested | self.mask)
+
+    ##############################################
+
+    @property
+    def st_mtime(self) -> float:
+        return self.st_mtime_ns / 1e9
+
+    @property
+    def st_atime(self) -> float:
+        return self.st_atime_ns / 1e9
+
+    @property
+    def st_ctime(self) -> float:
+        return self.st_ctime_ns / 1e9
+
+    ##############################################
+
+    def __repr__(self) -> str:
+        fields = ', '.join(f'{_}={getattr(self, _)}' for _ in self.__slots__ if hasattr(self, _))
+        return f'StatxResult({fields})'
+
+####################################################################################################
+
+_statx = None
+
+def statx(path: Union[AnyStr, Path],
+          mask: int = STATX_BASIC_STATS,
+          flags: int = AT_SYMLINK_NOFOLLOW,
+          dir_fd: int = AT_FDCWD,
+          ) -> StatxResult:
+    """Return the fields *mask* of *path*, which is relative to *dir_fd* if it is a descriptor.  The
+    default *flags* don't follow the symbolic links like :func:`os.lstat`.  Raise :exc:`OSError`,
+    with :data:`errno.ENOSYS` if the C library doesn't provide statx.
+
+    """
+    global _statx
+    if _statx is None:
+        libc = ctypes.CDLL(None, use_errno=True)
+        try:
+            function = libc.statx
+        except AttributeError:
+            # look up once
+            function = False
+        else:
+            function.argtypes = (
+                ctypes.c_int, ctypes.c_char_p, ctypes.c_int, ctypes.c_uint, ctypes.POINTER(_Statx),
+            )
+            function.restype = ctypes.c_int
+        _statx = function
+    if _statx is False:
+        raise OSError(ENOSYS, "glibc >= 2.28 is required for statx")
+    path = os.fsencode(path)
+    buffer = _Statx()
+    if _statx(dir_fd, path, flags, mask, ctypes.byref(buffer)) != 0:
+        errno = ctypes.get_errno()
+        raise OSError(errno, os.strerror(errno), os.fsdecode(path))
+    return StatxResult(buffer, mask)
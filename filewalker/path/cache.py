@@ -0,0 +1,280 @@
+####################################################################################################
+#
+# filewalker — ...
+# Copyright (C) 2020 Fabrice Salvaire
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+####################################################################################################
+####################################################################################################
+
+"""Module to implement a persistent directory cache for incremental rescans, like the database of
+updatedb(8).
+
+The cache maps the path of a directory to its `st_mtime_ns`, `st_ctime_ns` and inode, and to its
+listing.  When a directory is walked again, it is stat'ed and, if its metadata is unchanged, the
+cached listing is reused instead of reading the directory.
+
+A directory modification time only changes when an entry is created, removed or renamed, not when a
+file is modified in place, thus only the names, types and inodes are cached and the files are
+stat'ed again when their listing is reused.
+
+"""
+
+####################################################################################################
+
+__all__ = ['CachedDirEntry', 'DirectoryCache']
+
+####################################################################################################
+
+from pathlib import Path
+from typing import AnyStr, Callable, Dict, List, Optional, Tuple, Union
+import logging
+import os
+import pickle
+import stat
+
+####################################################################################################
+
+_module_logger = logging.getLogger(__name__)
+
+type CachedEntryList = List['CachedDirEntry']
+type DirectoryKey = Tuple[int, int, int]
+type CachedListing = Tuple[DirectoryKey, CachedEntryList, CachedEntryList]
+
+####################################################################################################
+
+class CachedDirEntry:
+
+    """Class to implement a picklable :class:`os.DirEntry`.
+
+    A new entry wraps the :class:`os.DirEntry` returned by :func:`os.scandir` and delegates the
+    `stat` calls to it.  The `lstat` result is kept during a walk but it is not persisted.
+
+    """
+
+    __slots__ = ['name', 'path', '_inode', '_is_dir', '_is_file', '_is_symlink', '_stat', '_entry']
+
+    ##############################################
+
+    @classmethod
+    def from_dir_entry(cls, entry: os.DirEntry, is_dir: bool) -> 'CachedDirEntry':
+        """Make an entry from *entry*, *is_dir* is the result of :code:`entry.is_dir()`"""
+        obj = cls()
+        obj.name = entry.name
+        obj.path = entry.path
+        obj._inode = entry.inode()
+        obj._is_dir = is_dir
+        obj._is_symlink = entry.is_symlink()
+        # use d_type
+        obj._is_file = False if is_dir else entry.is_file(follow_symlinks=False)
+        obj._stat = None
+        obj._entry = entry
+        return obj
+
+    ##############################################
+
+    def __getstate__(self) -> tuple:
+        # the file metadata can change without the directory
+        return self.name, self.path, self._inode, self._is_dir, self._is_file, self._is_symlink
+
+    def __setstate__(self, state: tuple) -> None:
+        self.name, self.path, self._inode, self._is_dir, self._is_file, self._is_symlink = state
+        self._stat = None
+        self._entry = None
+
+    ##############################################
+
+    def __repr__(self) -> str:
+        return f'<CachedDirEntry {self.name!r}>'
+
+    def __fspath__(self) -> AnyStr:
+        return self.path
+
+    ##############################################
+
+    def inode(self) -> int:
+        return self._inode
+
+    def is_symlink(self) -> bool:
+        return self._is_symlink
+
+    def is_dir(self, *, follow_symlinks: bool = True) -> bool:
+        if follow_symlinks:
+            return self._is_dir
+        return self._is_dir and not self._is_symlink
+
+    def is_file(self, *, follow_symlinks: bool = True) -> bool:
+        if follow_symlinks and self._is_symlink:
+            try:
+                return stat.S_ISREG(self.stat().st_mode)
+            except OSError:
+                return False
+        return self._is_file
+
+    ##############################################
+
+    def stat(self, *, follow_symlinks: bool = True) -> os.stat_result:
+        if follow_symlinks and self._is_symlink:
+            if self._entry is not None:
+                return self._entry.stat()
+            return os.stat(self.path)
+        if self._stat is None:
+            if self._entry is not None:
+                self._stat = self._entry.stat(follow_symlinks=False)
+            else:
+                self._stat = os.lstat(self.path)
+        return self._stat
+
+    ##############################################
+
+    def forget_stat(self) -> None:
+        self._stat = None
+
+####################################################################################################
+
+class DirectoryCache:
+
+    """Class to implement a persistent directory cache.
+
+    Usage::
+
+        cache = DirectoryCache.load('walk.cache')
+        walker.run(cache=cache)
+        print(cache.revisited_subtrees())
+        cache.save()
+
+    The cache can be used by the threaded and asynchronous walks, but not by :meth:`run_sharded`.
+
+    """
+
+    _logger = _module_logger.getChild('DirectoryCache')
+
+    # 2: the lstat results are not persisted
+    VERSION = 2
+
+    ##############################################
+
+    @classmethod
+    def load(cls, path: Union[AnyStr, Path], **kwargs) -> 'DirectoryCache':
+        """Load the cache saved in *path*, start from an empty cache if the file doesn't exist or is
+        incompatible.
+
+        """
+        obj = cls(path, **kwargs)
+        try:
+            with open(path, 'rb') as fh:
+                data = pickle.load(fh)
+            if data.get('version') != cls.VERSION:
+                raise ValueError(f"version {data.get('version')}")
+            obj._directories = data['directories']
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError, AttributeError, pickle.UnpicklingError, EOFError) as exception:
+            cls._logger.warning(f"Ignore the directory cache {path}: {exception}")
+        return obj
+
+    ##############################################
+
+    def __init__(self, path: Optional[Union[AnyStr, Path]] = None) -> None:
+        self._path = path
+        self._directories: Dict[bytes, CachedListing] = {}
+        # set.add is atomic, thus the walker threads don't need a lock
+        self._visited = set()
+        self._revisited = set()
+
+    ##############################################
+
+    def __len__(self) -> int:
+        return len(self._directories)
+
+    def __contains__(self, dirpath: bytes) -> bool:
+        return dirpath in self._directories
+
+    @property
+    def visited(self) -> int:
+        """Number of directories walked since the cache was loaded"""
+        return len(self._visited)
+
+    @property
+    def revisited(self) -> List[bytes]:
+        """Sorted list of the directories that were read again"""
+        return sorted(self._revisited)
+
+    @property
+    def reused(self) -> int:
+        """Number of directories whose listing was reused"""
+        return len(self._visited) - len(self._revisited)
+
+    ##############################################
+
+    def revisited_subtrees(self) -> List[bytes]:
+        """Return the roots of the subtrees that were read again, i.e. the revisited directories whose
+        parent was not.
+
+        """
+        revisited = self._revisited
+        return [_ for _ in self.revisited if os.path.dirname(_) not in revisited]
+
+    ##############################################
+
+    def list_directory(self,
+                       dirpath: bytes,
+                       read_directory: Callable[[bytes], Tuple[List[os.DirEntry], List[os.DirEntry]]],
+                       ) -> Tuple[CachedEntryList, CachedEntryList]:
+        """Return the subdirectories and the files of *dirpath*, call *read_directory* if the
+        directory changed.  Raise :exc:`OSError`.
+
+        """
+        # stat before the listing, thus a change during the listing is seen by the next walk
+        stat_result = os.stat(dirpath)
+        key = (stat_result.st_ino, stat_result.st_mtime_ns, stat_result.st_ctime_ns)
+        self._visited.add(dirpath)
+        cached = self._directories.get(dirpath)
+        if cached is not None and cached[0] == key:
+            _, directories, files = cached
+            # a file can be modified in place
+            for entry in files:
+                entry.forget_stat()
+        else:
+            directories, files = read_directory(dirpath)
+            directories = [CachedDirEntry.from_dir_entry(_, True) for _ in directories]
+            files = [CachedDirEntry.from_dir_entry(_, False) for _ in files]
+            self._directories[dirpath] = (key, directories, files)
+            self._revisited.add(dirpath)
+        # the walker can modify the lists
+        return list(directories), list(files)
+
+    ##############################################
+
+    def save(self, path: Optional[Union[AnyStr, Path]] = None, purge: bool = True) -> None:
+        """Save the cache to *path*, by default to the path given to :meth:`load`.
+
+        If *purge* is set, only the directories walked since the cache was loaded are saved, thus
+        the removed directories are forgotten.
+
+        """
+        path = path or self._path
+        if path is None:
+            raise ValueError("No path to save the directory cache")
+        directories = self._directories
+        if purge:
+            directories = {_: directories[_] for _ in self._visited if _ in directories}
+        data = {'version': self.VERSION, 'directories': directories}
+        # write atomically
+        tmp_path = os.fsencode(path) + b'.tmp'
+        with open(tmp_path, 'wb') as fh:
+            pickle.dump(data, fh, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+        self._logger.info(f"Saved {len(directories)} directories to {os.fsdecode(path)}")
@@ -0,0 +1,335 @@
+####################################################################################################
+#
+# filewalker — ...
+# Copyright (C) 2020 Fabrice Salvaire
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+####################################################################################################
+####################################################################################################
+
+"""Module to compare the content of two files in process.
+
+The files are mapped by windows of :attr:`FileComparer.WINDOW_SIZE` bytes and the windows are
+compared by `memcmp`, thus the content is not copied and the comparison stops at the first
+difference.  On a network file system, where a page fault is a round trip, and for small files, the
+content is read with `readinto` in preallocated buffers instead.
+
+A group of files is partitioned by reading all the files chunk by chunk in lockstep, the group is
+split as soon as the chunks differ, thus each byte is read once whatever the size of the group, see
+:meth:`FileComparer.partition`.
+
+"""
+
+####################################################################################################
+
+__all__ = ['FileComparer', 'compare_files', 'partition_files']
+
+####################################################################################################
+
+from contextlib import ExitStack
+from typing import TYPE_CHECKING, BinaryIO, Dict, List, Optional, Sequence
+import ctypes
+import logging
+import mmap
+import threading
+
+from filewalker.os.linux import MountPoints
+
+if TYPE_CHECKING:
+    from .file import File
+
+####################################################################################################
+
+_module_logger = logging.getLogger(__name__)
+
+_memcmp = None
+
+def _get_memcmp():
+    global _memcmp
+    if _memcmp is None:
+        function = ctypes.CDLL(None).memcmp
+        function.argtypes = (ctypes.c_void_p, ctypes.c_void_p, ctypes.c_size_t)
+        function.restype = ctypes.c_int
+        _memcmp = function
+    return _memcmp
+
+####################################################################################################
+
+def _read_full(fh: BinaryIO, view: memoryview) -> int:
+    """Fill *view* unless the end of file is reached, return the number of bytes read"""
+    size = len(view)
+    count = 0
+    while count < size:
+        _ = fh.readinto(view[count:])
+        if not _:
+            break
+        count += _
+    return count
+
+####################################################################################################
+
+class FileComparer:
+
+    """Class to compare the content of files.
+
+    *use_mmap* forces the mode, by default mmap is used for the files of at least
+    :attr:`MMAP_MIN_SIZE` bytes which are not on a network file system.
+
+    """
+
+    # multiple of mmap.ALLOCATIONGRANULARITY
+    WINDOW_SIZE = 64 * 1024**2
+    MMAP_MIN_SIZE = 256 * 1024
+    BUFFER_SIZE = 1024**2
+    # bounds of a lockstep partition: descriptors and memory of the chunk buffers
+    MAX_OPEN_FILES = 256
+    GROUP_MEMORY = 64 * 1024**2
+    MIN_CHUNK_SIZE = 4096
+
+    _logger = _module_logger.getChild('FileComparer')
+
+    ##############################################
+
+    def __init__(self, use_mmap: Optional[bool] = None) -> None:
+        self._use_mmap = use_mmap
+        self._lock = threading.Lock()
+        self._mount_points = None
+        # device -> is on a network file system
+        self._network_devices: Dict[int, bool] = {}
+        self._buffers = threading.local()
+
+    ##############################################
+
+    def is_network_device(self, device: int) -> bool:
+        with self._lock:
+            is_network = self._network_devices.get(device)
+            if is_network is None:
+                if self._mount_points is None:
+                    self._mount_points = MountPoints(include_system=True)
+                mount = self._mount_points.find_device(device)
+                is_network = mount is not None and mount.is_network
+                self._network_devices[device] = is_network
+            return is_network
+
+    ##############################################
+
+    def use_mmap(self, file1: 'File', file2: 'File') -> bool:
+        if self._use_mmap is not None:
+            return self._use_mmap
+        return (
+            file1.size >= self.MMAP_MIN_SIZE
+            and not self.is_network_device(file1.device)
+            and not self.is_network_device(file2.device)
+        )
+
+    ##############################################
+
+    def compare(self, file1: 'File', file2: 'File') -> bool:
+        """Return True if the files have the same content"""
+        size = file1.size
+        if size != file2.size:
+            return False
+        if not size:
+            return True
+        throttle = file1.THROTTLE
+        if throttle is not None:
+            throttle.metadata(1, file1.device)
+            throttle.metadata(1, file2.device)
+        use_mmap = self.use_mmap(file1, file2)
+        with file1.open(buffering=0) as fh1, file2.open(buffering=0) as fh2:
+            if use_mmap:
+                try:
+                    return self._compare_mmap(fh1, fh2, size, file1, file2)
+                except (OSError, ValueError):
+                    # e.g. a file system without mmap support
+                    self._logger.debug(f"Cannot map {file1} or {file2}")
+                    fh1.seek(0)
+                    fh2.seek(0)
+            return self._compare_read(fh1, fh2, size, file1, file2)
+
+    ##############################################
+
+    def _compare_mmap(self, fh1: BinaryIO, fh2: BinaryIO, size: int, file1: 'File', file2: 'File') -> bool:
+        memcmp = _get_memcmp()
+        throttle = file1.THROTTLE
+        window_size = self.WINDOW_SIZE
+        offset = 0
+        while offset < size:
+            length = min(window_size, size - offset)
+            # a private mapping is writable, thus ctypes can take its address, but it is never written
+            map1 = mmap.mmap(fh1.fileno(), length, access=mmap.ACCESS_COPY, offset=offset)
+            map2 = mmap.mmap(fh2.fileno(), length, access=mmap.ACCESS_COPY, offset=offset)
+            try:
+                for _ in (map1, map2):
+                    _.madvise(mmap.MADV_SEQUENTIAL)
+                array1 = (ctypes.c_char * length).from_buffer(map1)
+                array2 = (ctypes.c_char * length).from_buffer(map2)
+                try:
+                    if memcmp(array1, array2, length):
+                        return False
+                finally:
+                    # release the exports before closing the maps
+                    del array1, array2
+            finally:
+                map1.close()
+                map2.close()
+            if throttle is not None:
+                throttle.read(length, file1.device)
+                throttle.read(length, file2.device)
+            offset += length
+        return True
+
+    ##############################################
+
+    def _get_buffers(self) -> tuple:
+        buffers = getattr(self._buffers, 'buffers', None)
+        if buffers is None or len(buffers[0]) != self.BUFFER_SIZE:
+            buffers = tuple(bytearray(self.BUFFER_SIZE) for _ in range(2))
+            self._buffers.buffers = buffers
+        return buffers
+
+    ##############################################
+
+    def _compare_read(self, fh1: BinaryIO, fh2: BinaryIO, size: int, file1: 'File', file2: 'File') -> bool:
+        memcmp = _get_memcmp()
+        throttle = file1.THROTTLE
+        buffer1, buffer2 = self._get_buffers()
+        array1 = (ctypes.c_char * len(buffer1)).from_buffer(buffer1)
+        array2 = (ctypes.c_char * len(buffer2)).from_buffer(buffer2)
+        view1 = memoryview(buffer1)
+        view2 = memoryview(buffer2)
+        try:
+            offset = 0
+            while offset < size:
+                count1 = _read_full(fh1, view1)
+                count2 = _read_full(fh2, view2)
+                if count1 != count2:
+                    # a file was modified
+                    return False
+                if not count1:
+                    break
+                if memcmp(array1, array2, count1):
+                    return False
+                if throttle is not None:
+                    throttle.read(count1, file1.device)
+                    throttle.read(count2, file2.device)
+                offset += count1
+            return True
+        finally:
+            del array1, array2
+            view1.release()
+            view2.release()
+
+    ##############################################
+
+    def partition(self, files: Sequence['File']) -> List[List['File']]:
+        """Partition *files* in groups of files with the same content, the singletons included.
+
+        The files of the same size are read in lockstep by chunks, at most :attr:`BUFFER_SIZE` bytes
+        and :attr:`GROUP_MEMORY` for the group, and a group is split when the chunks differ.  A file
+        which has no match is closed at once.  The files beyond :attr:`MAX_OPEN_FILES` are compared
+        with the first file of each partition.
+
+        """
+        by_size = {}
+        for file_obj in files:
+            by_size.setdefault(file_obj.size, []).append(file_obj)
+        partitions = []
+        for size, group in by_size.items():
+            if len(group) == 1 or not size:
+                partitions.append(group)
+                continue
+            subgroups = self._partition_lockstep(group[:self.MAX_OPEN_FILES], size)
+            for file_obj in group[self.MAX_OPEN_FILES:]:
+                for subgroup in subgroups:
+                    if self.compare(subgroup[0], file_obj):
+                        subgroup.append(file_obj)
+                        break
+                else:
+                    subgroups.append([file_obj])
+            partitions.extend(subgroups)
+        return partitions
+
+    ##############################################
+
+    def _partition_lockstep(self, group: List['File'], size: int) -> List[List['File']]:
+        memcmp = _get_memcmp()
+        throttle = group[0].THROTTLE
+        chunk_size = max(self.MIN_CHUNK_SIZE, min(self.BUFFER_SIZE, self.GROUP_MEMORY // len(group)))
+        chunk_size = min(chunk_size, size)
+        partitions = []
+        with ExitStack() as stack:
+            # file, file handle, buffer view and ctypes array
+            members = []
+            for file_obj in group:
+                if throttle is not None:
+                    throttle.metadata(1, file_obj.device)
+                try:
+                    fh = stack.enter_context(file_obj.open(buffering=0))
+                except OSError as exception:
+                    self._logger.warning(f"Cannot open {file_obj}: {exception}")
+                    partitions.append([file_obj])
+                    continue
+                buffer = bytearray(chunk_size)
+                members.append((file_obj, fh, memoryview(buffer), (ctypes.c_char * chunk_size).from_buffer(buffer)))
+            if len(members) > 1:
+                active = [members]
+            else:
+                active = []
+                partitions.extend([_[0]] for _ in members)
+            offset = 0
+            while active and offset < size:
+                count = min(chunk_size, size - offset)
+                next_active = []
+                for subgroup in active:
+                    buckets = []
+                    for member in subgroup:
+                        file_obj, fh, view, array = member
+                        if _read_full(fh, view[:count]) != count:
+                            # the file was truncated
+                            partitions.append([file_obj])
+                            fh.close()
+                            continue
+                        if throttle is not None:
+                            throttle.read(count, file_obj.device)
+                        for bucket in buckets:
+                            if not memcmp(bucket[0][3], array, count):
+                                bucket.append(member)
+                                break
+                        else:
+                            buckets.append([member])
+                    for bucket in buckets:
+                        if len(bucket) > 1:
+                            next_active.append(bucket)
+                        else:
+                            partitions.append([bucket[0][0]])
+                            # release the descriptor
+                            bucket[0][1].close()
+                active = next_active
+                offset += count
+            partitions.extend([_[0] for _ in subgroup] for subgroup in active)
+        return partitions
+
+####################################################################################################
+
+_comparer = FileComparer()
+
+def compare_files(file1: 'File', file2: 'File') -> bool:
+    """Compare two files with a shared :class:`FileComparer`"""
+    return _comparer.compare(file1, file2)
+
+def partition_files(files: Sequence['File']) -> List[List['File']]:
+    """Partition files with a shared :class:`FileComparer`"""
+    return _comparer.partition(files)
@@ -45,21 +45,34 @@ DANGEROUS = True
 
 ####################################################################################################
 
+from errno import ENOSYS
 from pathlib import Path
-from typing import AnyStr, Optional, Type
-import hashlib
+from typing import TYPE_CHECKING, AnyStr, BinaryIO, Iterator, Optional, Type, Union
 import logging
 import os
+import stat
 import subprocess
+import threading
 
 import xattr
 
+from filewalker.common.hashing import get_backend
+from filewalker.os import statx as _statx
+from .compare import compare_files
+
+if TYPE_CHECKING:
+    from filewalker.common.throttle import IoThrottle
+    from filewalker.os.dirfd import DirectoryHandle
+
 ####################################################################################################
 
 _module_logger = logging.getLogger(__name__)
 
 LINESEP = os.linesep
 
+# read buffer of each thread, see File._chunk_buffer
+_buffers = threading.local()
+
 ####################################################################################################
 
 class File:
@@ -72,14 +85,36 @@ class File:
         '_stat',
         '_allocated_size',
         '_sha',
+        # feature caches, see extract_features
+        '_first_bytes',
+        '_last_bytes',
+        '_partial_sha',
         'user_data',
+        # handle of the parent directory, see filewalker.os.dirfd
+        'handle',
+        # rank of the file in a multi-root walk, see WalkerAbc.locate
+        'priority',
+        'depth',
     ]
 
-    SHA_METHOD = hashlib.sha1
+    # see filewalker.common.hashing
+    HASH_BACKEND = get_backend('sha1')
 
     SOME_BYTES_SIZE = 64    # rdfind uses 64
     PARTIAL_SHA_BYTES = 10 * 1024
 
+    # a checksum is computed by chunks read in a buffer of each thread, thus the memory doesn't
+    # depend on the file size
+    CHUNK_SIZE = 1024 * 1024
+
+    # Throttle the open and read calls, see filewalker.common.throttle
+    THROTTLE: Optional['IoThrottle'] = None
+
+    # Fetch the metadata using statx and only the fields which are used, see fetch_stat
+    USE_STATX = False
+    # flags passed to statx, e.g. AT_STATX_DONT_SYNC on a network file system
+    STATX_FLAGS = 0
+
     _logger = _module_logger.getChild('File')
 
     ##############################################
@@ -129,13 +164,40 @@ class File:
 
     ##############################################
 
-    def __init__(self, parent: bytes, name: bytes) -> None:
+    @classmethod
+    def from_dir_entry(cls, parent: bytes, entry: os.DirEntry) -> 'File':
+        """Make a file from a :class:`os.DirEntry` returned by :func:`os.scandir` on *parent*.
+
+        The stat cache is filled from the entry, it doesn't follow symbolic links.  If the entry is
+        bound to a directory handle, the file is bound to it while the handle is live.
+
+        """
+        file_obj = cls(parent, entry.name, getattr(entry, 'handle', None))
+        # DirEntry caches the lstat result
+        file_obj._stat = entry.stat(follow_symlinks=False)
+        return file_obj
+
+    ##############################################
+
+    @classmethod
+    def from_stat(cls, parent: bytes, name: bytes, stat_result: os.stat_result) -> 'File':
+        """Make a file and fill the stat cache with *stat_result*"""
+        file_obj = cls(parent, name)
+        file_obj._stat = stat_result
+        return file_obj
+
+    ##############################################
+
+    def __init__(self, parent: bytes, name: bytes, handle: Optional['DirectoryHandle'] = None) -> None:
         # Fixme: design
         #  why bytes and not str or Path ???
         if not name:
             raise ValueError("name must be provided")
         self._parent = parent
         self._name = name
+        self.handle = handle
+        self.priority = 0
+        self.depth = 0
         self.vacuum()
 
     ##############################################
@@ -144,10 +206,36 @@ class File:
         self._stat = None
         self._allocated_size = None
         self._sha = None
+        self._first_bytes = None
+        self._last_bytes = None
+        self._partial_sha = None
         self.user_data = None
 
     ##############################################
 
+    def __getstate__(self) -> tuple:
+        # a directory handle is bound to this process
+        return None, {_: getattr(self, _) for _ in self.__slots__ if _ != 'handle'}
+
+    def __setstate__(self, state: tuple) -> None:
+        # the slots added since the state was saved
+        self.priority = self.depth = 0
+        self.vacuum()
+        for key, value in state[1].items():
+            setattr(self, key, value)
+        self.handle = None
+
+    ##############################################
+
+    def _live_handle(self) -> Optional['DirectoryHandle']:
+        # once the walk closed its handles, a handle would reopen the directory for a single call
+        handle = self.handle
+        if handle is not None and not handle.live:
+            handle = self.handle = None
+        return handle
+
+    ##############################################
+
     @property
     def parent(self) -> bytes:
         return self._parent
@@ -207,49 +295,105 @@ class File:
 
     @property
     def is_symlink(self) -> bool:
-        return os.path.islink(self.path_bytes)
+        # stat doesn't follow symbolic links
+        return stat.S_ISLNK(self.fetch_stat(_statx.STATX_TYPE).st_mode)
 
     ##############################################
 
     @property
     def stat(self) -> os.stat_result:
+        return self.fetch_stat()
+
+    ##############################################
+
+    def fetch_stat(self, mask: int = _statx.STATX_BASIC_STATS) -> os.stat_result:
+        """Return the stat cache, fetch it if the fields *mask* are missing.
+
+        If :attr:`USE_STATX` is set, only the fields *mask* are requested to statx, else the cache is
+        filled by :func:`os.lstat`.  If statx is not available or the file system omits a requested
+        basic field, the cache is also filled by :func:`os.lstat`, a field which was requested is
+        never requested again.  In
+        both cases, symbolic links are not followed and the name is resolved relative to
+        :attr:`handle` if it is live.
+
+        """
         # if not hasattr(self, '_stat'):
-        if self._stat is None:
-            # does not follow symbolic links
-            self._stat = os.lstat(self.path_bytes)
+        _stat = self._stat
+        if _stat is None:
+            if self.USE_STATX:
+                self._stat = self._statx(mask)
+            else:
+                self._stat = self._lstat()
+        elif isinstance(_stat, _statx.StatxResult) and _stat.missing(mask):
+            # keep the fields already fetched
+            self._stat = self._statx(mask | _stat.requested)
         return self._stat
 
+    def _lstat(self) -> os.stat_result:
+        handle = self._live_handle()
+        if handle is not None:
+            return handle.lstat(self._name)
+        # does not follow symbolic links
+        return os.lstat(self.path_bytes)
+
+    def _statx(self, mask: int) -> Union[_statx.StatxResult, os.stat_result]:
+        flags = _statx.AT_SYMLINK_NOFOLLOW | self.STATX_FLAGS
+        handle = self._live_handle()
+        try:
+            if handle is not None:
+                stat_result = handle.statx(self._name, mask, flags)
+            else:
+                stat_result = _statx.statx(self.path_bytes, mask, flags)
+        except OSError as exception:
+            if exception.errno != ENOSYS:
+                raise
+            # statx is not provided by the C library or the kernel
+            return self._lstat()
+        if not stat_result.has(mask & _statx.STATX_BASIC_STATS):
+            # os.lstat fills all the basic fields
+            return self._lstat()
+        return stat_result
+
+    ##############################################
+
+    def open(self, buffering: int = -1) -> BinaryIO:
+        """Open the file for reading, relative to :attr:`handle` if it is live"""
+        handle = self._live_handle()
+        if handle is not None:
+            return open(handle.open(self._name), 'rb', buffering=buffering)
+        return open(self.path_bytes, 'rb', buffering=buffering)
+
     ##############################################
 
     @property
     def is_empty(self) -> bool:
-        return self.stat.st_size == 0
+        return self.fetch_stat(_statx.STATX_SIZE).st_size == 0
 
     ##############################################
 
     @property
     def size(self) -> int:
-        return self.stat.st_size
+        return self.fetch_stat(_statx.STATX_SIZE).st_size
 
     @property
     def inode(self) -> int:
-        return self.stat.st_ino
+        return self.fetch_stat(_statx.STATX_INO).st_ino
 
     @property
     def device(self) -> int:
-        return self.stat.st_dev
+        return self.fetch_stat(_statx.STATX_INO).st_dev
 
     @property
     def mtime(self) -> int:
-        return self.stat.st_mtime_ns
+        return self.fetch_stat(_statx.STATX_MTIME).st_mtime_ns
 
     @property
     def uid(self) -> int:
-        return self.stat.st_uid
+        return self.fetch_stat(_statx.STATX_UID).st_uid
 
     @property
     def gid(self) -> int:
-        return self.stat.st_gid
+        return self.fetch_stat(_statx.STATX_GID).st_gid
 
     ##############################################
 
@@ -261,7 +405,7 @@ class File:
         # ST_NBLOCKS (*sb) * ST_NBLOCKSIZE
         # if not hasattr(self, '_allocated_size'):
         if self._allocated_size is None:
-            self._allocated_size = self.stat.st_blocks * 512
+            self._allocated_size = self.fetch_stat(_statx.STATX_BLOCKS).st_blocks * 512
         return self._allocated_size
 
     ##############################################
@@ -270,7 +414,10 @@ class File:
         # unlikely to happen
         # if self.is_empty:
         #     return b''
-        with open(self.path_bytes, 'rb') as fh:
+        throttle = self.THROTTLE
+        if throttle is not None:
+            throttle.metadata(1, self.device)
+        with self.open() as fh:
             if size is not None and size < 0:
                 if abs(size) < self.size:
                     fh.seek(size, os.SEEK_END)
@@ -278,18 +425,124 @@ class File:
                 else:
                     size = None
             data = fh.read(size)
+        if throttle is not None:
+            throttle.read(len(data), self.device)
         return data
 
     ##############################################
 
+    @classmethod
+    def _chunk_buffer(cls) -> memoryview:
+        """Return the read buffer of the calling thread, it is allocated once"""
+        buffer = getattr(_buffers, 'buffer', None)
+        if buffer is None or len(buffer) != cls.CHUNK_SIZE:
+            buffer = _buffers.buffer = memoryview(bytearray(cls.CHUNK_SIZE))
+        return buffer
+
+    ##############################################
+
+    def _iter_chunks(self, fh: BinaryIO, size: Optional[int] = None) -> Iterator[memoryview]:
+        """Read the next *size* bytes, or up to the end, of the raw file *fh* by chunks of
+        :attr:`CHUNK_SIZE` bytes.  A chunk is only valid until the next one.
+
+        """
+        throttle = self.THROTTLE
+        buffer = self._chunk_buffer()
+        chunk_size = len(buffer)
+        while size is None or size > 0:
+            view = buffer if size is None or size >= chunk_size else buffer[:size]
+            # readinto a raw file doesn't copy
+            count = fh.readinto(view)
+            if not count:
+                break
+            if size is not None:
+                size -= count
+            if throttle is not None:
+                throttle.read(count, self.device)
+            yield view[:count]
+
+    ##############################################
+
+    def _hash_content(self, size: Optional[int] = None) -> str:
+        """Return the checksum of the first *size* bytes, or of the whole file"""
+        throttle = self.THROTTLE
+        if throttle is not None:
+            throttle.metadata(1, self.device)
+        hasher = self.HASH_BACKEND.new()
+        with self.open(buffering=0) as fh:
+            for chunk in self._iter_chunks(fh, size):
+                hasher.update(chunk)
+        return hasher.hexdigest()
+
+    ##############################################
+
+    def extract_features(self,
+                         first: bool = False,
+                         last: bool = False,
+                         partial: bool = False,
+                         sha: bool = False,
+                         ) -> None:
+        """Fill the caches of the *first* bytes, *last* bytes, *partial* checksum and *sha* features
+        with the default sizes, the file is opened once for all the missing features.
+
+        When the file is read from the beginning for a checksum, the first bytes are taken from the
+        first chunk.
+
+        """
+        first = first and self._first_bytes is None
+        last = last and self._last_bytes is None
+        partial = partial and self._partial_sha is None
+        sha = sha and self._sha is None
+        if not (first or last or partial or sha):
+            return
+        size = self.size
+        if not size:
+            self._first_bytes = self._last_bytes = b''
+            self._partial_sha = self._sha = ''
+            return
+        throttle = self.THROTTLE
+        if throttle is not None:
+            throttle.metadata(1, self.device)
+        some_bytes_size = self.SOME_BYTES_SIZE
+        with self.open(buffering=0) as fh:
+            if last:
+                if size > some_bytes_size:
+                    fh.seek(-some_bytes_size, os.SEEK_END)
+                self._last_bytes = b''.join(bytes(_) for _ in self._iter_chunks(fh, some_bytes_size))
+                fh.seek(0)
+            if partial or sha:
+                full_hasher = self.HASH_BACKEND.new() if sha else None
+                partial_hasher = self.HASH_BACKEND.new() if partial else None
+                # the partial checksum is the full one for a small file
+                partial_size = self.PARTIAL_SHA_BYTES
+                head = b''
+                read_size = None if sha else max(partial_size, some_bytes_size if first else 0)
+                for chunk in self._iter_chunks(fh, read_size):
+                    if first and len(head) < some_bytes_size:
+                        head += bytes(chunk[:some_bytes_size - len(head)])
+                    if full_hasher is not None:
+                        full_hasher.update(chunk)
+                    if partial_hasher is not None and partial_size > 0:
+                        partial_hasher.update(chunk[:partial_size])
+                        partial_size -= len(chunk)
+                if first:
+                    self._first_bytes = head
+                if sha:
+                    self._sha = full_hasher.hexdigest()
+                if partial:
+                    self._partial_sha = partial_hasher.hexdigest()
+            elif first:
+                self._first_bytes = b''.join(bytes(_) for _ in self._iter_chunks(fh, some_bytes_size))
+
+    ##############################################
+
     @property
     def sha(self) -> str:
         if self._sha is None:
             if self.is_empty:
                 self._sha = ''
             else:
-                data = self._read_content()
-                self._sha = self.SHA_METHOD(data).hexdigest()
+                self._sha = self._hash_content()
         return self._sha
 
     ##############################################
@@ -298,30 +551,39 @@ class File:
         if self.is_empty:
             return ''
         if size is None:
-            size = self.PARTIAL_SHA_BYTES
-        data = self._read_content(size)
-        return self.SHA_METHOD(data).hexdigest()
+            if self._partial_sha is None:
+                self._partial_sha = self._hash_content(self.PARTIAL_SHA_BYTES)
+            return self._partial_sha
+        return self._hash_content(size)
 
     ##############################################
 
-    def first_bytes(self, size: Optional[int] = None) -> str:
+    def first_bytes(self, size: Optional[int] = None) -> bytes:
         if size is None:
-            size = self.SOME_BYTES_SIZE
+            if self._first_bytes is None:
+                self._first_bytes = self._read_content(self.SOME_BYTES_SIZE)
+            return self._first_bytes
         return self._read_content(size)
 
     ##############################################
 
-    def last_bytes(self, size: Optional[int] = None) -> str:
+    def last_bytes(self, size: Optional[int] = None) -> bytes:
         if size is None:
-            size = self.SOME_BYTES_SIZE
+            if self._last_bytes is None:
+                self._last_bytes = self._read_content(-self.SOME_BYTES_SIZE)
+            return self._last_bytes
         return self._read_content(-size)
 
     ##############################################
 
     def compare_with(self, other: 'File', posix: bool = False) -> bool:
+        """Compare the content with *other*, see :mod:`filewalker.path.compare`, *posix* runs
+        `cmp`.
+
+        """
         if posix:
             return self._compare_with_posix(other)
-        return self._compare_with_py(other)
+        return compare_files(self, other)
 
     ##############################################
 
@@ -333,35 +595,17 @@ class File:
 
     ##############################################
 
-    def _compare_with_py(self, other: 'File') -> bool:
-        size = self.size
-        if size != other.size:
-            return False
-
-        # Fixme: check < CHUNK_SIZE, > CHUNK_SIZE, = CHUNK_SIZE +1, ...
-        CHUNK_SIZE = 1024
-        with open(self.path_bytes, 'rb') as fh1:
-            with open(other.path_bytes, 'rb') as fh2:
-                offset = 0
-                while offset < size:
-                    offset += CHUNK_SIZE
-                    fh1.seek(offset)
-                    fh2.seek(offset)
-                    data1 = fh1.read(CHUNK_SIZE)
-                    data2 = fh2.read(CHUNK_SIZE)
-                    if data1 != data2:
-                        return False
-            return True
-
-    ##############################################
-
     def is_identical_to(self, other: 'File'):
+        if self.is_empty or self.size != other.size:
+            return False
+        # a session per file for the cheap features, the checksum only if they match
+        partial = self.size > self.PARTIAL_SHA_BYTES
+        for file_obj in (self, other):
+            file_obj.extract_features(first=True, last=True, partial=partial)
         return (
-            not self.is_empty
-            and self.size == other.size
-            and self.first_bytes == other.first_bytes
-            and self.last_bytes == other.last_bytes
-            and (self.size <= self.PARTIAL_SHA_BYTES or self.partial_sha() == other.partial_sha())
+            self.first_bytes() == other.first_bytes()
+            and self.last_bytes() == other.last_bytes()
+            and (not partial or self.partial_sha() == other.partial_sha())
             and self.sha == other.sha
             and self.compare_with(other)
         )
@@ -0,0 +1,260 @@
+####################################################################################################
+#
+# filewalker — ...
+# Copyright (C) 2020 Fabrice Salvaire
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+####################################################################################################
+
+"""Module to implement a multi-threaded walk.
+
+Directory listing and `lstat` release the GIL, thus several threads can keep a fast device or a
+network file system busy.  Each worker owns a double-ended queue of directories to be listed: it
+pushes and pops the subdirectories it discovers on its own side (depth-first) and, when its queue
+is empty, it steals the oldest directories from the other workers (breadth-first), which are
+likely the largest subtrees.
+
+"""
+
+####################################################################################################
+
+__all__ = ['ParallelWalk', 'WorkStealingQueue']
+
+####################################################################################################
+
+from collections import deque
+from typing import TYPE_CHECKING, Any, Callable, Iterator, List, Optional, Tuple
+import logging
+import queue
+import threading
+
+if TYPE_CHECKING:
+    from .walker import WalkerAbc, WalkOptions, WalkStep
+
+####################################################################################################
+
+_module_logger = logging.getLogger(__name__)
+
+####################################################################################################
+
+class WorkStealingQueue:
+
+    """Class to implement a work-stealing queue shared by *number_of_workers* workers.
+
+    The queue counts the pending tasks, i.e. queued items and items being processed, and :meth:`get`
+    returns :attr:`DONE` when all the tasks are done.
+
+    """
+
+    DONE = object()
+
+    ##############################################
+
+    def __init__(self, number_of_workers: int) -> None:
+        if number_of_workers < 1:
+            raise ValueError(f"Invalid number of workers {number_of_workers}")
+        self._deques = [deque() for _ in range(number_of_workers)]
+        self._condition = threading.Condition()
+        self._pending = 0
+        self._aborted = False
+
+    ##############################################
+
+    @property
+    def number_of_workers(self) -> int:
+        return len(self._deques)
+
+    @property
+    def aborted(self) -> bool:
+        return self._aborted
+
+    @property
+    def finished(self) -> bool:
+        return self._aborted or not self._pending
+
+    ##############################################
+
+    def put(self, worker: int, item: Any) -> None:
+        with self._condition:
+            self._pending += 1
+            self._deques[worker].append(item)
+            self._condition.notify()
+
+    ##############################################
+
+    def _pop(self, worker: int) -> Any:
+        # deque.pop and deque.popleft are atomic
+        try:
+            return self._deques[worker].pop()
+        except IndexError:
+            pass
+        number_of_workers = len(self._deques)
+        for i in range(1, number_of_workers):
+            try:
+                return self._deques[(worker + i) % number_of_workers].popleft()
+            except IndexError:
+                pass
+        return None
+
+    ##############################################
+
+    def get(self, worker: int) -> Any:
+        """Return an item for *worker*, wait if the queues are empty but tasks are pending."""
+        if not self._aborted:
+            item = self._pop(worker)
+            if item is not None:
+                return item
+        with self._condition:
+            while True:
+                if self._aborted:
+                    return self.DONE
+                item = self._pop(worker)
+                if item is not None:
+                    return item
+                if not self._pending:
+                    return self.DONE
+                self._condition.wait()
+
+    ##############################################
+
+    def task_done(self) -> None:
+        with self._condition:
+            self._pending -= 1
+            if not self._pending:
+                self._condition.notify_all()
+
+    ##############################################
+
+    def abort(self) -> None:
+        with self._condition:
+            self._aborted = True
+            self._condition.notify_all()
+
+####################################################################################################
+
+class ParallelWalk:
+
+    """Class to walk a file hierarchy with several threads.
+
+    If *consumer* is None, the steps are serialized through a bounded queue and are yielded by
+    :meth:`__iter__` in the calling thread, thus the walker callbacks don't have to be thread-safe.
+    Else the workers call *consumer* concurrently and :meth:`__iter__` yields nothing.
+
+    The walk starts from the list *tops* of :code:`(path, depth)`.
+
+    The steps are yielded in completion order, a directory is always yielded before its
+    subdirectories since they are queued once its step is emitted.  The subdirectories are selected
+    before, thus the walk cannot be pruned by modifying the yielded directory list.
+
+    """
+
+    _logger = _module_logger.getChild('ParallelWalk')
+
+    RESULT_QUEUE_SIZE = 1024
+    POLL_TIMEOUT = .1   # s
+
+    ##############################################
+
+    def __init__(self,
+                 walker: 'WalkerAbc',
+                 tops: List[Tuple[bytes, int]],
+                 workers: int,
+                 options: 'WalkOptions',
+                 consumer: Optional[Callable[['WalkStep'], None]] = None,
+                 ) -> None:
+        self._walker = walker
+        self._tops = tops
+        self._options = options
+        self._consumer = consumer
+        self._queue = WorkStealingQueue(workers)
+        self._results = queue.Queue(self.RESULT_QUEUE_SIZE)
+        self._exception = None
+        self._closed = False
+
+    ##############################################
+
+    def _emit(self, step: 'WalkStep') -> None:
+        if self._consumer is not None and step is not WorkStealingQueue.DONE:
+            self._consumer(step)
+            return
+        # poll to don't block forever if the consumer gave up
+        while not self._closed:
+            try:
+                self._results.put(step, timeout=self.POLL_TIMEOUT)
+                return
+            except queue.Full:
+                pass
+
+    ##############################################
+
+    def _work(self, worker: int) -> None:
+        walker = self._walker
+        throttle = self._options.throttle
+        workers = self._queue.number_of_workers
+        try:
+            while True:
+                if throttle is not None:
+                    # an adaptive throttle can park some workers
+                    while not (throttle.wait_worker(worker, workers) or self._queue.finished):
+                        pass
+                item = self._queue.get(worker)
+                if item is WorkStealingQueue.DONE:
+                    break
+                try:
+                    dirpath, depth = item
+                    step = walker._list_directory(dirpath, self._options)
+                    children = walker._children(dirpath, step[1], depth, self._options)
+                    # emit before the subdirectories can be listed by another worker
+                    self._emit(step)
+                    for child in children:
+                        self._queue.put(worker, child)
+                finally:
+                    self._queue.task_done()
+        except BaseException as exception:
+            self._exception = exception
+            self._queue.abort()
+        finally:
+            if self._consumer is None:
+                # tell the consumer this worker is done
+                self._emit(WorkStealingQueue.DONE)
+
+    ##############################################
+
+    def __iter__(self) -> Iterator['WalkStep']:
+        for i, item in enumerate(self._tops):
+            self._queue.put(i % self._queue.number_of_workers, item)
+        threads = [
+            threading.Thread(target=self._work, args=(_,), name=f'walker-{_}', daemon=True)
+            for _ in range(self._queue.number_of_workers)
+        ]
+        for _ in threads:
+            _.start()
+        try:
+            if self._consumer is None:
+                running = len(threads)
+                while running:
+                    step = self._results.get()
+                    if step is WorkStealingQueue.DONE:
+                        running -= 1
+                    else:
+                        yield step
+            for _ in threads:
+                _.join()
+        finally:
+            # the consumer could have closed the generator
+            self._closed = True
+            self._queue.abort()
+        if self._exception is not None:
+            raise self._exception
@@ -0,0 +1,186 @@
+####################################################################################################
+#
+# filewalker — ...
+# Copyright (C) 2020 Fabrice Salvaire
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+####################################################################################################
+
+"""Module to prune a walk like updatedb(8), see updatedb.conf(5).
+
+The configuration is evaluated when a subdirectory is about to be walked: a directory matched by
+*PRUNEFS*, *PRUNEPATHS*, *PRUNENAMES* or *PRUNE_BIND_MOUNTS* is never listed, thus the file systems
+mounted below it are skipped too.  The mount table is read once, so pruning costs set lookups and no
+syscall.
+
+A directory that contains a valid `CACHEDIR.TAG` file, see https://bford.info/cachedir, is listed
+but its content is discarded.
+
+"""
+
+####################################################################################################
+
+__all__ = ['PruneConfig']
+
+####################################################################################################
+
+from pathlib import Path
+from typing import AnyStr, Iterable, Optional, Union
+import logging
+import os
+import re
+
+from filewalker.os.linux import MountPoints
+
+####################################################################################################
+
+_module_logger = logging.getLogger(__name__)
+
+####################################################################################################
+
+class PruneConfig:
+
+    """Class to implement an updatedb.conf prune configuration.
+
+    Usage::
+
+        # skip pseudo file systems
+        prune_config = PruneConfig(prune_fs=MountPoints.SYSTEM_TYPES, cachedir_tag=True)
+        prune_config = PruneConfig.from_updatedb_conf()
+        walker.run(prune_config=prune_config)
+
+    """
+
+    _logger = _module_logger.getChild('PruneConfig')
+
+    UPDATEDB_CONF = '/etc/updatedb.conf'
+
+    CACHEDIR_TAG = b'CACHEDIR.TAG'
+    CACHEDIR_SIGNATURE = b'Signature: 8a477f597d28d172789f06886806bc55'
+
+    ##############################################
+
+    @staticmethod
+    def parse_updatedb_conf(text: str) -> dict:
+        """Parse the content of an updatedb.conf file and return a dict"""
+        variables = {}
+        for line in text.splitlines():
+            # a # outside of a quoted string starts a comment
+            match = re.match(r'^\s*([A-Za-z_][A-Za-z0-9_]*)\s*=\s*"([^"]*)"\s*(#.*)?$', line)
+            if match is not None:
+                variables[match.group(1)] = match.group(2)
+            elif line.strip() and not line.strip().startswith('#'):
+                raise ValueError(f"Invalid line in updatedb.conf: {line}")
+        return variables
+
+    ##############################################
+
+    @classmethod
+    def from_updatedb_conf(cls, path: Union[AnyStr, Path] = UPDATEDB_CONF, **kwargs) -> 'PruneConfig':
+        """Make a configuration from an updatedb.conf file, *kwargs* are passed to the constructor"""
+        with open(path, encoding='utf-8') as fh:
+            variables = cls.parse_updatedb_conf(fh.read())
+        return cls(
+            prune_fs=variables.get('PRUNEFS', '').split(),
+            prune_paths=variables.get('PRUNEPATHS', '').split(),
+            prune_names=variables.get('PRUNENAMES', '').split(),
+            prune_bind_mounts=variables.get('PRUNE_BIND_MOUNTS', 'no').lower() in ('1', 'yes'),
+            **kwargs,
+        )
+
+    ##############################################
+
+    def __init__(self,
+                 prune_fs: Iterable[str] = (),
+                 prune_paths: Iterable[Union[AnyStr, Path]] = (),
+                 prune_names: Iterable[AnyStr] = (),
+                 prune_bind_mounts: bool = False,
+                 cachedir_tag: bool = False,
+                 mount_points: Optional[MountPoints] = None,
+                 ) -> None:
+        # file system type matching is case-insensitive
+        self._prune_fs = frozenset(_.lower() for _ in prune_fs)
+        self._prune_paths = frozenset(os.fsencode(_).rstrip(b'/') or b'/' for _ in prune_paths)
+        self._prune_names = frozenset(os.fsencode(_) for _ in prune_names)
+        self._prune_bind_mounts = prune_bind_mounts
+        self._cachedir_tag = cachedir_tag
+        self._pruned_mount_points = frozenset()
+        if self._prune_fs or prune_bind_mounts:
+            if mount_points is None:
+                mount_points = MountPoints(include_system=True)
+            self._pruned_mount_points = frozenset(
+                os.fsencode(_.mount_point)
+                for _ in mount_points
+                if _.type.lower() in self._prune_fs or (prune_bind_mounts and _.is_bind)
+            )
+
+    ##############################################
+
+    @property
+    def prune_fs(self) -> frozenset[str]:
+        return self._prune_fs
+
+    @property
+    def prune_paths(self) -> frozenset[bytes]:
+        return self._prune_paths
+
+    @property
+    def prune_names(self) -> frozenset[bytes]:
+        return self._prune_names
+
+    @property
+    def prune_bind_mounts(self) -> bool:
+        return self._prune_bind_mounts
+
+    @property
+    def cachedir_tag(self) -> bool:
+        return self._cachedir_tag
+
+    @property
+    def pruned_mount_points(self) -> frozenset[bytes]:
+        return self._pruned_mount_points
+
+    ##############################################
+
+    def is_pruned(self, path: bytes, name: bytes) -> bool:
+        """Return True if the directory *path* with basename *name* must not be walked"""
+        return (
+            name in self._prune_names
+            or path in self._prune_paths
+            or path in self._pruned_mount_points
+        )
+
+    ##############################################
+
+    def is_cache_directory(self, dirpath: bytes, files: Iterable[os.DirEntry]) -> bool:
+        """Return True if the listing *files* of *dirpath* contains a valid CACHEDIR.TAG"""
+        if not self._cachedir_tag:
+            return False
+        for entry in files:
+            if entry.name == self.CACHEDIR_TAG:
+                return self.has_cachedir_tag(dirpath)
+        return False
+
+    ##############################################
+
+    def has_cachedir_tag(self, dirpath: bytes) -> bool:
+        """Return True if *dirpath* contains a valid CACHEDIR.TAG, without a listing"""
+        if not self._cachedir_tag:
+            return False
+        try:
+            with open(os.path.join(dirpath, self.CACHEDIR_TAG), 'rb') as fh:
+                return fh.read(len(self.CACHEDIR_SIGNATURE)) == self.CACHEDIR_SIGNATURE
+        except OSError:
+            return False
@@ -18,32 +18,795 @@
 #
 ####################################################################################################
 
+"""Module to walk in a file hierarchy.
+
+The walker is built on :func:`os.scandir` so the callbacks receive :class:`os.DirEntry` objects,
+which carry the file type (*d_type*) and cache the result of their :meth:`os.DirEntry.stat` call.
+A walk on a large volume then requires roughly one `lstat` per file instead of several.
+
+"""
+
+####################################################################################################
+
+__all__ = ['WalkerAbc']
+
+####################################################################################################
+
 # from os import PathLike
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from errno import ENOSYS
+from operator import attrgetter
 from pathlib import Path
-from typing import AnyStr, List, Union
+from typing import (
+    TYPE_CHECKING, Any, AnyStr, AsyncIterator, Callable, Iterable, Iterator, List, Optional, Sequence, Tuple, Union,
+)
+import asyncio
+import contextlib
+import copy
+import logging
 import os
+import threading
+
+from filewalker.os.dirfd import DirectoryHandles
+from filewalker.os.getdents import BUFFER_SIZE as DIRENT_BUFFER_SIZE, iter_dir_entries
+from filewalker.os.linux import MountPoints, is_rotational
+from .parallel import ParallelWalk
+
+if TYPE_CHECKING:
+    from filewalker.common.throttle import IoThrottle
+    from filewalker.os.linux import MountPoint
+    from .cache import DirectoryCache
+    from .prune import PruneConfig
+
+####################################################################################################
+
+_module_logger = logging.getLogger(__name__)
+
+type DirEntryList = List[os.DirEntry]
+type WalkStep = Tuple[bytes, DirEntryList, DirEntryList]
+type PrunePredicate = Callable[[bytes, os.DirEntry, int], bool]
+
+####################################################################################################
+
+class WalkOptions:
+
+    """Class to hold the options of a walk:
+
+    * *sort*: sort the subdirectories, see :meth:`WalkerAbc.sort_directories`,
+    * *follow_links*: walk the symbolic links to directories, a directory is walked once whatever
+      the number of links to it, see :meth:`WalkerAbc.on_duplicate_directory`,
+    * *max_depth*: if >= 0, don't list the directories deeper than *max_depth*, the top directory
+      has depth 0,
+    * *prune*: predicate :code:`prune(dirpath, entry, depth)` to prune a subdirectory before it is
+      listed, see also :meth:`WalkerAbc.prune_directory`,
+    * *prune_config*: an updatedb.conf like :class:`filewalker.path.prune.PruneConfig`,
+    * *prefetch_stat*: call `lstat` on the files when the directory is listed so the entries cache
+      the results, it is useful when the directories are listed by worker threads,
+    * *one_file_system*: don't walk the directories on other file systems, like `find -xdev`,
+    * *report_mount_points*: look up the skipped mount points in
+      :class:`filewalker.os.linux.MountPoints` and report them to
+      :meth:`WalkerAbc.on_skipped_mount_point`,
+    * *throttle*: an :class:`filewalker.common.throttle.IoThrottle` to limit the metadata operations,
+      they are accounted to the device of the top directory.  An adaptive throttle also limits the
+      number of running workers,
+    * *cache*: a :class:`filewalker.path.cache.DirectoryCache` to reuse the listing of the
+      directories which didn't change since the previous walk,
+    * *large_directory*: if set, the directories whose `st_size` is at least *large_directory* bytes
+      are read with getdents64 and a *dirent_buffer_size* buffer, see
+      :mod:`filewalker.os.getdents`.  It costs a stat per directory.  The serial walk yields the
+      files of a large directory by batches, see :meth:`WalkerAbc.walk`.
+    * *inode_order*: sort the subdirectories and the files by inode number instead of *sort*, thus
+      the walk and the stat batch read the inode tables mostly sequentially on a rotating disk.  It
+      can be True, :code:`'auto'` for the rotating disks, or a collection of devices given by their
+      :code:`st_dev` or a path on them.  Unless *one_file_system* is set, the per device modes cost
+      a stat of the listed directory, whose inode is cached.
+    * *dir_fds*: if > 0, the walk holds up to *dir_fds* open directory descriptors, see
+      :class:`filewalker.os.dirfd.DirectoryHandles`.  A directory is opened relative to its parent
+      and read with getdents64, and the entries are
+      :class:`filewalker.os.getdents.RawDirEntry` whose stat calls are relative to the handle of the
+      directory, thus the kernel resolves a single name instead of the whole path.  After the walk,
+      the entries and the files fall back to their path.
+
+    *device*, *root_devices*, *mount_points*, *inode_order_devices*, *visited* and *handles* are set
+    by the walker.
+
+    """
+
+    __slots__ = [
+        'sort',
+        'follow_links',
+        'max_depth',
+        'prune',
+        'prune_config',
+        'prefetch_stat',
+        'one_file_system',
+        'report_mount_points',
+        'throttle',
+        'cache',
+        'large_directory',
+        'dirent_buffer_size',
+        'inode_order',
+        'dir_fds',
+        'device',
+        'root_devices',
+        'mount_points',
+        'inode_order_devices',
+        'visited',
+        'handles',
+    ]
+
+    _WALKER_SLOTS = ('device', 'root_devices', 'mount_points', 'inode_order_devices', 'visited', 'handles')
+
+    ##############################################
+
+    def __init__(self,
+                 sort: bool = False,
+                 follow_links: bool = False,
+                 max_depth: int = -1,
+                 prune: Optional[PrunePredicate] = None,
+                 prune_config: Optional['PruneConfig'] = None,
+                 prefetch_stat: bool = False,
+                 one_file_system: bool = False,
+                 report_mount_points: bool = False,
+                 throttle: Optional['IoThrottle'] = None,
+                 cache: Optional['DirectoryCache'] = None,
+                 large_directory: Optional[int] = None,
+                 dirent_buffer_size: int = DIRENT_BUFFER_SIZE,
+                 inode_order: Union[bool, str, Iterable[Union[int, AnyStr, Path]]] = False,
+                 dir_fds: int = 0,
+                 ) -> None:
+        self.sort = sort
+        self.follow_links = follow_links
+        self.max_depth = max_depth
+        self.prune = prune
+        self.prune_config = prune_config
+        self.prefetch_stat = prefetch_stat
+        self.one_file_system = one_file_system
+        self.report_mount_points = report_mount_points
+        self.throttle = throttle
+        self.cache = cache
+        self.large_directory = large_directory
+        self.dirent_buffer_size = dirent_buffer_size
+        self.inode_order = inode_order
+        self.dir_fds = dir_fds
+        self.device = None
+        self.root_devices = None
+        self.mount_points = None
+        self.inode_order_devices = None
+        self.visited = None
+        self.handles = None
+
+    ##############################################
+
+    def close(self) -> None:
+        """Close the directory descriptors, the handles of the entries are no longer live"""
+        if self.handles is not None:
+            self.handles.close()
+
+    ##############################################
+
+    @classmethod
+    def from_kwargs(cls, kwargs: dict) -> 'WalkOptions':
+        """Make options from the keyword arguments that match an option"""
+        return cls(**{
+            key: value
+            for key, value in kwargs.items()
+            if key in cls.__slots__ and key not in cls._WALKER_SLOTS
+        })
+
+####################################################################################################
+
+class _VisitedSet:
+
+    """Class to implement a thread-safe set of directories, keyed by :code:`(st_dev << 64) + st_ino`"""
+
+    ##############################################
+
+    def __init__(self) -> None:
+        self._keys = set()
+        self._lock = threading.Lock()
+
+    ##############################################
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    ##############################################
+
+    def add(self, stat_result: os.stat_result) -> bool:
+        """Add a directory, return False if it was already visited"""
+        # an int is more compact than a tuple
+        key = (stat_result.st_dev << 64) + stat_result.st_ino
+        with self._lock:
+            if key in self._keys:
+                return False
+            self._keys.add(key)
+            return True
+
+####################################################################################################
+
+def _run_shard(shard: 'WalkerAbc', kwargs: dict) -> Any:
+    """Run a shard in a worker process"""
+    shard.run(**kwargs)
+    return shard.shard_result()
 
 ####################################################################################################
 
 class WalkerAbc:
 
-    """Base class to implement a walk in a file hierarchy."""
+    """Base class to implement a walk in a file hierarchy.
+
+    A subclass can implement these callbacks:
+
+    * :code:`on_directory(dirpath: bytes, entry: os.DirEntry)`
+    * :code:`on_filename(dirpath: bytes, entry: os.DirEntry)`
+
+    where *entry.name* is a bytes and *entry.path* is the joined path.
+
+    Without subclassing, :meth:`iter_files` and :meth:`iter_dirs` yield the entries lazily.
+
+    The walker accepts a list of roots ranked by priority, the first root has the highest priority
+    0, like rdfind.  A root nested in, or identical to, a root of higher priority is skipped since
+    it is walked with it.  A root nested in a root of lower priority is excluded from its walk,
+    thus no subtree is walked twice.  See :meth:`locate`.
+
+    To run the walk in a process pool, see :meth:`run_sharded`, a subclass must implement:
+
+    * :code:`shard_result() -> Any` to return a compact and picklable result,
+    * :code:`merge_shard_result(result: Any)` to merge it in the parent walker.
+
+    """
+
+    _logger = _module_logger.getChild('WalkerAbc')
+
+    # paths of the directories that must not be walked
+    _excluded = frozenset()
+    # depth of the top directory, it is not null for a shard
+    _top_depth = 0
+    # roots to be walked with their depth, if there are several
+    _tops = None
 
     ##############################################
 
     # def __init__(self, path : Union[AnyStr, PathLike[AnyStr]]) -> None:
-    def __init__(self, path: Union[AnyStr, Path]) -> None:
-        # Make the path absolute, resolving any symlinks.
-        self._path = Path(path).expanduser().resolve()
-        if not self._path.exists():
-            raise ValueError(f"Path {self._path} doesn't exists")
+    def __init__(self, path: Union[AnyStr, Path, Sequence[Union[AnyStr, Path]]]) -> None:
+        if isinstance(path, (str, bytes, os.PathLike)):
+            path = (path,)
+        self._roots = []
+        for _ in path:
+            if isinstance(_, bytes):
+                _ = os.fsdecode(_)
+            # Make the path absolute, resolving any symlinks.
+            _ = Path(_).expanduser().resolve()
+            if not _.exists():
+                raise ValueError(f"Path {_} doesn't exists")
+            self._roots.append(_)
+        if not self._roots:
+            raise ValueError("No path to walk")
+        self._path = self._roots[0]
+        self._rank_roots()
+
+    ##############################################
+
+    def _rank_roots(self) -> None:
+        """Find the roots to be walked and their priority"""
+        # (root, priority) by decreasing length, thus the nested roots come first
+        self._root_priorities = []
+        keys = set()
+        for priority, root in enumerate(self._roots):
+            root = os.fsencode(root)
+            stat_result = os.stat(root)
+            # a bind mount can be an alias
+            key = (stat_result.st_dev << 64) + stat_result.st_ino
+            covering_root = next((_ for _, __ in self._root_priorities if self._is_below(root, _)), None)
+            if key in keys or covering_root is not None:
+                self._logger.info(
+                    f"Skip root {os.fsdecode(root)} already walked with {os.fsdecode(covering_root or root)}"
+                )
+                continue
+            keys.add(key)
+            self._root_priorities.append((root, priority))
+        if len(self._root_priorities) > 1:
+            self._tops = [(_, 0) for _, __ in self._root_priorities]
+            # each root is walked on its own
+            self._excluded = frozenset(_ for _, __ in self._root_priorities)
+        self._root_priorities.sort(key=lambda _: len(_[0]), reverse=True)
+
+    ##############################################
+
+    @staticmethod
+    def _is_below(path: bytes, root: bytes) -> bool:
+        return path == root or path.startswith(root.rstrip(b'/') + b'/')
 
     ##############################################
 
     @property
     def path(self) -> Path:
+        """First root"""
         return self._path
 
+    @property
+    def roots(self) -> List[Path]:
+        return list(self._roots)
+
+    ##############################################
+
+    def _find_root(self, path: bytes) -> Tuple[bytes, int]:
+        """Return the root of *path* and its priority"""
+        for root, priority in self._root_priorities:
+            if self._is_below(path, root):
+                return root, priority
+        raise ValueError(f"{os.fsdecode(path)} is not below a root")
+
+    ##############################################
+
+    def locate(self, dirpath: bytes) -> Tuple[int, int]:
+        """Return the priority of the root of *dirpath* and the depth of *dirpath* relative to it,
+        the root has depth 0.
+
+        """
+        root, priority = self._find_root(dirpath)
+        if dirpath == root:
+            return priority, 0
+        return priority, dirpath[len(root.rstrip(b'/')) + 1:].count(b'/') + 1
+
+    ##############################################
+
+    def _start_items(self) -> List[Tuple[bytes, int]]:
+        """Return the :code:`(path, depth)` of the directories where the walk starts"""
+        if self._tops is not None:
+            return list(self._tops)
+        return [(self._top, self._top_depth)]
+
+    @property
+    def _top(self) -> bytes:
+        # to avoid UnicodeEncodeError: surrogates not allowed
+        return os.fsencode(self._path)
+
+    ##############################################
+
+    def _make_options(self, kwargs: dict) -> WalkOptions:
+        options = WalkOptions.from_kwargs(kwargs)
+        if options.one_file_system or options.throttle is not None:
+            options.device = os.stat(self._top).st_dev
+        if options.one_file_system:
+            if self._tops is not None:
+                options.root_devices = {_: os.stat(_).st_dev for _, __ in self._root_priorities}
+            if options.report_mount_points:
+                options.mount_points = MountPoints(include_system=True)
+        if options.follow_links:
+            options.visited = _VisitedSet()
+            for top, _ in self._start_items():
+                options.visited.add(os.stat(top))
+        inode_order = options.inode_order
+        if inode_order is not True and inode_order:
+            # cache of the decision by device
+            options.inode_order_devices = {}
+            if inode_order != 'auto':
+                for device in inode_order:
+                    if not isinstance(device, int):
+                        device = os.stat(device).st_dev
+                    options.inode_order_devices[device] = True
+        if options.dir_fds > 0:
+            options.handles = DirectoryHandles(options.dir_fds)
+        return options
+
+    ##############################################
+
+    def _use_inode_order(self, dirpath: bytes, options: WalkOptions) -> bool:
+        """Return True if the entries of *dirpath* are sorted by inode"""
+        devices = options.inode_order_devices
+        if devices is None:
+            return options.inode_order is True
+        device = options.device if options.one_file_system else None
+        if device is None:
+            try:
+                device = os.stat(dirpath).st_dev
+            except OSError:
+                return False
+        decision = devices.get(device)
+        if decision is None:
+            decision = options.inode_order == 'auto' and bool(is_rotational(device))
+            devices[device] = decision
+        return decision
+
+    ##############################################
+
+    def sort_by_inode(self, entries: DirEntryList) -> None:
+        # d_ino is returned by the listing
+        entries.sort(key=lambda _: _.inode())
+
+    ##############################################
+
+    def _read_directory(self, dirpath: bytes) -> Tuple[DirEntryList, DirEntryList]:
+        """List a directory and split the entries in directories and non-directories.  Raise
+        :exc:`OSError`.
+
+        Like :func:`os.walk`, a symlink to a directory is classified as a directory.
+
+        """
+        directories = []
+        files = []
+        with os.scandir(dirpath) as it:
+            for entry in it:
+                try:
+                    # use d_type, don't call stat unless d_type is DT_UNKNOWN or a symlink
+                    is_dir = entry.is_dir()
+                except OSError:
+                    is_dir = False
+                if is_dir:
+                    directories.append(entry)
+                else:
+                    files.append(entry)
+        return directories, files
+
+    ##############################################
+
+    def _read_directory_at(self, dirpath: bytes, handles: DirectoryHandles) -> Tuple[DirEntryList, DirEntryList]:
+        """Like :meth:`_read_directory` but read the directory from its handle, the entries are bound
+        to the handle.
+
+        """
+        directories = []
+        files = []
+        try:
+            # the buffer size of scandir
+            for batch in iter_dir_entries(dirpath, 32 * 1024, handles.get(dirpath)):
+                for entry in batch:
+                    try:
+                        is_dir = entry.is_dir()
+                    except OSError:
+                        is_dir = False
+                    if is_dir:
+                        directories.append(entry)
+                    else:
+                        files.append(entry)
+        except OSError as exception:
+            if exception.errno != ENOSYS:
+                raise
+            # getdents64 is not available, raised before the first batch
+            return self._read_directory(dirpath)
+        return directories, files
+
+    ##############################################
+
+    def _scandir(self,
+                 dirpath: bytes,
+                 cache: Optional['DirectoryCache'] = None,
+                 handles: Optional[DirectoryHandles] = None,
+                 ) -> Tuple[DirEntryList, DirEntryList]:
+        """List a directory, or look it up in *cache*, and report the errors to :meth:`on_error`.  If
+        *handles* is set, the directory is read from its handle.
+
+        """
+        if handles is None:
+            read_directory = self._read_directory
+        else:
+            def read_directory(dirpath: bytes) -> Tuple[DirEntryList, DirEntryList]:
+                return self._read_directory_at(dirpath, handles)
+        try:
+            if cache is not None:
+                return cache.list_directory(dirpath, read_directory)
+            return read_directory(dirpath)
+        except OSError as exception:
+            self.on_error(exception)
+            return [], []
+
+    ##############################################
+
+    def _is_large_directory(self, dirpath: bytes, options: WalkOptions) -> bool:
+        if options.large_directory is None or options.cache is not None:
+            return False
+        try:
+            return os.stat(dirpath).st_size >= options.large_directory
+        except OSError:
+            # reported by the listing
+            return False
+
+    ##############################################
+
+    def _prefetch_stat(self, files: DirEntryList, options: WalkOptions) -> None:
+        if options.throttle is not None:
+            options.throttle.metadata(len(files), options.device)
+        for entry in files:
+            try:
+                # DirEntry caches the result
+                entry.stat(follow_symlinks=False)
+            except OSError:
+                pass
+
+    ##############################################
+
+    def _iter_directory(self, dirpath: bytes, options: WalkOptions) -> Iterator[WalkStep]:
+        """List a directory and yield walk steps.
+
+        A large directory, see :attr:`WalkOptions.large_directory`, is yielded by batches of files
+        and the last step holds the subdirectories, else a single step is yielded.
+
+        """
+        throttle = options.throttle
+        if throttle is not None:
+            throttle.metadata(1, options.device)
+        prune_config = options.prune_config
+        inode_order = self._use_inode_order(dirpath, options)
+        if self._is_large_directory(dirpath, options):
+            if prune_config is not None and prune_config.has_cachedir_tag(dirpath):
+                yield dirpath, [], []
+                return
+            directories = []
+            unsupported = False
+            try:
+                handle = None if options.handles is None else options.handles.get(dirpath)
+                for batch in iter_dir_entries(dirpath, options.dirent_buffer_size, handle):
+                    files = []
+                    for entry in batch:
+                        try:
+                            # use d_type
+                            is_dir = entry.is_dir()
+                        except OSError:
+                            is_dir = False
+                        if is_dir:
+                            directories.append(entry)
+                        else:
+                            files.append(entry)
+                    if files:
+                        if inode_order:
+                            self.sort_by_inode(files)
+                        if options.prefetch_stat:
+                            self._prefetch_stat(files, options)
+                        yield dirpath, [], files
+            except OSError as exception:
+                if exception.errno == ENOSYS:
+                    # getdents64 is not available, raised before the first batch
+                    unsupported = True
+                else:
+                    self.on_error(exception)
+            if not unsupported:
+                if inode_order:
+                    self.sort_by_inode(directories)
+                elif options.sort:
+                    self.sort_directories(directories)
+                yield dirpath, directories, []
+                return
+        directories, files = self._scandir(dirpath, options.cache, options.handles)
+        if prune_config is not None and prune_config.is_cache_directory(dirpath, files):
+            yield dirpath, [], []
+            return
+        if inode_order:
+            self.sort_by_inode(directories)
+            self.sort_by_inode(files)
+        elif options.sort:
+            self.sort_directories(directories)
+        if options.prefetch_stat:
+            self._prefetch_stat(files, options)
+        yield dirpath, directories, files
+
+    ##############################################
+
+    def _list_directory(self, dirpath: bytes, options: WalkOptions) -> WalkStep:
+        """List a directory and return a walk step."""
+        steps = list(self._iter_directory(dirpath, options))
+        if len(steps) == 1:
+            return steps[0]
+        files = [entry for step in steps for entry in step[2]]
+        return dirpath, steps[-1][1], files
+
+    ##############################################
+
+    def prune_directory(self, dirpath: bytes, entry: os.DirEntry, depth: int) -> bool:
+        """Hook to prune the subdirectory *entry* of *dirpath*, it is called before the subdirectory is
+        listed.  *depth* is the depth of the subdirectory, the top directory has depth 0.
+
+        """
+        return False
+
+    ##############################################
+
+    def on_skipped_mount_point(self, path: bytes, mount_point: Optional['MountPoint']) -> None:
+        """Hook called when the walk doesn't cross the file system boundary at *path*, *mount_point*
+        is only looked up if the option *report_mount_points* is set.
+
+        """
+        self._logger.info(f"Skip mount point {mount_point or os.fsdecode(path)}")
+
+    ##############################################
+
+    def _report_duplicate_directory(self, dirpath: bytes, path: bytes) -> None:
+        # only called for a duplicate, thus realpath is cheap overall
+        target = os.path.realpath(path)
+        real_dirpath = os.path.realpath(dirpath)
+        is_cycle = real_dirpath == target or real_dirpath.startswith(target.rstrip(b'/') + b'/')
+        self.on_duplicate_directory(path, is_cycle)
+
+    ##############################################
+
+    def on_duplicate_directory(self, path: bytes, is_cycle: bool) -> None:
+        """Hook called when a followed symlink *path* leads to a directory which was already walked,
+        *is_cycle* is set if it is an ancestor of *path*.  The directory is not walked again.
+
+        """
+        kind = "cycle" if is_cycle else "duplicate directory"
+        self._logger.info(f"Skip {kind} {os.fsdecode(path)}")
+
+    ##############################################
+
+    def _children(self,
+                  dirpath: bytes,
+                  directories: DirEntryList,
+                  depth: int,
+                  options: WalkOptions,
+                  ) -> List[Tuple[bytes, int]]:
+        """Return the paths and depths of the subdirectories to be walked."""
+        child_depth = depth + 1
+        if 0 <= options.max_depth < child_depth:
+            return []
+        follow_links = options.follow_links
+        prune = options.prune
+        prune_config = options.prune_config
+        device = options.device if options.one_file_system else None
+        if device is not None and options.root_devices is not None:
+            device = options.root_devices[self._find_root(dirpath)[0]]
+        visited = options.visited
+        if (device is not None or visited is not None) and options.throttle is not None:
+            options.throttle.metadata(len(directories), options.device)
+        excluded = self._excluded
+        children = []
+        for entry in directories:
+            if not follow_links and entry.is_symlink():
+                continue
+            path = os.path.join(dirpath, entry.name)
+            if device is not None:
+                try:
+                    # DirEntry caches the result
+                    is_other_device = entry.stat(follow_symlinks=follow_links).st_dev != device
+                except OSError:
+                    is_other_device = False
+                if is_other_device:
+                    mount_point = None
+                    if options.mount_points is not None:
+                        mount_point = options.mount_points.find(path)
+                    self.on_skipped_mount_point(path, mount_point)
+                    continue
+            if (path in excluded
+                or (prune_config is not None and prune_config.is_pruned(path, entry.name))
+                or self.prune_directory(dirpath, entry, child_depth)
+                or (prune is not None and prune(dirpath, entry, child_depth))):
+                continue
+            if visited is not None:
+                try:
+                    # DirEntry caches the result
+                    is_new = visited.add(entry.stat())
+                except OSError:
+                    # dangling symlink
+                    continue
+                if not is_new:
+                    self._report_duplicate_directory(dirpath, path)
+                    continue
+            children.append((path, child_depth))
+        return children
+
+    ##############################################
+
+    def walk(self,
+             top_down: bool = False,
+             workers: int = 1,
+             frontier: Optional[List[Tuple[bytes, int]]] = None,
+             **kwargs,
+             ) -> Iterator[WalkStep]:
+        """Walk the file hierarchy and yield :code:`(dirpath, directories, files)` like
+        :func:`os.walk`, but *directories* and *files* are lists of :class:`os.DirEntry`.
+
+        *kwargs* are the options of the walk, see :class:`WalkOptions`.  In top-down mode, the
+        caller can also prune the walk by modifying *directories* in place.
+
+        If *workers* > 1, the directories are listed by a pool of threads, see
+        :class:`filewalker.path.parallel.ParallelWalk`, and *top_down* is ignored.
+
+        If the option *large_directory* is set, a large directory is yielded in several steps: the
+        batches of files without subdirectories are yielded as soon as they are read, even in
+        bottom-up mode, and the last step holds the subdirectories.
+
+        A serial top-down walk can be resumed: *frontier* is a list of :code:`(path, depth)` of the
+        directories to be listed, which is used as the stack of the walk, see :meth:`on_frontier`.
+
+        """
+        if frontier is not None and (workers > 1 or not top_down):
+            raise ValueError("Only a serial top-down walk can be resumed")
+        options = self._make_options(kwargs)
+        try:
+            yield from self._walk_steps(top_down, workers, frontier, options)
+        finally:
+            options.close()
+
+    ##############################################
+
+    def _walk_steps(self,
+                    top_down: bool,
+                    workers: int,
+                    frontier: Optional[List[Tuple[bytes, int]]],
+                    options: WalkOptions,
+                    ) -> Iterator[WalkStep]:
+        if workers > 1:
+            yield from ParallelWalk(self, self._start_items(), workers, options)
+            return
+        # the stack contains the paths to be listed with their depth and, in bottom-up mode, the
+        # steps to be yielded with a None depth
+        stack = list(reversed(self._start_items())) if frontier is None else frontier
+        while stack:
+            item, depth = stack.pop()
+            if depth is None:
+                yield item
+                continue
+            step = None
+            for next_step in self._iter_directory(item, options):
+                if step is not None:
+                    # a batch of files of a large directory
+                    yield step
+                step = next_step
+            if top_down:
+                yield step
+            else:
+                stack.append((step, None))
+            stack.extend(reversed(self._children(item, step[1], depth, options)))
+            if top_down:
+                self.on_frontier(stack)
+
+    ##############################################
+
+    def _make_dispatcher(self, prune: bool = False) -> Callable[[WalkStep], None]:
+        """Return a function to call the callbacks on a walk step.
+
+        If *prune* is set, the subdirectories for which :code:`on_directory` returns False are
+        removed from the step.
+
+        """
+        # lookup the callbacks once
+        on_directory = getattr(self, 'on_directory', None)
+        on_filename = getattr(self, 'on_filename', None)
+
+        def dispatch(step: WalkStep) -> None:
+            dirpath, directories, files = step
+            if on_directory is not None:
+                if prune:
+                    directories[:] = [_ for _ in directories if on_directory(dirpath, _) is not False]
+                else:
+                    for entry in directories:
+                        on_directory(dirpath, entry)
+            if on_filename is not None:
+                for entry in files:
+                    on_filename(dirpath, entry)
+
+        return dispatch
+
+    ##############################################
+
+    def iter_files(self, **kwargs) -> Iterator[os.DirEntry]:
+        """Yield lazily the entries of the non-directory files, see :meth:`walk` for the arguments,
+        the walk is top-down by default.
+
+        Usage::
+
+            from itertools import islice
+            large_files = (_ for _ in walker.iter_files() if _.stat(follow_symlinks=False).st_size > 2**30)
+            for entry in islice(large_files, 10):
+                ...
+
+        """
+        kwargs.setdefault('top_down', True)
+        for _, _, files in self.walk(**kwargs):
+            yield from files
+
+    ##############################################
+
+    def iter_dirs(self, **kwargs) -> Iterator[os.DirEntry]:
+        """Yield lazily the entries of the directories, see :meth:`walk` for the arguments, the walk
+        is top-down by default.
+
+        """
+        kwargs.setdefault('top_down', True)
+        for _, directories, _ in self.walk(**kwargs):
+            yield from directories
+
     ##############################################
 
     def run(self,
@@ -51,39 +814,239 @@ class WalkerAbc:
             sort: bool = False,
             follow_links: bool = False,
             max_depth: int = -1,
+            workers: int = 1,
+            serialize: bool = True,
+            **kwargs,
             ) -> None:
-        if max_depth >= 0:
-            top_down = True
-            depth = 0
-        # to avoid UnicodeEncodeError: surrogates not allowed
-        top = str(self._path).encode('utf-8')
-        for dirpath, dirnames, filenames in os.walk(top, topdown=top_down, followlinks=follow_links):
-            # dirnames and filenames are List[bytes]
-            if top_down and sort:
-                self.sort_dirnames(dirnames)
-            if hasattr(self, 'on_directory'):
-                for directory in dirnames:
-                    self.on_directory(dirpath, directory)
-            if hasattr(self, 'on_filename'):
-                for filename in filenames:
-                    self.on_filename(dirpath, filename)
-            if max_depth >= 0:
-                depth += 1
-                if depth > max_depth:
-                    break
-
-    ##############################################
-
-    def sort_dirnames(self, dirnames: List[bytes]) -> None:
+        """Walk the file hierarchy and call the callbacks, see :meth:`walk` and :class:`WalkOptions`
+        for the arguments.
+
+        In top-down mode and with a single worker, :code:`on_directory` is called before the
+        subdirectory is listed and the subdirectory is pruned if it returns False.
+
+        If *workers* > 1, the walk is multi-threaded.  If *serialize* is set, the callbacks are
+        called from the calling thread, else they are called concurrently from the worker threads
+        and must be thread-safe.  The walk can only be pruned by :meth:`prune_directory` or *prune*.
+
+        """
+        kwargs.update(sort=sort, follow_links=follow_links, max_depth=max_depth)
+        if workers > 1 and not serialize:
+            options = self._make_options(kwargs)
+            dispatch = self._make_dispatcher()
+            try:
+                for _ in ParallelWalk(self, self._start_items(), workers, options, consumer=dispatch):
+                    pass
+            finally:
+                options.close()
+            return
+        dispatch = self._make_dispatcher(prune=top_down and workers == 1)
+        for step in self.walk(top_down, workers, **kwargs):
+            dispatch(step)
+
+    ##############################################
+
+    async def aiter(self,
+                    workers: int = 4,
+                    queue_size: int = 1024,
+                    files: bool = True,
+                    directories: bool = False,
+                    **kwargs,
+                    ) -> AsyncIterator[os.DirEntry]:
+        """Walk the file hierarchy without blocking the event loop and yield the entries of the files
+        and/or *directories*.  *kwargs* are the options of the walk, see :class:`WalkOptions`.
+
+        The directories are listed on a pool of *workers* threads, with at most *workers* listings
+        in flight, the subdirectories to be walked are also selected in these threads since it can
+        require a stat.  The entries are passed through a queue of *queue_size* items, thus a slow
+        consumer pauses the walk.  If the consumer stops, the listings in flight are awaited before
+        the options are closed.
+
+        Usage::
+
+            async for entry in walker.aiter():
+                ...
+
+        """
+        options = self._make_options(kwargs)
+        loop = asyncio.get_running_loop()
+        entries = asyncio.Queue(queue_size)
+        done = object()
+        # listings in flight
+        pending = set()
+
+        def list_directory(dirpath: bytes, depth: int) -> Tuple[WalkStep, List[Tuple[bytes, int]]]:
+            step = self._list_directory(dirpath, options)
+            return step, self._children(dirpath, step[1], depth, options)
+
+        async def produce(executor: ThreadPoolExecutor) -> None:
+            cancelled = False
+            try:
+                stack = list(reversed(self._start_items()))
+                throttle = options.throttle
+                while stack or pending:
+                    max_workers = workers if throttle is None else throttle.max_workers(workers)
+                    while stack and len(pending) < max_workers:
+                        pending.add(loop.run_in_executor(executor, list_directory, *stack.pop()))
+                    completed, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for future in completed:
+                        pending.discard(future)
+                        (_, dir_entries, file_entries), children = future.result()
+                        stack.extend(reversed(children))
+                        if directories:
+                            for entry in dir_entries:
+                                await entries.put(entry)
+                        if files:
+                            for entry in file_entries:
+                                await entries.put(entry)
+            except asyncio.CancelledError:
+                cancelled = True
+                raise
+            finally:
+                if cancelled:
+                    # the consumer stopped, the queue can be full
+                    with contextlib.suppress(asyncio.QueueFull):
+                        entries.put_nowait(done)
+                else:
+                    await entries.put(done)
+
+        executor = ThreadPoolExecutor(workers, thread_name_prefix='walker')
+        task = asyncio.create_task(produce(executor))
+        try:
+            while (entry := await entries.get()) is not done:
+                yield entry
+            # raise the producer exception
+            await task
+        finally:
+            task.cancel()
+            executor.shutdown(wait=False, cancel_futures=True)
+            # the listings in flight use the options
+            await asyncio.gather(task, *pending, return_exceptions=True)
+            options.close()
+
+    ##############################################
+
+    def make_shard(self, top: bytes, depth: int, excluded: Iterable[bytes] = ()) -> 'WalkerAbc':
+        """Return a walker for the subtree *top* at *depth*, which excludes the directories
+        *excluded*.
+
+        The shard is a shallow copy of the walker that is pickled to a worker process, thus it
+        must not hold the results collected so far, see :meth:`init_shard`.
+
+        """
+        shard = copy.copy(self)
+        shard._path = Path(os.fsdecode(top))
+        shard._top_depth = depth
+        shard._tops = None
+        # keep the other roots excluded
+        shard._excluded = frozenset(excluded) | self._excluded
+        shard.init_shard()
+        return shard
+
+    ##############################################
+
+    def init_shard(self) -> None:
+        """Hook to reset the state of a shard"""
+        pass
+
+    ##############################################
+
+    def _make_shards(self, by_mount_point: bool, options: WalkOptions) -> Tuple[List['WalkerAbc'], Optional[WalkStep]]:
+        top = self._top
+        if self._tops is not None:
+            # a shard per root
+            return [self.make_shard(*_) for _ in self._tops], None
+        if by_mount_point:
+            prefix = top.rstrip(b'/') + b'/'
+            mount_points = set(os.fsencode(mount.mount_point) for mount in MountPoints())
+            roots = [top] + sorted(_ for _ in mount_points if _ != top and _.startswith(prefix))
+            shards = []
+            for root in roots:
+                depth = self._top_depth
+                if root != top:
+                    depth += root[len(prefix):].count(b'/') + 1
+                    if 0 <= options.max_depth < depth:
+                        continue
+                root_prefix = root.rstrip(b'/') + b'/'
+                excluded = [_ for _ in roots if _ != root and _.startswith(root_prefix)]
+                shards.append(self.make_shard(root, depth, excluded))
+            return shards, None
+        else:
+            step = self._list_directory(top, options)
+            shards = [self.make_shard(*_) for _ in self._children(top, step[1], self._top_depth, options)]
+            return shards, step
+
+    ##############################################
+
+    def run_sharded(self,
+                    processes: Optional[int] = None,
+                    by_mount_point: bool = False,
+                    **kwargs,
+                    ) -> None:
+        """Run the walk in a pool of *processes* to parallelise CPU-bound callbacks.
+
+        The tree is sharded by top-level subdirectory or, if *by_mount_point* is set, by mount
+        point.  Each shard runs the callbacks in a worker process, see :meth:`run` for *kwargs*, and
+        only returns its :code:`shard_result()`, which is merged by :code:`merge_shard_result()`.
+        In top-level mode, the callbacks for the top directory are called in this process.  A
+        *prune* predicate must be picklable.  A *throttle* is split between the processes, see
+        :meth:`filewalker.common.throttle.IoThrottle.split`.
+
+        """
+        options = self._make_options(kwargs)
+        if options.cache is not None:
+            raise ValueError("A directory cache cannot be shared by processes")
+        try:
+            shards, top_step = self._make_shards(by_mount_point, options)
+            if options.throttle is not None and shards:
+                workers = min(processes or os.cpu_count() or 1, len(shards))
+                kwargs['throttle'] = options.throttle.split(workers)
+            with ProcessPoolExecutor(processes) as executor:
+                futures = [executor.submit(_run_shard, _, kwargs) for _ in shards]
+                if top_step is not None:
+                    self._make_dispatcher()(top_step)
+                for future in as_completed(futures):
+                    self.merge_shard_result(future.result())
+        finally:
+            options.close()
+
+    ##############################################
+
+    # def shard_result(self) -> Any:
+    #     raise NotImplementedError
+
+    ##############################################
+
+    # def merge_shard_result(self, result: Any) -> None:
+    #     raise NotImplementedError
+
+    ##############################################
+
+    def sort_directories(self, entries: DirEntryList) -> None:
         # Fixme: sort utf-8 bytes ???
-        dirnames.sort()
+        entries.sort(key=attrgetter('name'))
+
+    ##############################################
+
+    def on_frontier(self, frontier: List[Tuple[bytes, int]]) -> None:
+        """Hook called by a serial top-down walk when the steps yielded so far are processed.
+        *frontier* is the list of :code:`(path, depth)` of the directories to be listed, it can be
+        saved to resume the walk but must not be modified.
+
+        """
+        pass
+
+    ##############################################
+
+    def on_error(self, exception: OSError) -> None:
+        # os.walk ignores errors by default
+        self._logger.warning(f"{exception}")
 
     ##############################################
 
-    # def on_directory(self, dirpath: bytes, dirname: bytes) -> None:
+    # def on_directory(self, dirpath: bytes, entry: os.DirEntry) -> None:
     #     raise NotImplementedError
 
     ##############################################
 
-    # def on_filename(self, dirpath: bytes, filename: bytes) -> None:
+    # def on_filename(self, dirpath: bytes, entry: os.DirEntry) -> None:
     #     raise NotImplementedError
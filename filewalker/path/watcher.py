@@ -0,0 +1,458 @@
+####################################################################################################
+#
+# filewalker — ...
+# Copyright (C) 2020 Fabrice Salvaire
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+####################################################################################################
+####################################################################################################
+
+"""Module to implement a live file index maintained by inotify.
+
+The index is filled by an initial walk, then the inotify events are applied to it: a created or
+moved directory is walked, a modified file is stat'ed again, and a moved directory is renamed in the
+index without a walk.
+
+If the kernel queue overflows, events are lost in unknown directories, thus the index is
+resynchronised with the file system: the subtree of a directory whose change time differs from the
+one recorded is rescanned, and the files of the other directories are stat'ed again.  The key of a
+directory is recorded when it is watched and, once its events are applied, it is stat'ed again
+before the next read, thus its events up to this stat are in the next batch.  A change time too
+recent to be trusted, given the timestamp granularity, counts as a change.
+
+Each directory is watched before it is listed, thus an entry created during the walk is either
+listed or reported by an event.  Only the walked directories are watched, a directory pruned by the
+walk options, even if it is created later, is neither watched nor indexed.  The number of watches is
+limited by /proc/sys/fs/inotify/max_user_watches, a directory that cannot be watched is indexed but
+not updated.
+
+"""
+
+####################################################################################################
+
+__all__ = ['FileIndex']
+
+####################################################################################################
+
+from pathlib import Path
+from typing import AnyStr, Dict, List, Optional, Tuple, Union
+import logging
+import os
+import stat
+import threading
+import time
+
+from filewalker.os.getdents import DT_DIR, RawDirEntry
+from filewalker.os.inotify import (
+    Inotify,
+    IN_ATTRIB, IN_CLOSE_WRITE, IN_CREATE, IN_DELETE, IN_DELETE_SELF, IN_DONT_FOLLOW,
+    IN_EXCL_UNLINK, IN_IGNORED, IN_MODIFY, IN_MOVE_SELF, IN_MOVED_FROM, IN_MOVED_TO, IN_ONLYDIR,
+    IN_Q_OVERFLOW,
+)
+from .file import File
+from .walker import DirEntryList, WalkerAbc, WalkOptions
+
+####################################################################################################
+
+_module_logger = logging.getLogger(__name__)
+
+####################################################################################################
+
+class _IndexWalker(WalkerAbc):
+
+    """Class to walk a subtree for a :class:`FileIndex`"""
+
+    ##############################################
+
+    def __init__(self, path: Union[AnyStr, Path], index: 'FileIndex') -> None:
+        super().__init__(path)
+        self._index = index
+
+    ##############################################
+
+    def on_directory(self, dirpath: bytes, entry: os.DirEntry) -> None:
+        if entry.is_symlink():
+            # the symlinks to directories are not followed
+            self._index._add_file(File.from_dir_entry(dirpath, entry))
+
+    ##############################################
+
+    def _children(self,
+                  dirpath: bytes,
+                  directories: DirEntryList,
+                  depth: int,
+                  options: WalkOptions,
+                  ) -> List[Tuple[bytes, int]]:
+        children = super()._children(dirpath, directories, depth, options)
+        # watch before the directory is listed, only the walked directories
+        for path, _ in children:
+            self._index._watch(path)
+        return children
+
+    ##############################################
+
+    def on_filename(self, dirpath: bytes, entry: os.DirEntry) -> None:
+        self._index._add_file(File.from_dir_entry(dirpath, entry))
+
+####################################################################################################
+
+class FileIndex:
+
+    """Class to implement a live index of the files in a directory tree.
+
+    Usage::
+
+        with FileIndex(path, prune_config=prune_config) as index:
+            index.scan()
+            stop = threading.Event()
+            threading.Thread(target=index.watch, args=(stop,)).start()
+            ...
+            file_obj = index.get(path)
+            stop.set()
+
+    *kwargs* are the walk options, see :class:`filewalker.path.walker.WalkOptions`, the walk is
+    serial.  The queries are thread-safe.
+
+    """
+
+    _logger = _module_logger.getChild('FileIndex')
+
+    MASK = (
+        IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE
+        | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR | IN_DONT_FOLLOW | IN_EXCL_UNLINK
+    )
+
+    # delay in ns below which a change time cannot be trusted
+    RACY_DELAY = 2 * 10**9
+
+    ##############################################
+
+    def __init__(self, path: Union[AnyStr, Path], **kwargs) -> None:
+        self._walker = _IndexWalker(path, self)
+        self._top = self._walker._top
+        self._walk_kwargs = kwargs
+        self._inotify = Inotify()
+        self._lock = threading.RLock()
+        self._files: Dict[bytes, File] = {}
+        self._wd_to_path: Dict[int, bytes] = {}
+        self._path_to_wd: Dict[bytes, int] = {}
+        # stat key of the watched directories when their index was up to date
+        self._dir_keys: Dict[bytes, tuple] = {}
+        # directories which had events in the last batch
+        self._touched = set()
+        self._overflow_count = 0
+
+    ##############################################
+
+    def close(self) -> None:
+        self._inotify.close()
+
+    def __enter__(self) -> 'FileIndex':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    ##############################################
+
+    @property
+    def path(self) -> Path:
+        return self._walker.path
+
+    @property
+    def overflow_count(self) -> int:
+        """Number of queue overflows"""
+        return self._overflow_count
+
+    def __len__(self) -> int:
+        return len(self._files)
+
+    def __contains__(self, path: Union[AnyStr, Path]) -> bool:
+        return os.fsencode(path) in self._files
+
+    def get(self, path: Union[AnyStr, Path]) -> Optional[File]:
+        return self._files.get(os.fsencode(path))
+
+    ##############################################
+
+    def files(self, prefix: Optional[Union[AnyStr, Path]] = None) -> List[File]:
+        """Return the files of the index, or those below the directory *prefix*"""
+        with self._lock:
+            if prefix is None:
+                return list(self._files.values())
+            prefix = os.fsencode(prefix).rstrip(b'/') + b'/'
+            return [file_obj for path, file_obj in self._files.items() if path.startswith(prefix)]
+
+    ##############################################
+
+    def directories(self) -> List[bytes]:
+        """Return the watched directories"""
+        with self._lock:
+            return sorted(self._path_to_wd)
+
+    ##############################################
+
+    @staticmethod
+    def _stat_key(stat_result: os.stat_result) -> tuple:
+        return stat_result.st_ino, stat_result.st_size, stat_result.st_mtime_ns, stat_result.st_ctime_ns
+
+    def _is_unchanged(self, key: tuple, stat_result: os.stat_result, now: int) -> bool:
+        return key == self._stat_key(stat_result) and now - key[3] >= self.RACY_DELAY
+
+    ##############################################
+
+    def _watch(self, path: bytes) -> None:
+        try:
+            # before the watch, thus a later change is reported or changes the key
+            key = self._stat_key(os.lstat(path))
+            wd = self._inotify.add_watch(path, self.MASK)
+        except OSError as exception:
+            self._logger.warning(f"Cannot watch {os.fsdecode(path)}: {exception}")
+            return
+        self._wd_to_path[wd] = path
+        self._path_to_wd[path] = wd
+        self._dir_keys[path] = key
+
+    ##############################################
+
+    def _add_file(self, file_obj: File) -> None:
+        self._files[file_obj.path_bytes] = file_obj
+
+    ##############################################
+
+    def _refresh_file(self, path: bytes) -> None:
+        try:
+            stat_result = os.lstat(path)
+        except OSError:
+            self._files.pop(path, None)
+            return
+        if stat.S_ISDIR(stat_result.st_mode):
+            return
+        parent, name = os.path.split(path)
+        self._add_file(File.from_stat(parent, name, stat_result))
+
+    ##############################################
+
+    def _subtree(self, mapping: dict, path: bytes) -> List[bytes]:
+        prefix = path + b'/'
+        return [_ for _ in mapping if _ == path or _.startswith(prefix)]
+
+    ##############################################
+
+    def _scan(self, path: bytes) -> None:
+        """Watch and walk the subtree *path*"""
+        self._watch(path)
+        depth = path.count(b'/') - self._top.count(b'/')
+        shard = self._walker.make_shard(path, depth)
+        shard.run(top_down=True, **self._walk_kwargs)
+
+    def _scan_created(self, dirpath: bytes, name: bytes) -> None:
+        """Watch and walk the directory *name* created in *dirpath*, unless the walk prunes it"""
+        entry = RawDirEntry(dirpath, name, 0, DT_DIR)
+        depth = dirpath.count(b'/') - self._top.count(b'/')
+        options = self._walker._make_options(dict(self._walk_kwargs))
+        try:
+            # the subdirectory is watched by _IndexWalker._children
+            children = self._walker._children(dirpath, [entry], depth, options)
+        finally:
+            options.close()
+        for path, child_depth in children:
+            shard = self._walker.make_shard(path, child_depth)
+            shard.run(top_down=True, **self._walk_kwargs)
+
+    ##############################################
+
+    def _remove_subtree(self, path: bytes) -> None:
+        for _ in self._subtree(self._files, path):
+            del self._files[_]
+        for _ in self._subtree(self._path_to_wd, path):
+            wd = self._path_to_wd.pop(_)
+            del self._wd_to_path[wd]
+            self._dir_keys.pop(_, None)
+            try:
+                self._inotify.rm_watch(wd)
+            except OSError:
+                # the kernel already removed the watch
+                pass
+
+    ##############################################
+
+    def _rename_subtree(self, old_path: bytes, new_path: bytes) -> None:
+        """Rename the directory *old_path* to *new_path*, the watches follow the inodes"""
+        start = len(old_path)
+        for path in self._subtree(self._files, old_path):
+            file_obj = self._files.pop(path)
+            parent = new_path + file_obj.parent[start:]
+            self._add_file(File.from_stat(parent, file_obj.name, file_obj.stat))
+        for path in self._subtree(self._path_to_wd, old_path):
+            wd = self._path_to_wd.pop(path)
+            key = self._dir_keys.pop(path, None)
+            path = new_path + path[start:]
+            self._path_to_wd[path] = wd
+            self._wd_to_path[wd] = path
+            if key is not None:
+                self._dir_keys[path] = key
+
+    ##############################################
+
+    def scan(self) -> None:
+        """Build the index"""
+        with self._lock:
+            self._scan(self._top)
+        self._logger.info(f"Indexed {len(self._files)} files in {len(self._path_to_wd)} directories")
+
+    ##############################################
+
+    def rescan(self, path: Optional[Union[AnyStr, Path]] = None) -> None:
+        """Rebuild the index of the subtree *path*, by default the whole tree"""
+        path = self._top if path is None else os.fsencode(path).rstrip(b'/')
+        with self._lock:
+            self._remove_subtree(path)
+            self._scan(path)
+
+    ##############################################
+
+    def _resync(self) -> None:
+        """Resynchronise the index after events were lost, see the module documentation"""
+        now = time.time_ns()
+        rescanned = []
+        unchanged = set()
+        # a parent comes before its subdirectories
+        for path in sorted(self._path_to_wd):
+            if any(WalkerAbc._is_below(path, _) for _ in rescanned):
+                continue
+            try:
+                stat_result = os.lstat(path)
+            except OSError:
+                stat_result = None
+            if stat_result is not None and self._is_unchanged(self._dir_keys.get(path), stat_result, now):
+                unchanged.add(path)
+            else:
+                rescanned.append(path)
+        for path, file_obj in list(self._files.items()):
+            if file_obj.parent in unchanged:
+                try:
+                    stat_result = os.lstat(path)
+                except OSError:
+                    # the parent directory changed
+                    continue
+                if not self._is_unchanged(self._stat_key(file_obj.stat), stat_result, now):
+                    self._add_file(File.from_stat(file_obj.parent, file_obj.name, stat_result))
+        for path in rescanned:
+            if os.path.isdir(path):
+                self.rescan(path)
+            else:
+                # removed, the parent is rescanned
+                self._remove_subtree(path)
+        self._logger.info(f"Rescanned {len(rescanned)} subtrees, {len(unchanged)} directories are unchanged")
+
+    ##############################################
+
+    def process_events(self, timeout: Optional[float] = None) -> int:
+        """Apply the pending events to the index, wait at most *timeout* seconds if there is none.
+        Return the number of events.
+
+        """
+        # stat the directories touched by the last batch before the read, thus their events up to
+        # this stat are in this batch
+        keys = {}
+        for path in self._touched:
+            try:
+                keys[path] = self._stat_key(os.lstat(path))
+            except OSError:
+                pass
+        self._touched = set()
+        events = self._inotify.read_events(timeout)
+        if not any(_.mask & IN_Q_OVERFLOW for _ in events):
+            with self._lock:
+                for path, key in keys.items():
+                    if path in self._dir_keys:
+                        self._dir_keys[path] = key
+        if not events:
+            return 0
+        overflow = False
+        with self._lock:
+            # the paths to be stat'ed once at the end
+            refresh = set()
+            # pair IN_MOVED_FROM and IN_MOVED_TO by cookie
+            moved_from = {}
+            for event in events:
+                mask = event.mask
+                if mask & IN_Q_OVERFLOW:
+                    overflow = True
+                    continue
+                dirpath = self._wd_to_path.get(event.wd)
+                if dirpath is None:
+                    continue
+                if mask & IN_IGNORED:
+                    # the directory was removed
+                    del self._wd_to_path[event.wd]
+                    if self._path_to_wd.get(dirpath) == event.wd:
+                        del self._path_to_wd[dirpath]
+                        self._dir_keys.pop(dirpath, None)
+                    continue
+                if not event.name:
+                    # IN_DELETE_SELF and IN_MOVE_SELF are handled by the parent events
+                    if dirpath == self._top and mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                        self._logger.warning(f"{os.fsdecode(dirpath)} was removed or moved")
+                    continue
+                self._touched.add(dirpath)
+                path = os.path.join(dirpath, event.name)
+                if mask & IN_MOVED_FROM:
+                    moved_from[event.cookie] = path, event.is_dir
+                    continue
+                if mask & IN_MOVED_TO:
+                    source = moved_from.pop(event.cookie, None)
+                    if source is not None and event.is_dir:
+                        self._rename_subtree(source[0], path)
+                        continue
+                    if source is not None:
+                        self._files.pop(source[0], None)
+                        refresh.discard(source[0])
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    if event.is_dir:
+                        self._scan_created(dirpath, event.name)
+                    else:
+                        refresh.add(path)
+                elif mask & IN_DELETE:
+                    if event.is_dir:
+                        self._remove_subtree(path)
+                    else:
+                        self._files.pop(path, None)
+                        refresh.discard(path)
+                elif not event.is_dir:
+                    # IN_MODIFY, IN_ATTRIB, IN_CLOSE_WRITE
+                    refresh.add(path)
+            # moved out of the tree
+            for path, is_dir in moved_from.values():
+                if is_dir:
+                    self._remove_subtree(path)
+                else:
+                    self._files.pop(path, None)
+                    refresh.discard(path)
+            for path in refresh:
+                self._refresh_file(path)
+            if overflow:
+                self._overflow_count += 1
+                self._logger.warning("inotify queue overflow, resynchronise")
+                self._resync()
+        return len(events)
+
+    ##############################################
+
+    def watch(self, stop: Optional[threading.Event] = None, timeout: float = 1.) -> None:
+        """Process the events until *stop* is set, it is checked every *timeout* seconds"""
+        while stop is None or not stop.is_set():
+            self.process_events(timeout)
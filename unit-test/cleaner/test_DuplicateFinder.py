@@ -0,0 +1,211 @@
+####################################################################################################
+#
+# filewalker -
+# Copyright (C) 2020 Fabrice Salvaire
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+####################################################################################################
+####################################################################################################
+
+import os
+import unittest
+
+####################################################################################################
+
+from filewalker.cleaner.DuplicateFinder import DuplicateFinder
+from filewalker.cleaner.DuplicateSet import DuplicatePool
+from filewalker.common.checkpoint import Checkpoint
+from filewalker.common.hashing import IncompatibleHashBackend, get_backend
+from filewalker.common.throttle import IoThrottle
+from filewalker.path.file import File
+from filewalker.unit_test.file import TemporaryDirectory
+
+####################################################################################################
+
+class Crash(Exception):
+    pass
+
+class CrashingFinder(DuplicateFinder):
+
+    CRASH_STAGE = None
+
+    ##############################################
+
+    def _save_checkpoint(self, stage: str, **state) -> None:
+        super()._save_checkpoint(stage, **state)
+        if stage == self.CRASH_STAGE:
+            raise Crash
+
+class RecordingThrottle(IoThrottle):
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.devices = []
+
+    def metadata(self, count: int = 1, device=None) -> None:
+        self.devices.append(device)
+        super().metadata(count, device)
+
+####################################################################################################
+
+def make_tree(directory) -> None:
+    for _ in ('a', 'b', 'c', 'd'):
+        directory.joinpath(_).mkdir()
+    for path, content in (
+            ('a/x1', 'hello'),
+            ('b/x2', 'hello'),
+            ('c/x3', 'hellp'),
+            ('c/y1', 'world!'),
+            ('d/y2', 'world!'),
+            ('d/z', 'unique size'),
+    ):
+        directory.make_file(path, content)
+
+####################################################################################################
+
+class TestDuplicateFinder(unittest.TestCase):
+
+    ##############################################
+
+    def duplicates(self, finder):
+        return sorted(sorted(_.name for _ in group) for group in finder._pool)
+
+    ##############################################
+
+    def test_find_duplicate(self):
+        with TemporaryDirectory() as directory:
+            make_tree(directory)
+            finder = DuplicateFinder.find_duplicate(directory.joinpath(''))
+            self.assertListEqual(self.duplicates(finder), [[b'x1', b'x2'], [b'y1', b'y2']])
+
+    ##############################################
+
+    def test_statx(self):
+        with TemporaryDirectory() as directory:
+            make_tree(directory)
+            finder = DuplicateFinder.find_duplicate(directory.joinpath(''), statx=True, dont_sync=True)
+            self.assertListEqual(self.duplicates(finder), [[b'x1', b'x2'], [b'y1', b'y2']])
+            self.assertFalse(File.USE_STATX)
+
+    ##############################################
+
+    def test_throttle(self):
+        with TemporaryDirectory() as directory:
+            make_tree(directory)
+            throttle = RecordingThrottle()
+            finder = DuplicateFinder.find_duplicate(directory.joinpath(''), throttle=throttle)
+            self.assertListEqual(self.duplicates(finder), [[b'x1', b'x2'], [b'y1', b'y2']])
+            # the metadata operations are accounted to the device of the files
+            self.assertSetEqual(set(throttle.devices), {os.stat(directory.joinpath('')).st_dev})
+
+    ##############################################
+
+    def test_hash_backend(self):
+        with TemporaryDirectory() as directory, TemporaryDirectory() as output_directory:
+            make_tree(directory)
+            top = directory.joinpath('')
+            pool = DuplicateFinder.find_duplicate_set(top, hash='sha256')
+            self.assertEqual(pool.hash_backend, 'sha256')
+            self.assertIs(File.HASH_BACKEND, get_backend('sha1'))
+            path = output_directory.joinpath('pool.json')
+            pool.write_json(path)
+            loaded_pool = DuplicatePool.new_from_json(path)
+            self.assertEqual(loaded_pool.hash_backend, 'sha256')
+            self.assertEqual(loaded_pool, pool)
+            # the pools only hold paths
+            self.assertEqual(loaded_pool, DuplicateFinder.find_duplicate_set(top))
+            # a checkpoint is resumed with its backend
+            checkpoint = Checkpoint(output_directory.joinpath('scan'), interval=0)
+            CrashingFinder.CRASH_STAGE = 'first_bytes'
+            with self.assertRaises(Crash):
+                CrashingFinder.find_duplicate(top, checkpoint=checkpoint, hash='blake2b')
+            with self.assertRaises(IncompatibleHashBackend):
+                DuplicateFinder.resume(checkpoint, hash='sha1')
+            finder = DuplicateFinder.resume(checkpoint)
+            self.assertEqual(finder.hash_backend, 'blake2b')
+            self.assertListEqual(self.duplicates(finder), [[b'x1', b'x2'], [b'y1', b'y2']])
+
+    ##############################################
+
+    def test_cache(self):
+        with TemporaryDirectory() as directory, TemporaryDirectory() as cache_directory:
+            make_tree(directory)
+            top = directory.joinpath('')
+            cache_path = cache_directory.joinpath('walk.cache')
+            pool = DuplicateFinder.find_duplicate_set(top, cache=cache_path)
+            self.assertEqual(len(pool), 2)
+            # rewritten in place, the directories are unchanged
+            for path in ('c/y1', 'd/y2'):
+                directory.make_file(path, 'unique size')
+            pool = DuplicateFinder.find_duplicate_set(top, cache=cache_path)
+            paths = sorted(sorted(os.path.basename(_) for _ in duplicate_set.paths_str) for duplicate_set in pool)
+            self.assertListEqual(paths, [['x1', 'x2'], ['y1', 'y2', 'z']])
+
+    ##############################################
+
+    def test_hard_links(self):
+        with TemporaryDirectory() as directory:
+            make_tree(directory)
+            # a/x1 and its links are a single inode
+            for _ in ('a/l1', 'b/l2'):
+                os.link(directory.joinpath('a/x1'), directory.joinpath(_))
+            # a hard link alone in its size group
+            os.link(directory.joinpath('d/z'), directory.joinpath('d/l3'))
+            finder = DuplicateFinder.find_duplicate(directory.joinpath(''))
+            group = [_ for _ in finder._pool if b'x2' in [file_obj.name for file_obj in _]][0]
+            # one link per inode is kept
+            self.assertEqual(len(group), 2)
+            kept = [_ for _ in group if _.name != b'x2'][0]
+            links = sorted(_.name for _ in finder.hard_links(kept))
+            self.assertListEqual(links, [b'l1', b'l2', b'x1'])
+            self.assertEqual(len(list(finder.hard_link_groups())), 2)
+            self.assertEqual(len(finder._pool), 2)
+
+    ##############################################
+
+    def test_roots(self):
+        with TemporaryDirectory() as directory:
+            make_tree(directory)
+            directory.joinpath('d/e').mkdir()
+            directory.make_file('d/e/x4', 'hello')
+            # d has the highest priority, a is nested in the second root
+            roots = [directory.joinpath(_) for _ in ('d', '', 'a')]
+            pool = DuplicateFinder.find_duplicate_set(roots)
+            originals = sorted(_.first.name for _ in pool)
+            self.assertListEqual(originals, ['x4', 'y2'])
+            pool = DuplicateFinder.find_duplicate_set(directory.joinpath(''))
+            originals = sorted(_.first.name for _ in pool)
+            self.assertListEqual(originals, ['x1', 'y1'])
+
+    ##############################################
+
+    def test_resume(self):
+        with TemporaryDirectory() as directory, TemporaryDirectory() as checkpoint_directory:
+            make_tree(directory)
+            top = directory.joinpath('')
+            for stage in ('walk', 'first_bytes', 'sha'):
+                checkpoint = Checkpoint(checkpoint_directory.joinpath('scan'), interval=0)
+                CrashingFinder.CRASH_STAGE = stage
+                with self.assertRaises(Crash):
+                    CrashingFinder.find_duplicate(top, checkpoint=checkpoint)
+                self.assertEqual(checkpoint.load()['stage'], stage)
+                finder = DuplicateFinder.resume(checkpoint)
+                self.assertListEqual(self.duplicates(finder), [[b'x1', b'x2'], [b'y1', b'y2']])
+                self.assertFalse(checkpoint.exists())
+
+####################################################################################################
+
+if __name__ == '__main__':
+    unittest.main()
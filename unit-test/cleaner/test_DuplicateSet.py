@@ -145,6 +145,24 @@ class TestDuplicateSet(unittest.TestCase):
             _ = DuplicateSet((file1, file2, dupfile))
             self.assertFalse(_.check_is_duplicate())
 
+    ##############################################
+
+    def test_is_duplicate_group(self):
+        with TemporaryDirectory() as directory:
+            content1 = make_content1(100)
+            files = [directory.make_file(f'file{_}', content1)[0] for _ in range(3)]
+            dset = DuplicateSet(files)
+            self.assertTrue(dset.check_is_duplicate())
+            files.append(directory.make_file('other', content1[:-1] + b'x')[0])
+            dset = DuplicateSet(files)
+            self.assertFalse(dset.check_is_duplicate())
+            # the committed duplicates are not compared
+            for _ in dset:
+                if _.file is files[-1]:
+                    _.mark()
+            dset.commit()
+            self.assertTrue(dset.check_is_duplicate())
+
 ####################################################################################################
 
 if __name__ == '__main__':
@@ -0,0 +1,69 @@
+####################################################################################################
+#
+# filewalker -
+# Copyright (C) 2020 Fabrice Salvaire
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+####################################################################################################
+####################################################################################################
+
+import hashlib
+import unittest
+
+####################################################################################################
+
+from filewalker.common.hashing import (
+    IncompatibleHashBackend, backends, benchmark, check_backend, fastest_backend, get_backend,
+)
+
+####################################################################################################
+
+class TestHashing(unittest.TestCase):
+
+    ##############################################
+
+    def test_backends(self):
+        names = backends()
+        for name in ('sha1', 'sha256', 'blake2b'):
+            self.assertIn(name, names)
+            self.assertEqual(get_backend(name).hexdigest(b'hello'), hashlib.new(name, b'hello').hexdigest())
+        with self.assertRaises(ValueError):
+            get_backend('foo')
+
+    ##############################################
+
+    def test_benchmark(self):
+        throughputs = benchmark(['sha1', 'sha256'], size=1024, duration=.001)
+        self.assertListEqual(sorted(throughputs), ['sha1', 'sha256'])
+        self.assertTrue(all(_ > 0 for _ in throughputs.values()))
+        name = fastest_backend()
+        self.assertTrue(get_backend(name).cryptographic)
+        self.assertIs(get_backend('auto'), get_backend(name))
+        # any backend, e.g. xxhash if it is installed
+        self.assertIn(get_backend('auto-fast').name, backends())
+        self.assertEqual(fastest_backend(None), get_backend('auto-fast').name)
+
+    ##############################################
+
+    def test_check_backend(self):
+        check_backend('sha1', 'sha1')
+        check_backend(None, 'sha1')
+        with self.assertRaises(IncompatibleHashBackend):
+            check_backend('sha1', 'sha256')
+
+####################################################################################################
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+####################################################################################################
+#
+# filewalker -
+# Copyright (C) 2020 Fabrice Salvaire
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+####################################################################################################
+
+
+####################################################################################################
+
+import pickle
+import platform
+import time
+import unittest
+from unittest.mock import patch
+
+####################################################################################################
+
+from filewalker.common.throttle import AdaptiveThrottle, IoThrottle, TokenBucket
+
+####################################################################################################
+
+class TestThrottle(unittest.TestCase):
+
+    ##############################################
+
+    def test_token_bucket(self):
+        bucket = TokenBucket(rate=100, burst=1)
+        start = time.monotonic()
+        for _ in range(11):
+            bucket.consume()
+        self.assertGreaterEqual(time.monotonic() - start, .09)
+        # the bucket is in debt
+        self.assertGreater(bucket.reserve(10), .09)
+
+    ##############################################
+
+    def test_io_throttle(self):
+        throttle = IoThrottle(bytes_per_second=1000, devices={1: (10, None)})
+        start = time.monotonic()
+        # burst
+        throttle.read(1000)
+        throttle.metadata(10, device=2)
+        self.assertLess(time.monotonic() - start, .05)
+        throttle.read(100)
+        throttle.metadata(1, device=1)
+        throttle.metadata(1, device=1)
+        self.assertGreaterEqual(time.monotonic() - start, .1)
+
+    ##############################################
+
+    def test_adaptive_throttle(self):
+
+        class BusyThrottle(AdaptiveThrottle):
+            busy = True
+            def is_busy(self):
+                return self.busy
+
+        throttle = BusyThrottle(max_workers=8, interval=0, max_delay=.004)
+        for workers in (4, 2, 1, 1):
+            throttle.update()
+            self.assertEqual(throttle.allowed_workers, workers)
+        self.assertEqual(throttle.delay, .004)
+        self.assertEqual(throttle.max_workers(16), 1)
+        self.assertTrue(throttle.wait_worker(0, 16))
+        self.assertFalse(throttle.wait_worker(1, 16))
+        throttle.busy = False
+        throttle.update()
+        self.assertEqual(throttle.allowed_workers, 2)
+        self.assertEqual(throttle.delay, .002)
+
+    ##############################################
+
+    def test_io_priority(self):
+        # the ioprio_set syscall number is unknown
+        with patch.object(platform, 'machine', return_value='vax'), \
+             self.assertLogs('filewalker.common.throttle', 'WARNING') as logs:
+            throttle = AdaptiveThrottle(idle_io_priority=True)
+        self.assertIn('Cannot set the idle I/O priority', logs.output[0])
+        self.assertGreaterEqual(throttle.max_workers(1), 1)
+
+    ##############################################
+
+    def test_pickle(self):
+        throttle = AdaptiveThrottle(ops_per_second=100, bytes_per_second=1000, devices={1: (10, None)})
+        throttle = pickle.loads(pickle.dumps(throttle))
+        throttle.update()
+        throttle.metadata(1, device=1)
+        shard = throttle.split(4)
+        self.assertIsInstance(shard, AdaptiveThrottle)
+        self.assertEqual(shard._ops.rate, 25)
+        self.assertEqual(shard._bytes.rate, 250)
+        self.assertEqual(shard._devices[1][0].rate, 2.5)
+        self.assertIsNone(shard._devices[1][1])
+        self.assertEqual(throttle._ops.rate, 100)
+
+####################################################################################################
+
+if __name__ == '__main__':
+    unittest.main()
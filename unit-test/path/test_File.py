@@ -20,11 +20,15 @@
 
 ####################################################################################################
 
+import hashlib
+import os
 import unittest
+from unittest.mock import patch
 # from unittest import skip
 
 ####################################################################################################
 
+from filewalker.os import statx as _statx
 from filewalker.path.file import File
 from filewalker.unit_test.file import TemporaryDirectory, make_content1, make_content2
 
@@ -49,6 +53,44 @@ class TestFile(unittest.TestCase):
 
     ##############################################
 
+    def test_sha(self):
+        data = make_content1(1000)
+        with TemporaryDirectory() as directory:
+            file_obj, path = directory.make_file('test.txt', data)
+            # the last chunk is partial
+            for chunk_size in (7, len(data), File.CHUNK_SIZE):
+                with patch.object(File, 'CHUNK_SIZE', chunk_size):
+                    file_obj.vacuum()
+                    self.assertEqual(file_obj.sha, hashlib.sha1(data).hexdigest())
+                    for size in (1, 100, len(data) + 10):
+                        self.assertEqual(file_obj.partial_sha(size), hashlib.sha1(data[:size]).hexdigest())
+
+    ##############################################
+
+    def test_extract_features(self):
+        with TemporaryDirectory() as directory:
+            for size in (10, 100, 100 * 1000):
+                data = make_content1(size)
+                file_obj, path = directory.make_file(f'test-{size}', data)
+                some_bytes_size = File.SOME_BYTES_SIZE
+                with patch.object(File, 'CHUNK_SIZE', 4096), \
+                     patch.object(File, 'open', autospec=True, side_effect=File.open) as spy:
+                    file_obj.extract_features(first=True, last=True, partial=True, sha=True)
+                    self.assertEqual(spy.call_count, 1)
+                    # the features are cached
+                    self.assertEqual(file_obj.first_bytes(), data[:some_bytes_size])
+                    self.assertEqual(file_obj.last_bytes(), data[-some_bytes_size:])
+                    self.assertEqual(file_obj.partial_sha(), hashlib.sha1(data[:File.PARTIAL_SHA_BYTES]).hexdigest())
+                    self.assertEqual(file_obj.sha, hashlib.sha1(data).hexdigest())
+                    self.assertEqual(spy.call_count, 1)
+                    other = File.from_path(path)
+                    other.extract_features(first=True, partial=True)
+                    self.assertEqual(other.first_bytes(), data[:some_bytes_size])
+                    self.assertEqual(other.partial_sha(), file_obj.partial_sha())
+                    self.assertTrue(file_obj.is_identical_to(other))
+
+    ##############################################
+
     def test_rename(self):
         with TemporaryDirectory() as directory:
             filename = "test.txt"
@@ -89,6 +131,54 @@ class TestFile(unittest.TestCase):
                 self.assertFalse(file1.compare_with(file2, posix=posix))
                 self.assertTrue(file1.compare_with(dupfile, posix=posix))
 
+    ##############################################
+
+    def test_statx(self):
+        with TemporaryDirectory() as directory:
+            file_obj, path = directory.make_file('test.txt', 'hello' * 100)
+            stat_result = os.lstat(path)
+            File.USE_STATX = True
+            try:
+                file_obj = File.from_path(path)
+                self.assertEqual(file_obj.size, stat_result.st_size)
+                self.assertEqual(file_obj.inode, stat_result.st_ino)
+                self.assertEqual(file_obj.device, stat_result.st_dev)
+                self.assertTrue(file_obj._stat.has(_statx.STATX_SIZE | _statx.STATX_INO))
+                # the missing fields are fetched on demand
+                self.assertEqual(file_obj.mtime, stat_result.st_mtime_ns)
+                self.assertEqual(file_obj.allocated_size, stat_result.st_blocks * 512)
+                self.assertFalse(file_obj.is_symlink)
+                self.assertTrue(file_obj._stat.has(_statx.STATX_SIZE | _statx.STATX_MTIME))
+
+                # a file system which doesn't report the number of links and the birth time
+                def statx(path, mask, flags):
+                    buffer = _statx._Statx()
+                    buffer.stx_mask = mask & ~(_statx.STATX_NLINK | _statx.STATX_BTIME)
+                    buffer.stx_size = stat_result.st_size
+                    return _statx.StatxResult(buffer, mask)
+
+                with patch.object(_statx, 'statx', side_effect=statx) as spy:
+                    file_obj = File.from_path(path)
+                    file_obj.fetch_stat(_statx.STATX_SIZE | _statx.STATX_BTIME)
+                    self.assertEqual(file_obj.size, stat_result.st_size)
+                    with self.assertRaisesRegex(AttributeError, 'st_birthtime_ns is not returned'):
+                        file_obj._stat.st_birthtime_ns
+                    # a requested field is not requested again
+                    file_obj.fetch_stat(_statx.STATX_BTIME)
+                    self.assertEqual(spy.call_count, 1)
+                    # the missing basic fields are filled by lstat
+                    self.assertEqual(file_obj.fetch_stat(_statx.STATX_NLINK).st_nlink, stat_result.st_nlink)
+                    self.assertIsInstance(file_obj._stat, os.stat_result)
+                    self.assertEqual(spy.call_count, 2)
+
+                # statx is not available
+                with patch.object(_statx, '_statx', False):
+                    file_obj = File.from_path(path)
+                    self.assertEqual(file_obj.size, stat_result.st_size)
+                    self.assertIsInstance(file_obj._stat, os.stat_result)
+            finally:
+                File.USE_STATX = False
+
 ####################################################################################################
 
 if __name__ == '__main__':
@@ -0,0 +1,85 @@
+####################################################################################################
+#
+# filewalker -
+# Copyright (C) 2020 Fabrice Salvaire
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+####################################################################################################
+####################################################################################################
+
+import os
+import shutil
+import unittest
+
+####################################################################################################
+
+from filewalker.path.cache import DirectoryCache
+from filewalker.unit_test.file import TemporaryDirectory
+
+from test_walker import Collector, make_tree
+
+####################################################################################################
+
+class TestDirectoryCache(unittest.TestCase):
+
+    ##############################################
+
+    def walk(self, directory, cache_path):
+        cache = DirectoryCache.load(cache_path)
+        walker = Collector(directory.joinpath(''))
+        walker.run(cache=cache)
+        cache.save()
+        names = sorted(_.name for _ in walker.files)
+        sizes = sorted(_.size for _ in walker.files)
+        return cache, names, sizes
+
+    ##############################################
+
+    def test_cache(self):
+        with TemporaryDirectory() as directory, TemporaryDirectory() as cache_directory:
+            make_tree(directory)
+            top = os.fsencode(directory.joinpath(''))
+            cache_path = cache_directory.joinpath('walk.cache')
+
+            cache, names, sizes = self.walk(directory, cache_path)
+            self.assertEqual(cache.reused, 0)
+            self.assertListEqual(cache.revisited_subtrees(), [top])
+            self.assertListEqual(names, [b'f1', b'f2', b'f3', b'f4'])
+
+            # nothing changed
+            cache, names2, sizes2 = self.walk(directory, cache_path)
+            self.assertEqual(cache.reused, 4)
+            self.assertListEqual(cache.revisited, [])
+            self.assertListEqual(names2, names)
+            self.assertListEqual(sizes2, sizes)
+
+            # a file modified in place doesn't change its directory
+            directory.make_file('a/f2', 'a longer content')
+            cache, names2, sizes2 = self.walk(directory, cache_path)
+            self.assertEqual(cache.reused, 4)
+            self.assertIn(len('a longer content'), sizes2)
+
+            # a new file in a/b, a removed subtree
+            directory.make_file('a/b/f5', 'f5')
+            shutil.rmtree(directory.joinpath('c'))
+            cache, names, sizes = self.walk(directory, cache_path)
+            self.assertListEqual(cache.revisited_subtrees(), [top, os.path.join(top, b'a', b'b')])
+            self.assertListEqual(names, [b'f1', b'f2', b'f3', b'f5'])
+            self.assertNotIn(os.path.join(top, b'c'), DirectoryCache.load(cache_path))
+
+####################################################################################################
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+####################################################################################################
+#
+# filewalker -
+# Copyright (C) 2020 Fabrice Salvaire
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+####################################################################################################
+####################################################################################################
+
+import os
+import unittest
+from unittest.mock import patch
+
+####################################################################################################
+
+from filewalker.path.compare import FileComparer
+from filewalker.unit_test.file import TemporaryDirectory
+
+####################################################################################################
+
+class TestFileComparer(unittest.TestCase):
+
+    ##############################################
+
+    def test_compare(self):
+        size = 5 * 4096 + 100
+        data = os.urandom(size)
+        with TemporaryDirectory() as directory:
+            reference, _ = directory.make_file('reference', data)
+            same, _ = directory.make_file('same', data)
+            # a difference in the first byte, a window boundary and the last byte
+            others = []
+            for position in (0, 2 * 4096, size - 1):
+                other = bytearray(data)
+                other[position] ^= 0xff
+                others.append(directory.make_file(f'other-{position}', bytes(other))[0])
+            shorter, _ = directory.make_file('shorter', data[:-1])
+            empty1, _ = directory.make_file('empty1', b'')
+            empty2, _ = directory.make_file('empty2', b'')
+            for use_mmap in (True, False):
+                comparer = FileComparer(use_mmap=use_mmap)
+                with patch.object(FileComparer, 'WINDOW_SIZE', 2 * 4096), \
+                     patch.object(FileComparer, 'BUFFER_SIZE', 4096):
+                    self.assertTrue(comparer.compare(reference, same))
+                    for other in others:
+                        self.assertFalse(comparer.compare(reference, other))
+                        # cmp agrees
+                        self.assertFalse(reference.compare_with(other, posix=True))
+                    self.assertFalse(comparer.compare(reference, shorter))
+                    self.assertTrue(comparer.compare(empty1, empty2))
+            # default mode
+            self.assertTrue(reference.compare_with(same))
+            self.assertFalse(reference.compare_with(others[0]))
+
+    ##############################################
+
+    def test_partition(self):
+        chunk_size = 4096
+        size = 4 * chunk_size
+        data = os.urandom(size)
+
+        class ReadCounter:
+            def __init__(self):
+                self.count = 0
+            def metadata(self, count=1, device=None):
+                pass
+            def read(self, size, device=None):
+                self.count += size
+
+        with TemporaryDirectory() as directory:
+            files = [directory.make_file(f'same-{_}', data)[0] for _ in range(3)]
+            contents = {}
+            # a pair which diverges in the third chunk, a file which differs at the first byte
+            for name, position in (('other-1', 2 * chunk_size + 10), ('other-2', 2 * chunk_size + 10), ('first', 0)):
+                content = bytearray(data)
+                content[position] ^= 0xff
+                contents[name] = bytes(content)
+                files.append(directory.make_file(name, contents[name])[0])
+            files.append(directory.make_file('shorter', data[:-1])[0])
+            comparer = FileComparer()
+            counter = ReadCounter()
+            with patch.object(FileComparer, 'BUFFER_SIZE', chunk_size), \
+                 patch.object(files[0].__class__, 'THROTTLE', counter):
+                partitions = comparer.partition(files)
+            names = sorted(sorted(file_obj.name for file_obj in _) for _ in partitions)
+            self.assertListEqual(names, [
+                [b'first'], [b'other-1', b'other-2'], [b'same-0', b'same-1', b'same-2'], [b'shorter'],
+            ])
+            # each byte is read once, the file which differs at the first byte is dropped after a chunk
+            self.assertEqual(counter.count, 5 * size + chunk_size)
+            # the files beyond the limit are compared with the partitions
+            with patch.object(FileComparer, 'MAX_OPEN_FILES', 2):
+                partitions = comparer.partition(files)
+            self.assertEqual(sorted(len(_) for _ in partitions), [1, 1, 2, 3])
+
+####################################################################################################
+
+if __name__ == '__main__':
+    unittest.main()
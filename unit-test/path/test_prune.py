@@ -0,0 +1,111 @@
+####################################################################################################
+#
+# filewalker -
+# Copyright (C) 2020 Fabrice Salvaire
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+####################################################################################################
+
+
+####################################################################################################
+
+import os
+import unittest
+from unittest.mock import patch
+
+####################################################################################################
+
+from filewalker.os.linux import MountPoint, MountPoints
+from filewalker.path.prune import PruneConfig
+from filewalker.path.walker import WalkerAbc
+from filewalker.unit_test.file import TemporaryDirectory
+
+####################################################################################################
+
+UPDATEDB_CONF = '''
+# comment
+PRUNE_BIND_MOUNTS = "yes"
+PRUNEFS = "NFS proc"   # comment
+PRUNENAMES = ".git .snapshots"
+PRUNEPATHS = "/tmp /var/spool"
+'''
+
+MOUNTINFO = '''\
+22 1 8:1 / / rw,relatime - ext4 /dev/sda1 rw
+23 22 8:1 /srv /mnt/srv rw,relatime - ext4 /dev/sda1 rw
+24 22 8:2 / /home rw,relatime - ext4 /dev/sda2 rw
+25 22 8:2 / /mnt/home rw,relatime - ext4 /dev/sda2 rw
+26 22 0:30 /@data /data rw,relatime - btrfs /dev/sdb1 rw
+27 22 0:30 /@backup /backup rw,relatime - btrfs /dev/sdb1 rw
+28 22 0:30 /@data /mnt/data rw,relatime - btrfs /dev/sdb1 rw
+29 22 0:30 /@data/alice /mnt/alice rw,relatime - btrfs /dev/sdb1 rw
+30 22 0:30 /@database /database rw,relatime - btrfs /dev/sdb1 rw
+'''
+
+####################################################################################################
+
+class TestPruneConfig(unittest.TestCase):
+
+    ##############################################
+
+    def test_parse(self):
+        variables = PruneConfig.parse_updatedb_conf(UPDATEDB_CONF)
+        self.assertEqual(variables['PRUNE_BIND_MOUNTS'], 'yes')
+        self.assertEqual(variables['PRUNEFS'], 'NFS proc')
+        self.assertEqual(variables['PRUNEPATHS'], '/tmp /var/spool')
+        with self.assertRaises(ValueError):
+            PruneConfig.parse_updatedb_conf('PRUNEFS = nfs')
+
+    ##############################################
+
+    def test_bind_mounts(self):
+        with TemporaryDirectory() as directory:
+            _, path = directory.make_file('mountinfo', MOUNTINFO)
+            with patch.object(MountPoints, 'PROC_MOUNTINFO', str(path)):
+                mount_points = MountPoints()
+            binds = sorted(_.mount_point for _ in mount_points if _.is_bind)
+            self.assertListEqual(binds, ['/mnt/alice', '/mnt/data', '/mnt/home', '/mnt/srv'])
+
+    ##############################################
+
+    def test_walk(self):
+        with TemporaryDirectory() as directory:
+            for _ in ('a', 'a/.git', 'b', 'c', 'd', 'e'):
+                directory.joinpath(_).mkdir()
+            for _ in ('f1', 'a/f2', 'a/.git/f3', 'b/f4', 'c/f5', 'd/f6', 'e/f7'):
+                directory.make_file(_, _)
+            directory.make_file('e/CACHEDIR.TAG', 'Signature: 8a477f597d28d172789f06886806bc55')
+            mount_points = [
+                MountPoint(str(directory.joinpath('c')), 'none', 'proc'),
+                MountPoint(str(directory.joinpath('d')), '/dev/sda1', 'ext4', '/d', is_bind=True),
+            ]
+            prune_config = PruneConfig(
+                prune_fs=('PROC',),
+                prune_paths=(str(directory.joinpath('b')) + '/',),
+                prune_names=('.git',),
+                prune_bind_mounts=True,
+                cachedir_tag=True,
+                mount_points=mount_points,
+            )
+            self.assertTrue(prune_config.is_pruned(os.fsencode(directory.joinpath('c')), b'c'))
+            walker = WalkerAbc(directory.joinpath(''))
+            for workers in (1, 2):
+                names = sorted(_.name for _ in walker.iter_files(prune_config=prune_config, workers=workers))
+                self.assertListEqual(names, [b'f1', b'f2'])
+
+####################################################################################################
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,498 @@
+####################################################################################################
+#
+# filewalker -
+# Copyright (C) 2020 Fabrice Salvaire
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+####################################################################################################
+
+
+####################################################################################################
+
+from collections import Counter
+from itertools import islice
+import asyncio
+import contextlib
+import os
+import pickle
+import platform
+import threading
+import unittest
+from unittest.mock import patch
+
+####################################################################################################
+
+from filewalker.common.throttle import IoThrottle
+from filewalker.os.dirfd import DirectoryHandles
+from filewalker.path.file import File
+from filewalker.path.parallel import WorkStealingQueue
+from filewalker.path.walker import WalkerAbc
+from filewalker.unit_test.file import TemporaryDirectory
+
+####################################################################################################
+
+class Collector(WalkerAbc):
+
+    ##############################################
+
+    def __init__(self, path) -> None:
+        super().__init__(path)
+        self.directories = []
+        self.files = []
+
+    ##############################################
+
+    def on_directory(self, dirpath: bytes, entry: os.DirEntry) -> None:
+        self.directories.append(os.path.join(dirpath, entry.name))
+
+    ##############################################
+
+    def on_filename(self, dirpath: bytes, entry: os.DirEntry) -> None:
+        self.files.append(File.from_dir_entry(dirpath, entry))
+
+####################################################################################################
+
+class ThreadSafeCollector(Collector):
+
+    ##############################################
+
+    def __init__(self, path) -> None:
+        super().__init__(path)
+        self._lock = threading.Lock()
+
+    ##############################################
+
+    def on_directory(self, dirpath: bytes, entry: os.DirEntry) -> None:
+        with self._lock:
+            super().on_directory(dirpath, entry)
+
+    ##############################################
+
+    def on_filename(self, dirpath: bytes, entry: os.DirEntry) -> None:
+        with self._lock:
+            super().on_filename(dirpath, entry)
+
+####################################################################################################
+
+class PruningCollector(Collector):
+
+    ##############################################
+
+    def on_directory(self, dirpath: bytes, entry: os.DirEntry) -> bool:
+        super().on_directory(dirpath, entry)
+        return entry.name != b'a'
+
+####################################################################################################
+
+class OtherDeviceCollector(Collector):
+
+    ##############################################
+
+    def __init__(self, path) -> None:
+        super().__init__(path)
+        self.mount_points = []
+
+    ##############################################
+
+    def _make_options(self, kwargs):
+        options = super()._make_options(kwargs)
+        # pretend the top directory is on another device
+        options.device = -1
+        return options
+
+    ##############################################
+
+    def on_skipped_mount_point(self, path: bytes, mount_point) -> None:
+        self.mount_points.append(os.path.basename(path))
+
+####################################################################################################
+
+class SizeCounter(WalkerAbc):
+
+    ##############################################
+
+    def __init__(self, path) -> None:
+        super().__init__(path)
+        self.init_shard()
+
+    ##############################################
+
+    def init_shard(self) -> None:
+        self.counter = Counter()
+
+    ##############################################
+
+    def on_filename(self, dirpath: bytes, entry: os.DirEntry) -> None:
+        self.counter[entry.name] += entry.stat(follow_symlinks=False).st_size
+
+    ##############################################
+
+    def shard_result(self) -> Counter:
+        return self.counter
+
+    ##############################################
+
+    def merge_shard_result(self, result: Counter) -> None:
+        self.counter += result
+
+####################################################################################################
+
+def make_tree(directory) -> None:
+    for _ in ('a', 'a/b', 'c'):
+        directory.joinpath(_).mkdir()
+    for _ in ('f1', 'a/f2', 'a/b/f3', 'c/f4'):
+        directory.make_file(_, os.path.basename(_))
+    os.symlink(directory.joinpath('a'), directory.joinpath('link'))
+
+####################################################################################################
+
+class TestWalker(unittest.TestCase):
+
+    ##############################################
+
+    def test_run(self):
+        with TemporaryDirectory() as directory:
+            make_tree(directory)
+            for top_down in (True, False):
+                walker = Collector(directory.joinpath(''))
+                walker.run(top_down=top_down, sort=True)
+                names = sorted(_.name for _ in walker.files)
+                self.assertListEqual(names, [b'f1', b'f2', b'f3', b'f4'])
+                # symlink to a directory is reported but not followed
+                self.assertEqual(len(walker.directories), 4)
+                for file_obj in walker.files:
+                    # stat is filled by the DirEntry
+                    self.assertIsNotNone(file_obj._stat)
+                    self.assertFalse(file_obj.is_symlink)
+                    self.assertEqual(file_obj.size, len(file_obj.name))
+
+    ##############################################
+
+    def test_depth(self):
+        with TemporaryDirectory() as directory:
+            make_tree(directory)
+            walker = WalkerAbc(directory.joinpath(''))
+            for max_depth, expected in (
+                    (0, [b'f1']),
+                    (1, [b'f1', b'f2', b'f4']),
+                    (2, [b'f1', b'f2', b'f3', b'f4']),
+            ):
+                for workers in (1, 2):
+                    for top_down in (True, False):
+                        entries = walker.iter_files(max_depth=max_depth, top_down=top_down, workers=workers)
+                        names = sorted(_.name for _ in entries)
+                        self.assertListEqual(names, expected)
+
+    ##############################################
+
+    def test_prune(self):
+        with TemporaryDirectory() as directory:
+            make_tree(directory)
+            walker = WalkerAbc(directory.joinpath(''))
+            listed = []
+            list_directory = walker._list_directory
+
+            def spy(dirpath, *args):
+                listed.append(os.path.basename(dirpath))
+                return list_directory(dirpath, *args)
+
+            walker._list_directory = spy
+
+            def prune(dirpath, entry, depth):
+                return entry.name == b'a' and depth == 1
+
+            for workers in (1, 2):
+                listed.clear()
+                names = sorted(_.name for _ in walker.iter_files(prune=prune, workers=workers))
+                self.assertListEqual(names, [b'f1', b'f4'])
+                # pruned directories are never listed
+                self.assertNotIn(b'a', listed)
+                self.assertNotIn(b'b', listed)
+
+            # on_directory returns False
+            walker = PruningCollector(directory.joinpath(''))
+            walker.run(top_down=True)
+            self.assertListEqual(sorted(_.name for _ in walker.files), [b'f1', b'f4'])
+
+    ##############################################
+
+    def test_one_file_system(self):
+        with TemporaryDirectory() as directory:
+            make_tree(directory)
+            walker = Collector(directory.joinpath(''))
+            walker.run(one_file_system=True)
+            self.assertEqual(len(walker.files), 4)
+            walker = OtherDeviceCollector(directory.joinpath(''))
+            walker.run(one_file_system=True, sort=True)
+            self.assertListEqual([_.name for _ in walker.files], [b'f1'])
+            self.assertListEqual(walker.mount_points, [b'a', b'c'])
+
+    ##############################################
+
+    def test_iter(self):
+        with TemporaryDirectory() as directory:
+            make_tree(directory)
+            walker = WalkerAbc(directory.joinpath(''))
+            names = sorted(_.name for _ in walker.iter_files())
+            self.assertListEqual(names, [b'f1', b'f2', b'f3', b'f4'])
+            names = [_.name for _ in walker.iter_dirs(sort=True)]
+            self.assertListEqual(names, [b'a', b'c', b'link', b'b'])
+            # lazy
+            entries = walker.iter_files(sort=True)
+            self.assertListEqual([_.name for _ in islice(entries, 2)], [b'f1', b'f2'])
+
+    ##############################################
+
+    def test_parallel(self):
+        with TemporaryDirectory() as directory:
+            make_tree(directory)
+            for cls, serialize in ((Collector, True), (ThreadSafeCollector, False)):
+                walker = cls(directory.joinpath(''))
+                walker.run(workers=3, serialize=serialize, prefetch_stat=True)
+                names = sorted(_.name for _ in walker.files)
+                self.assertListEqual(names, [b'f1', b'f2', b'f3', b'f4'])
+                self.assertEqual(len(walker.directories), 4)
+
+    ##############################################
+
+    def test_parallel_order(self):
+        with TemporaryDirectory() as directory:
+            for i in range(8):
+                for j in range(4):
+                    directory.joinpath(f'd{i}/d{j}/d').mkdir(parents=True)
+            walker = WalkerAbc(directory.joinpath(''))
+            yielded = set()
+            for dirpath, _, _ in walker.walk(workers=4):
+                if dirpath != os.fsencode(walker.path):
+                    # a directory is yielded before its subdirectories
+                    self.assertIn(os.path.dirname(dirpath), yielded)
+                yielded.add(dirpath)
+            self.assertEqual(len(yielded), 1 + 8 * (1 + 4 * 2))
+
+    ##############################################
+
+    def test_large_directory(self):
+        with TemporaryDirectory() as directory:
+            make_tree(directory)
+            big = directory.joinpath('big')
+            big.mkdir()
+            for i in range(100):
+                big.joinpath(f'file{i:03}').touch()
+            big.joinpath('sub').mkdir()
+            top = directory.joinpath('')
+            walker = Collector(top)
+            steps = [_ for _ in walker.walk(top_down=False, large_directory=0, dirent_buffer_size=1024)
+                     if _[0].endswith(b'big')]
+            self.assertGreater(len(steps), 2)
+            # the subdirectories are in the last step
+            self.assertListEqual([_.name for _ in steps[-1][1]], [b'sub'])
+            self.assertEqual(sum(len(_[2]) for _ in steps), 100)
+            for workers in (1, 2):
+                walker = Collector(top)
+                walker.run(workers=workers, large_directory=0, dirent_buffer_size=1024, prefetch_stat=True)
+                self.assertEqual(len(walker.files), 104)
+                self.assertEqual(len(walker.directories), 6)
+            # the getdents64 syscall number is unknown, the directories are listed by scandir
+            with patch.object(platform, 'machine', return_value='vax'):
+                for kwargs in (dict(large_directory=0), dict(dir_fds=4)):
+                    walker = Collector(top)
+                    walker.run(**kwargs)
+                    self.assertEqual(len(walker.files), 104)
+                    self.assertEqual(len(walker.directories), 6)
+
+    ##############################################
+
+    def test_inode_order(self):
+        with TemporaryDirectory() as directory:
+            make_tree(directory)
+            for _ in range(10):
+                directory.joinpath(f'd{_}').mkdir()
+            top = directory.joinpath('')
+            for inode_order in (True, [top], 'auto'):
+                walker = Collector(top)
+                steps = list(walker.walk(top_down=True, inode_order=inode_order))
+                self.assertEqual(sum(len(_[2]) for _ in steps), 4)
+                if inode_order == 'auto':
+                    # depends on the disk
+                    continue
+                directories, files = steps[0][1:]
+                for entries in (directories, files):
+                    inodes = [_.inode() for _ in entries]
+                    self.assertListEqual(inodes, sorted(inodes))
+                # depth first in inode order
+                first = [_.name for _ in directories if not _.is_symlink()][0]
+                self.assertEqual(steps[1][0], os.path.join(os.fsencode(top), first))
+
+    ##############################################
+
+    def test_dir_fds(self):
+        with TemporaryDirectory() as directory:
+            make_tree(directory)
+            for workers in (1, 2):
+                walker = Collector(directory.joinpath(''))
+                # less descriptors than directories
+                walker.run(top_down=True, follow_links=True, workers=workers, dir_fds=1)
+                names = sorted(_.name for _ in walker.files)
+                self.assertListEqual(names, [b'f1', b'f2', b'f3', b'f4'])
+                for file_obj in walker.files:
+                    self.assertIsNotNone(file_obj.handle)
+                    self.assertEqual(file_obj.handle.path, file_obj.parent)
+                    self.assertFalse(file_obj.handle.live)
+                    # the descriptors are closed at the end of the walk, the directories are not
+                    # reopened for a single call
+                    with patch.object(os, 'open', wraps=os.open) as os_open:
+                        self.assertEqual(file_obj.size, len(file_obj.name))
+                        file_obj.vacuum()
+                        self.assertEqual(file_obj.stat.st_size, len(file_obj.name))
+                        self.assertEqual(file_obj.first_bytes(), file_obj.name)
+                    os_open.assert_not_called()
+                    self.assertIsNone(file_obj.handle)
+                # a descriptor is bound to the process
+                file_obj = pickle.loads(pickle.dumps(walker.files[0]))
+                self.assertIsNone(file_obj.handle)
+                self.assertEqual(file_obj.first_bytes(), file_obj.name)
+
+    ##############################################
+
+    def test_directory_handles(self):
+        with TemporaryDirectory() as directory:
+            make_tree(directory)
+            top = os.fsencode(directory.joinpath(''))
+            handles = DirectoryHandles(2)
+            handle = handles.get(os.path.join(top, b'a'))
+            self.assertEqual(handle.lstat(b'f2').st_size, 2)
+            self.assertEqual(len(handles), 1)
+            # a pinned descriptor is closed when it is released
+            handle.acquire()
+            handles.close()
+            self.assertEqual(len(handles), 1)
+            handle.release()
+            self.assertEqual(len(handles), 0)
+            # after the close, a descriptor is only opened for the duration of a call
+            fds = len(os.listdir('/proc/self/fd'))
+            self.assertEqual(handle.lstat(b'f2').st_size, 2)
+            self.assertIsNone(handle.fd)
+            self.assertEqual(len(handles), 0)
+            self.assertEqual(len(os.listdir('/proc/self/fd')), fds)
+
+    ##############################################
+
+    def test_follow_links(self):
+        with TemporaryDirectory() as directory:
+            make_tree(directory)
+            os.symlink('..', directory.joinpath('a/b/up'))
+            os.symlink(directory.joinpath('c'), directory.joinpath('a/c_link'))
+            duplicates = []
+
+            class LoopCollector(Collector):
+                def on_duplicate_directory(self, path, is_cycle):
+                    duplicates.append((os.path.basename(path), is_cycle))
+
+            for workers in (1, 2):
+                duplicates.clear()
+                walker = LoopCollector(directory.joinpath(''))
+                walker.run(top_down=True, follow_links=True, workers=workers)
+                # each real directory is walked once
+                names = sorted(_.name for _ in walker.files)
+                self.assertListEqual(names, [b'f1', b'f2', b'f3', b'f4'])
+                self.assertEqual(len(duplicates), 3)
+                self.assertIn((b'up', True), duplicates)
+
+    ##############################################
+
+    def test_roots(self):
+        with TemporaryDirectory() as directory:
+            make_tree(directory)
+            roots = [directory.joinpath(_) for _ in ('a/b', '', 'c', '')]
+            for workers in (1, 2):
+                walker = Collector(roots)
+                walker.run(workers=workers)
+                # nested and duplicated roots are walked once
+                names = sorted(_.name for _ in walker.files)
+                self.assertListEqual(names, [b'f1', b'f2', b'f3', b'f4'])
+                locations = {_.name: walker.locate(_.parent) for _ in walker.files}
+                self.assertDictEqual(locations, {b'f3': (0, 0), b'f1': (1, 0), b'f2': (1, 1), b'f4': (1, 1)})
+
+    ##############################################
+
+    def test_run_sharded(self):
+        with TemporaryDirectory() as directory:
+            make_tree(directory)
+            walker = SizeCounter(directory.joinpath(''))
+            walker.run_sharded(processes=2)
+            self.assertDictEqual(dict(walker.counter), {b'f1': 2, b'f2': 2, b'f3': 2, b'f4': 2})
+            # the throttle is split between the processes
+            walker = SizeCounter(directory.joinpath(''))
+            walker.run_sharded(processes=2, throttle=IoThrottle(ops_per_second=10000))
+            self.assertDictEqual(dict(walker.counter), {b'f1': 2, b'f2': 2, b'f3': 2, b'f4': 2})
+
+    ##############################################
+
+    def test_aiter(self):
+        async def collect(walker, **kwargs):
+            entries = []
+            async for entry in walker.aiter(**kwargs):
+                # slow consumer
+                await asyncio.sleep(0)
+                entries.append(entry.name)
+            return sorted(entries)
+
+        with TemporaryDirectory() as directory:
+            make_tree(directory)
+            walker = WalkerAbc(directory.joinpath(''))
+            names = asyncio.run(collect(walker, workers=2, queue_size=1))
+            self.assertListEqual(names, [b'f1', b'f2', b'f3', b'f4'])
+            names = asyncio.run(collect(walker, files=False, directories=True))
+            self.assertListEqual(names, [b'a', b'b', b'c', b'link'])
+
+    ##############################################
+
+    def test_aiter_break(self):
+        async def first(walker, **kwargs):
+            async with contextlib.aclosing(walker.aiter(**kwargs)) as entries:
+                async for entry in entries:
+                    return entry.name
+
+        with TemporaryDirectory() as directory:
+            make_tree(directory)
+            for i in range(10):
+                directory.make_file(f'f{i + 10}', 'x')
+            walker = WalkerAbc(directory.joinpath(''))
+            fds = len(os.listdir('/proc/self/fd'))
+            # the producer is blocked on the full queue when the consumer stops
+            coroutine = first(walker, workers=2, queue_size=1, dir_fds=4, follow_links=True)
+            name = asyncio.run(asyncio.wait_for(coroutine, timeout=10))
+            self.assertTrue(name.startswith(b'f'))
+            # the directory descriptors are closed
+            self.assertEqual(len(os.listdir('/proc/self/fd')), fds)
+
+    ##############################################
+
+    def test_work_stealing_queue(self):
+        work_queue = WorkStealingQueue(2)
+        for _ in range(3):
+            work_queue.put(0, _)
+        # owner pops the newest item, thief steals the oldest
+        self.assertEqual(work_queue.get(0), 2)
+        self.assertEqual(work_queue.get(1), 0)
+        self.assertEqual(work_queue.get(1), 1)
+        for _ in range(3):
+            work_queue.task_done()
+        self.assertIs(work_queue.get(1), WorkStealingQueue.DONE)
+
+####################################################################################################
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,138 @@
+####################################################################################################
+#
+# filewalker -
+# Copyright (C) 2020 Fabrice Salvaire
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+####################################################################################################
+####################################################################################################
+
+import os
+import shutil
+import time
+import unittest
+from unittest.mock import patch
+
+####################################################################################################
+
+from filewalker.os.inotify import IN_Q_OVERFLOW, InotifyEvent
+from filewalker.path.prune import PruneConfig
+from filewalker.path.watcher import FileIndex
+from filewalker.unit_test.file import TemporaryDirectory
+
+from test_walker import make_tree
+
+####################################################################################################
+
+class TestFileIndex(unittest.TestCase):
+
+    ##############################################
+
+    def names(self, index):
+        top = os.fsencode(index.path)
+        return sorted(os.path.relpath(_.path_bytes, top) for _ in index.files())
+
+    ##############################################
+
+    def process_events(self, index):
+        while index.process_events(timeout=.1):
+            pass
+
+    ##############################################
+
+    def test_index(self):
+        with TemporaryDirectory() as directory:
+            make_tree(directory)
+            with FileIndex(directory.joinpath('')) as index:
+                index.scan()
+                self.assertListEqual(self.names(index), [b'a/b/f3', b'a/f2', b'c/f4', b'f1', b'link'])
+                self.assertEqual(len(index.directories()), 4)
+
+                directory.make_file('a/f5', 'f5')
+                os.mkdir(directory.joinpath('d'))
+                directory.make_file('d/f6', 'f6')
+                os.remove(directory.joinpath('f1'))
+                shutil.rmtree(directory.joinpath('c'))
+                self.process_events(index)
+                self.assertListEqual(self.names(index), [b'a/b/f3', b'a/f2', b'a/f5', b'd/f6', b'link'])
+
+                # rename a directory
+                os.rename(directory.joinpath('a'), directory.joinpath('e'))
+                with open(directory.joinpath('e/b/f3'), 'a') as fh:
+                    fh.write('123')
+                self.process_events(index)
+                self.assertListEqual(self.names(index), [b'd/f6', b'e/b/f3', b'e/f2', b'e/f5', b'link'])
+                self.assertEqual(index.get(directory.joinpath('e/b/f3')).size, 5)
+
+                index.rescan()
+                self.assertListEqual(self.names(index), [b'd/f6', b'e/b/f3', b'e/f2', b'e/f5', b'link'])
+                self.assertListEqual(
+                    [os.path.relpath(_, os.fsencode(index.path)) for _ in index.directories()],
+                    [b'.', b'd', b'e', b'e/b'],
+                )
+
+    ##############################################
+
+    def test_prune(self):
+        with TemporaryDirectory() as directory:
+            make_tree(directory)
+            prune_config = PruneConfig(prune_names=('b', '.git'))
+            with FileIndex(directory.joinpath(''), prune_config=prune_config) as index:
+                index.scan()
+                self.assertListEqual(self.names(index), [b'a/f2', b'c/f4', b'f1', b'link'])
+                # the pruned directories are not watched
+                self.assertEqual(len(index.directories()), 3)
+                directory.make_file('a/b/f5', 'f5')
+                os.mkdir(directory.joinpath('a/.git'))
+                directory.make_file('a/.git/f6', 'f6')
+                os.mkdir(directory.joinpath('d'))
+                directory.make_file('d/f7', 'f7')
+                self.process_events(index)
+                self.assertListEqual(self.names(index), [b'a/f2', b'c/f4', b'd/f7', b'f1', b'link'])
+                self.assertEqual(len(index.directories()), 4)
+
+    ##############################################
+
+    def test_overflow(self):
+        with TemporaryDirectory() as directory:
+            make_tree(directory)
+            with FileIndex(directory.joinpath('')) as index, \
+                 patch.object(FileIndex, 'RACY_DELAY', 0):
+                index.scan()
+                # the applied events update the key of the directory
+                directory.make_file('a/f6', 'f6')
+                self.process_events(index)
+                # exceed the timestamp granularity
+                time.sleep(.1)
+                with open(directory.joinpath('a/b/f3'), 'a') as fh:
+                    fh.write('123')
+                directory.make_file('c/f5', 'f5')
+                # lose the events
+                while index._inotify.read_events(timeout=.1):
+                    pass
+                overflow = [InotifyEvent(-1, IN_Q_OVERFLOW, 0, b'')]
+                with patch.object(index._inotify, 'read_events', return_value=overflow), \
+                     patch.object(index, 'rescan', wraps=index.rescan) as rescan:
+                    index.process_events()
+                # only the changed directory is rescanned
+                rescan.assert_called_once_with(os.fsencode(directory.joinpath('c')))
+                self.assertEqual(index.overflow_count, 1)
+                self.assertListEqual(self.names(index), [b'a/b/f3', b'a/f2', b'a/f6', b'c/f4', b'c/f5', b'f1', b'link'])
+                self.assertEqual(index.get(directory.joinpath('a/b/f3')).size, 5)
+
+####################################################################################################
+
+if __name__ == '__main__':
+    unittest.main()